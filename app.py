@@ -1,12 +1,42 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, g, has_request_context, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_sqlalchemy import SQLAlchemy
-from flask_jwt_extended import JWTManager, jwt_required, create_access_token, get_jwt_identity
+from flask_sqlalchemy.pagination import Pagination
+from flask_jwt_extended import JWTManager, jwt_required, create_access_token, get_jwt, get_jwt_identity
+from werkzeug.exceptions import HTTPException, MethodNotAllowed
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime, timedelta
+from sqlalchemy import event, func, insert, inspect, select, text, update
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import validates
+from datetime import datetime, timedelta, timezone
+from collections import OrderedDict, namedtuple
+from functools import wraps
+from operator import attrgetter
+import base64
+import bisect
+import csv
+import hashlib
+import io
+import json
+import logging
 import os
 import re
+import threading
+import time
+import zlib
+import numpy as np
 from config import config
 
+try:
+    import orjson
+except ImportError:  # pragma: no cover - o provedor volta para o json da biblioteca padrão
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - sem brotli, as respostas são comprimidas só com gzip
+    brotli = None
+
 # Configuração da aplicação Flask
 app = Flask(__name__)
 
@@ -14,15 +44,186 @@ app = Flask(__name__)
 config_name = os.environ.get('FLASK_ENV', 'default')
 app.config.from_object(config[config_name])
 
+# Serialização JSON
+class ProvedorJSON(DefaultJSONProvider):
+    """Provedor JSON do Flask que usa orjson quando instalado.
+    
+    Datas e horários são escritos em ISO 8601, como nos to_dict() dos modelos, em vez
+    do formato HTTP usado pelo provedor padrão do Flask.
+    """
+    
+    ensure_ascii = False
+    
+    @staticmethod
+    def default(valor):
+        if hasattr(valor, 'isoformat'):
+            return valor.isoformat()
+        return DefaultJSONProvider.default(valor)
+    
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            kwargs.setdefault('default', self.default)
+            kwargs.setdefault('ensure_ascii', self.ensure_ascii)
+            kwargs.setdefault('sort_keys', self.sort_keys)
+            return json.dumps(obj, **kwargs)
+        return self._dumps_bytes(obj).decode()
+    
+    def _dumps_bytes(self, obj):
+        opcoes = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            opcoes |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=opcoes)
+    
+    def response(self, *args, **kwargs):
+        if orjson is None or self.compact is False or (self.compact is None and self._app.debug):
+            return super().response(*args, **kwargs)
+        return self._app.response_class(
+            self._dumps_bytes(self._prepare_response_obj(args, kwargs)) + b'\n',
+            mimetype=self.mimetype
+        )
+
+app.json = ProvedorJSON(app)
+
+def compilar_serializador(campos):
+    """Monta um serializador que lê os atributos de uma vez (attrgetter) e os associa
+    às chaves do JSON, sem passar pelo to_dict(). Cada campo é um nome de atributo
+    ou um par (chave, caminho), ex.: ('paciente_nome', 'paciente.nome').
+    
+    Datas ficam como objetos datetime e são convertidas pelo ProvedorJSON.
+    """
+    pares = [(campo, campo) if isinstance(campo, str) else campo for campo in campos]
+    chaves = tuple(chave for chave, _ in pares)
+    caminhos = dict(pares)
+    ler = attrgetter(*(caminho for _, caminho in pares))
+    if len(pares) == 1:
+        # Com um único atributo, o attrgetter devolve o valor em vez de uma tupla
+        ler_um = ler
+        ler = lambda objeto: (ler_um(objeto),)
+    
+    def serializar(objeto):
+        return dict(zip(chaves, ler(objeto)))
+    
+    def serializar_lista(objetos):
+        return [dict(zip(chaves, valores)) for valores in map(ler, objetos)]
+    
+    parciais = {}
+    
+    def parcial(selecionados):
+        """Serializador só com os campos selecionados (None = todos), compilado uma vez por combinação"""
+        if selecionados is None:
+            return serializar
+        if selecionados not in parciais:
+            parciais[selecionados] = compilar_serializador([(chave, caminhos[chave]) for chave in selecionados])
+        return parciais[selecionados]
+    
+    serializar.chaves = chaves
+    serializar.caminhos = caminhos
+    serializar.lista = serializar_lista
+    serializar.parcial = parcial
+    return serializar
+
 # Inicialização das extensões
 db = SQLAlchemy(app)
 jwt = JWTManager(app)
 
+# Perfil do SQLite (PRAGMAs e transações de escrita)
+METODOS_ESCRITA = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+# Rotas POST que só leem: o login (que no máximo regrava o hash, em transação própria)
+# e o lote de leituras; reservar o banco nelas bloquearia as escritas à toa
+ENDPOINTS_SOMENTE_LEITURA = {'login', 'executar_lote'}
+
+def modo_transacao():
+    """Requisições de escrita reservam o banco já no BEGIN (IMMEDIATE); assim um
+    bloqueio aparece no início da transação, onde pode ser repetido com segurança,
+    e não no meio dela, ao passar de leitura para escrita."""
+    if (has_request_context() and request.method in METODOS_ESCRITA
+            and request.endpoint not in ENDPOINTS_SOMENTE_LEITURA):
+        return 'IMMEDIATE'
+    return 'DEFERRED'
+
+def configurar_sqlite(engine, pragmas, tentativas, espera):
+    """Aplica os PRAGMAs em cada conexão e passa a controlar o BEGIN das transações"""
+    
+    @event.listens_for(engine, 'connect')
+    def aplicar_pragmas(conexao_dbapi, registro):
+        # Desliga o BEGIN automático do pysqlite; o evento 'begin' abaixo o emite
+        conexao_dbapi.isolation_level = None
+        cursor = conexao_dbapi.cursor()
+        for nome, valor in pragmas.items():
+            cursor.execute(f'PRAGMA {nome}={valor}')
+        cursor.close()
+    
+    @event.listens_for(engine, 'begin')
+    def iniciar_transacao(conexao):
+        comando = f'BEGIN {modo_transacao()}'
+        for tentativa in range(tentativas):
+            try:
+                conexao.exec_driver_sql(comando)
+                return
+            except OperationalError as e:
+                if 'locked' not in str(e) or tentativa == tentativas - 1:
+                    raise
+                time.sleep(espera * 2 ** tentativa)
+
+if app.config['SQLITE_PRAGMAS']:
+    with app.app_context():
+        if db.engine.dialect.name == 'sqlite':
+            configurar_sqlite(
+                db.engine,
+                app.config['SQLITE_PRAGMAS'],
+                app.config['SQLITE_ESCRITA_TENTATIVAS'],
+                app.config['SQLITE_ESCRITA_ESPERA']
+            )
+
+# Leituras compartilhadas entre WSGI e ASGI
+# As rotas de leitura são geradores: em vez de executar os comandos SQL, entregam cada um
+# (yield) junto com a forma do resultado esperada e recebem o resultado de volta. Assim a
+# mesma função atende pela sessão síncrona (executar_leitura) e pela assíncrona (asgi.py).
+FORMAS_RESULTADO = {
+    'todos': lambda resultado: resultado.scalars().all(),
+    'primeiro': lambda resultado: resultado.scalars().first(),
+    'valor': lambda resultado: resultado.scalar(),
+    'linha': lambda resultado: resultado.one(),
+    'linhas': lambda resultado: resultado.all(),
+}
+
+# Rotas de leitura por endpoint, para o modo assíncrono
+LEITURAS = {}
+
+def executar_leitura(leitura):
+    """Conduz a leitura pela sessão síncrona e retorna o que ela retornar. Erros do banco
+    são repassados ao gerador, como se o comando tivesse sido executado nele."""
+    resultado = erro = None
+    while True:
+        try:
+            forma, comando = leitura.throw(erro) if erro else leitura.send(resultado)
+        except StopIteration as fim:
+            return fim.value
+        try:
+            resultado, erro = FORMAS_RESULTADO[forma](db.session.execute(comando)), None
+        except Exception as e:
+            resultado, erro = None, e
+
+def rota_de_leitura(gerador):
+    """Registra a rota em LEITURAS e retorna a view síncrona que a executa"""
+    LEITURAS[gerador.__name__] = gerador
+    
+    @wraps(gerador)
+    def view(**argumentos):
+        return executar_leitura(gerador(**argumentos))
+    return view
+
+# Função para normalizar CPF
+def normalizar_cpf(cpf):
+    """Retorna apenas os dígitos do CPF"""
+    return re.sub(r'[^0-9]', '', cpf)
+
 # Função para validar CPF
 def validar_cpf(cpf):
     """Valida CPF brasileiro"""
     # Remove caracteres não numéricos
-    cpf = re.sub(r'[^0-9]', '', cpf)
+    cpf = normalizar_cpf(cpf)
     
     # Verifica se tem 11 dígitos
     if len(cpf) != 11:
@@ -64,6 +265,52 @@ def validar_cpf(cpf):
     
     return True
 
+# Função para validar vários CPFs de uma vez
+_PESOS_DIGITO1 = np.arange(10, 1, -1)
+_PESOS_DIGITO2 = np.arange(11, 1, -1)
+
+def validar_cpfs(cpfs):
+    """Valida uma lista de CPFs com aritmética vetorizada.
+    
+    Retorna uma máscara booleana (numpy) com o mesmo resultado de validar_cpf para cada item.
+    """
+    textos = [cpf if isinstance(cpf, str) else '' for cpf in cpfs]
+    mascara = np.zeros(len(textos), dtype=bool)
+    if not textos:
+        return mascara
+    
+    # Todos os CPFs em um único buffer, separados por quebra de linha. Se algum CPF
+    # já contiver uma quebra de linha, a normalização é feita item a item
+    juntos = '\n'.join(textos)
+    if juntos.count('\n') != len(textos) - 1:
+        juntos = '\n'.join(normalizar_cpf(texto) for texto in textos)
+    bytes_ = np.frombuffer(juntos.encode('utf-8'), dtype=np.uint8)
+    
+    # Remove tudo que não é dígito (como normalizar_cpf) e mede cada CPF
+    eh_quebra = bytes_ == ord('\n')
+    eh_digito = (bytes_ >= ord('0')) & (bytes_ <= ord('9'))
+    digitos = bytes_[eh_digito].astype(np.int64) - ord('0')
+    # Quantidade de dígitos antes de cada quebra de linha = fim de cada CPF
+    fins = np.append(np.cumsum(eh_digito)[eh_quebra], len(digitos))
+    inicios = np.concatenate(([0], fins[:-1]))
+    
+    # Apenas CPFs com 11 dígitos seguem para o cálculo dos dígitos verificadores
+    com_11_digitos = (fins - inicios) == 11
+    if not com_11_digitos.any():
+        return mascara
+    matriz = digitos[inicios[com_11_digitos, None] + np.arange(11)]
+    
+    resto = (matriz[:, :9] @ _PESOS_DIGITO1) % 11
+    digito1 = np.where(resto < 2, 0, 11 - resto)
+    resto = (matriz[:, :10] @ _PESOS_DIGITO2) % 11
+    digito2 = np.where(resto < 2, 0, 11 - resto)
+    
+    # CPFs com todos os dígitos iguais são inválidos
+    repetidos = (matriz == matriz[:, :1]).all(axis=1)
+    
+    mascara[com_11_digitos] = (matriz[:, 9] == digito1) & (matriz[:, 10] == digito2) & ~repetidos
+    return mascara
+
 # Modelo de Usuário
 class Usuario(db.Model):
     __tablename__ = 'usuarios'
@@ -76,8 +323,16 @@ class Usuario(db.Model):
     telefone = db.Column(db.String(20))
     endereco = db.Column(db.String(200))
     data_criacao = db.Column(db.DateTime, default=datetime.utcnow)
+    atualizado_em = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     ativo = db.Column(db.Boolean, default=True)
     
+    # As listagens só consideram usuários ativos: índices parciais, em ordem de id
+    __table_args__ = (
+        db.Index('idx_usuarios_ativos', 'id', sqlite_where=text('ativo = 1'), postgresql_where=text('ativo')),
+        db.Index('idx_usuarios_ativos_tipo', 'tipo_usuario', 'id',
+                 sqlite_where=text('ativo = 1'), postgresql_where=text('ativo')),
+    )
+    
     def __repr__(self):
         return f'<Usuario {self.nome}>'
     
@@ -90,8 +345,18 @@ class Usuario(db.Model):
             'telefone': self.telefone,
             'endereco': self.endereco,
             'data_criacao': self.data_criacao.isoformat(),
+            'atualizado_em': self.atualizado_em.isoformat(),
             'ativo': self.ativo
         }
+    
+    def versoes(self):
+        """Datas de modificação que compõem a representação do usuário"""
+        return [self.atualizado_em]
+
+serializar_usuario = compilar_serializador([
+    'id', 'nome', 'email', 'tipo_usuario', 'telefone', 'endereco',
+    'data_criacao', 'atualizado_em', 'ativo'
+])
 
 # Modelo de Paciente
 class Paciente(db.Model):
@@ -100,13 +365,19 @@ class Paciente(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     nome = db.Column(db.String(100), nullable=False)
     cpf = db.Column(db.String(14), unique=True, nullable=False)
+    cpf_normalizado = db.Column(db.String(11), unique=True, nullable=False)  # apenas dígitos
     data_nascimento = db.Column(db.Date, nullable=False)
     telefone = db.Column(db.String(20))
     email = db.Column(db.String(120))
     endereco = db.Column(db.String(200))
     data_cadastro = db.Column(db.DateTime, default=datetime.utcnow)
+    atualizado_em = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     ativo = db.Column(db.Boolean, default=True)
     
+    __table_args__ = (
+        db.Index('idx_pacientes_ativos', 'id', sqlite_where=text('ativo = 1'), postgresql_where=text('ativo')),
+    )
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -117,8 +388,208 @@ class Paciente(db.Model):
             'email': self.email,
             'endereco': self.endereco,
             'data_cadastro': self.data_cadastro.isoformat(),
+            'atualizado_em': self.atualizado_em.isoformat(),
             'ativo': self.ativo
         }
+    
+    def versoes(self):
+        """Datas de modificação que compõem a representação do paciente"""
+        return [self.atualizado_em]
+    
+    @validates('cpf')
+    def validar_formato_cpf(self, chave, cpf):
+        """Mantém o CPF normalizado sempre que o CPF é alterado"""
+        self.cpf_normalizado = normalizar_cpf(cpf)
+        return cpf
+    
+    @classmethod
+    def buscar_por_cpf(cls, cpf):
+        """Busca paciente pelo CPF em qualquer formatação, usando o índice único"""
+        return cls.query.filter_by(cpf_normalizado=normalizar_cpf(cpf)).first()
+
+serializar_paciente = compilar_serializador([
+    'id', 'nome', 'cpf', 'data_nascimento', 'telefone', 'email', 'endereco',
+    'data_cadastro', 'atualizado_em', 'ativo'
+])
+
+# Índice de busca textual de pacientes (SQLite FTS5)
+# A tabela virtual guarda apenas os pacientes ativos e é mantida por triggers,
+# então qualquer INSERT/UPDATE/DELETE em pacientes (inclusive soft delete) a atualiza.
+DDL_BUSCA_PACIENTES = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS pacientes_busca USING fts5(
+        nome, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS pacientes_busca_ai AFTER INSERT ON pacientes
+    WHEN new.ativo BEGIN
+        INSERT INTO pacientes_busca(rowid, nome) VALUES (new.id, new.nome);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS pacientes_busca_au AFTER UPDATE OF nome, ativo ON pacientes
+    BEGIN
+        DELETE FROM pacientes_busca WHERE rowid = old.id;
+        INSERT INTO pacientes_busca(rowid, nome) SELECT new.id, new.nome WHERE new.ativo;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS pacientes_busca_ad AFTER DELETE ON pacientes
+    BEGIN
+        DELETE FROM pacientes_busca WHERE rowid = old.id;
+    END""",
+]
+
+@event.listens_for(Paciente.__table__, 'after_create')
+def criar_indice_busca(target, connection, **kw):
+    """Cria o índice de busca junto com a tabela de pacientes"""
+    if connection.dialect.name != 'sqlite':
+        return
+    for ddl in DDL_BUSCA_PACIENTES:
+        connection.exec_driver_sql(ddl)
+    connection.exec_driver_sql('DELETE FROM pacientes_busca')
+
+@event.listens_for(Paciente.__table__, 'before_drop')
+def remover_indice_busca(target, connection, **kw):
+    """Remove o índice de busca junto com a tabela de pacientes"""
+    if connection.dialect.name == 'sqlite':
+        connection.exec_driver_sql('DROP TABLE IF EXISTS pacientes_busca')
+
+def sincronizar_indice_busca():
+    """Cria o índice de busca em bancos existentes. Os gatilhos o mantêm em dia, então ele
+    só é reconstruído se acabou de ser criado ou se o total não confere com os pacientes
+    ativos (ex.: carga feita com os gatilhos removidos); retorna se houve reconstrução."""
+    if db.engine.dialect.name != 'sqlite':
+        return False
+    with db.engine.begin() as connection:
+        existia = connection.exec_driver_sql(
+            "SELECT EXISTS (SELECT 1 FROM sqlite_master WHERE name = 'pacientes_busca')"
+        ).scalar()
+        for ddl in DDL_BUSCA_PACIENTES:
+            connection.exec_driver_sql(ddl)
+        if existia:
+            indexados = connection.exec_driver_sql('SELECT COUNT(*) FROM pacientes_busca').scalar()
+            ativos = connection.exec_driver_sql('SELECT COUNT(*) FROM pacientes WHERE ativo').scalar()
+            if indexados == ativos:
+                return False
+        connection.exec_driver_sql('DELETE FROM pacientes_busca')
+        connection.exec_driver_sql(
+            'INSERT INTO pacientes_busca(rowid, nome) SELECT id, nome FROM pacientes WHERE ativo'
+        )
+    return True
+
+logger_esquema = logging.getLogger('consultorio.esquema')
+
+def criar_indice_cpf_normalizado(connection):
+    """Cria o índice único do CPF normalizado, se ainda não há cadastros com o mesmo CPF.
+    
+    Cadastros antigos podem ter gravado o mesmo CPF com e sem formatação; nesse caso os
+    grupos são registrados no log e o índice fica para a próxima inicialização, depois
+    que os cadastros forem corrigidos. Retorna os grupos duplicados encontrados.
+    """
+    duplicados = connection.exec_driver_sql(
+        'SELECT cpf_normalizado, GROUP_CONCAT(id), GROUP_CONCAT(cpf, \' | \') FROM pacientes '
+        'GROUP BY cpf_normalizado HAVING COUNT(*) > 1 ORDER BY cpf_normalizado'
+    ).fetchall()
+    if duplicados:
+        logger_esquema.warning(
+            'Índice único ix_pacientes_cpf_normalizado não criado: %d CPF(s) cadastrados mais de '
+            'uma vez. Corrija ou unifique os pacientes e reinicie a aplicação.\n%s',
+            len(duplicados),
+            '\n'.join(f'  CPF {cpf}: pacientes {ids} ({originais})' for cpf, ids, originais in duplicados)
+        )
+        return duplicados
+    connection.exec_driver_sql(
+        'CREATE UNIQUE INDEX IF NOT EXISTS ix_pacientes_cpf_normalizado '
+        'ON pacientes (cpf_normalizado)'
+    )
+    return []
+
+def atualizar_esquema():
+    """Aplica em bancos existentes as alterações de esquema que o create_all não faz"""
+    inspetor = inspect(db.engine)
+    colunas = {coluna['name'] for coluna in inspetor.get_columns('pacientes')}
+    
+    # CPF normalizado: adiciona a coluna e a preenche a partir do CPF
+    if 'cpf_normalizado' not in colunas:
+        with db.engine.begin() as connection:
+            connection.exec_driver_sql('ALTER TABLE pacientes ADD COLUMN cpf_normalizado VARCHAR(11)')
+            pacientes = connection.exec_driver_sql('SELECT id, cpf FROM pacientes').fetchall()
+            if pacientes:
+                connection.execute(
+                    text('UPDATE pacientes SET cpf_normalizado = :cpf_normalizado WHERE id = :id'),
+                    [{'id': id_, 'cpf_normalizado': normalizar_cpf(cpf)} for id_, cpf in pacientes]
+                )
+    
+    # Índice único do CPF normalizado (tabelas do create_all já têm a restrição UNIQUE)
+    unicos = [restricao['column_names'] for restricao in inspetor.get_unique_constraints('pacientes')]
+    unicos += [indice['column_names'] for indice in inspetor.get_indexes('pacientes') if indice['unique']]
+    if ['cpf_normalizado'] not in unicos:
+        with db.engine.begin() as connection:
+            criar_indice_cpf_normalizado(connection)
+    
+    # Data de modificação, preenchida inicialmente com a data de criação
+    for tabela, coluna_criacao in [('usuarios', 'data_criacao'), ('pacientes', 'data_cadastro'),
+                                   ('consultas', 'data_criacao')]:
+        if 'atualizado_em' not in {coluna['name'] for coluna in inspect(db.engine).get_columns(tabela)}:
+            with db.engine.begin() as connection:
+                connection.exec_driver_sql(f'ALTER TABLE {tabela} ADD COLUMN atualizado_em DATETIME')
+                connection.exec_driver_sql(f'UPDATE {tabela} SET atualizado_em = {coluna_criacao}')
+    
+    # Duração das consultas
+    colunas = {coluna['name'] for coluna in inspect(db.engine).get_columns('consultas')}
+    if 'duracao_minutos' not in colunas:
+        with db.engine.begin() as connection:
+            connection.exec_driver_sql(
+                'ALTER TABLE consultas ADD COLUMN duracao_minutos INTEGER NOT NULL '
+                f"DEFAULT {int(app.config['DURACAO_PADRAO_CONSULTA'])}"
+            )
+    
+    # Índices declarados nos modelos (o create_all só os cria junto com tabelas novas)
+    with db.engine.begin() as connection:
+        for tabela in db.metadata.sorted_tables:
+            for indice in tabela.indexes:
+                indice.create(connection, checkfirst=True)
+    
+    sincronizar_indice_busca()
+    
+    # Invalidações do cache entre processos
+    if db.engine.dialect.name == 'sqlite':
+        with db.engine.begin() as connection:
+            criar_invalidacao_cache(None, connection)
+    
+    # Resumo da agenda: bancos que já tinham consultas antes do resumo precisam da carga inicial
+    if db.engine.dialect.name == 'sqlite':
+        with db.engine.begin() as connection:
+            criar_gatilhos_resumo(None, connection)
+            resumo_vazio = connection.exec_driver_sql(
+                'SELECT NOT EXISTS (SELECT 1 FROM agenda_resumo) AND EXISTS (SELECT 1 FROM consultas)'
+            ).scalar()
+        if resumo_vazio:
+            reconstruir_resumo_agenda()
+
+def buscar_pacientes_por_nome(texto, limite, deslocamento, opcoes=()):
+    """Busca pacientes ativos pelo nome, ignorando acentos e ordenando por relevância.
+    As opções de carga (ex.: load_only) são aplicadas à query dos pacientes.
+    É uma leitura: use com executar_leitura() ou yield from."""
+    termos = re.findall(r'\w+', texto)
+    if not termos:
+        return []
+    
+    if db.engine.dialect.name != 'sqlite':
+        comando = select(Paciente).options(*opcoes).filter(Paciente.ativo == True)
+        for termo in termos:
+            comando = comando.filter(Paciente.nome.contains(termo))
+        return (yield 'todos', comando.order_by(Paciente.nome).limit(limite).offset(deslocamento))
+    
+    # Cada termo vira uma busca por prefixo: "mar sil" encontra "Maria da Silva"
+    expressao = ' '.join(f'"{termo}"*' for termo in termos)
+    # Todos os pacientes que casam são ordenados por relevância (bm25); o rowid desempata
+    # nomes iguais, para que as páginas não se sobreponham
+    ids = yield 'todos', text(
+        'SELECT rowid FROM pacientes_busca WHERE pacientes_busca MATCH :expressao '
+        'ORDER BY rank, rowid LIMIT :limite OFFSET :deslocamento'
+    ).bindparams(expressao=expressao, limite=limite, deslocamento=deslocamento)
+    if not ids:
+        return []
+    
+    pacientes = {paciente.id: paciente
+                 for paciente in (yield 'todos', select(Paciente).options(*opcoes).filter(Paciente.id.in_(ids)))}
+    return [pacientes[id_] for id_ in ids if id_ in pacientes]
 
 # Modelo de Consulta
 class Consulta(db.Model):
@@ -130,8 +601,19 @@ class Consulta(db.Model):
     data_consulta = db.Column(db.DateTime, nullable=False)
     tipo_consulta = db.Column(db.String(50), nullable=False)
     observacoes = db.Column(db.Text)
+    duracao_minutos = db.Column(db.Integer, nullable=False, default=lambda: app.config['DURACAO_PADRAO_CONSULTA'])
     status = db.Column(db.String(20), default='agendada')  # 'agendada', 'realizada', 'cancelada'
     data_criacao = db.Column(db.DateTime, default=datetime.utcnow)
+    atualizado_em = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # As consultas são filtradas por médico, paciente, status e período e
+    # ordenadas por data; cada índice termina em data_consulta para servir os dois
+    __table_args__ = (
+        db.Index('idx_consultas_data', 'data_consulta'),
+        db.Index('idx_consultas_medico_data', 'medico_id', 'data_consulta'),
+        db.Index('idx_consultas_paciente_data', 'paciente_id', 'data_consulta'),
+        db.Index('idx_consultas_status_data', 'status', 'data_consulta'),
+    )
     
     # Relacionamentos
     paciente = db.relationship('Paciente', backref='consultas')
@@ -143,13 +625,830 @@ class Consulta(db.Model):
             'paciente_id': self.paciente_id,
             'medico_id': self.medico_id,
             'data_consulta': self.data_consulta.isoformat(),
+            'duracao_minutos': self.duracao_minutos,
             'tipo_consulta': self.tipo_consulta,
             'observacoes': self.observacoes,
             'status': self.status,
             'data_criacao': self.data_criacao.isoformat(),
+            'atualizado_em': self.atualizado_em.isoformat(),
             'paciente_nome': self.paciente.nome if self.paciente else None,
             'medico_nome': self.medico.nome if self.medico else None
         }
+    
+    @classmethod
+    def opcoes_com_nomes(cls, campos=None):
+        """Opções de carga que trazem paciente e médico no mesmo SELECT, evitando N+1.
+        Com campos, só as colunas pedidas são carregadas, e paciente e médico apenas
+        se os nomes deles forem pedidos."""
+        if campos is not None:
+            # data_consulta é a chave do cursor e da ordem das listagens
+            return opcoes_de_campos(cls, serializar_consulta, campos, colunas=[cls.data_consulta])
+        return (db.joinedload(cls.paciente), db.joinedload(cls.medico))
+    
+    @classmethod
+    def query_com_nomes(cls, campos=None):
+        """Query que já carrega paciente e médico no mesmo SELECT"""
+        return cls.query.options(*cls.opcoes_com_nomes(campos))
+    
+    @classmethod
+    def select_com_nomes(cls, campos=None):
+        """Como query_com_nomes, para as rotas de leitura"""
+        return select(cls).options(*cls.opcoes_com_nomes(campos))
+    
+    def versoes(self):
+        """Datas de modificação que compõem a representação da consulta (inclui os nomes,
+        se paciente e médico foram carregados; com ?campos= sem os nomes, não são)"""
+        nao_carregados = inspect(self).unloaded
+        return [
+            self.atualizado_em,
+            self.paciente.atualizado_em if 'paciente' not in nao_carregados and self.paciente else None,
+            self.medico.atualizado_em if 'medico' not in nao_carregados and self.medico else None
+        ]
+    
+    @property
+    def data_fim(self):
+        return self.data_consulta + timedelta(minutes=self.duracao_minutos)
+
+serializar_consulta = compilar_serializador([
+    'id', 'paciente_id', 'medico_id', 'data_consulta', 'duracao_minutos', 'tipo_consulta',
+    'observacoes', 'status', 'data_criacao', 'atualizado_em',
+    ('paciente_nome', 'paciente.nome'), ('medico_nome', 'medico.nome')
+])
+
+# Cache de entidades (usuários e pacientes)
+class Instantaneo:
+    """Cópia da representação de uma entidade, desvinculada da sessão do banco"""
+    
+    __slots__ = ('id', 'dados', '_versoes')
+    
+    def __init__(self, entidade):
+        self.id = entidade.id
+        self.dados = entidade.to_dict()
+        self._versoes = entidade.versoes()
+    
+    def to_dict(self, campos=None):
+        if campos is None:
+            return dict(self.dados)
+        return {campo: self.dados[campo] for campo in campos}
+    
+    def versoes(self):
+        return self._versoes
+
+class CacheEntidades:
+    """Cache LRU com TTL e tamanho máximo, compartilhado pelas threads do processo.
+    
+    Qualquer invalidação incrementa uma geração global; uma leitura que começou antes
+    de uma invalidação não grava no cache, evitando guardar um valor já desatualizado.
+    """
+    
+    def __init__(self, tamanho_maximo, ttl):
+        self.tamanho_maximo = tamanho_maximo
+        self.ttl = ttl
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+        self._geracao = 0
+        self.acertos = 0
+        self.faltas = 0
+        self.remocoes = 0
+    
+    def obter(self, chave, carregar):
+        """Retorna o valor em cache ou o carrega com carregar() (None não é guardado)"""
+        valor, geracao = self.consultar(chave)
+        if geracao is None:
+            return valor
+        valor = carregar()
+        self.guardar(chave, valor, geracao)
+        return valor
+    
+    def consultar(self, chave):
+        """Retorna (valor, None) num acerto ou (None, geração) numa falta; a geração
+        deve ser repassada a guardar() depois de carregar o valor"""
+        with self._lock:
+            item = self._itens.get(chave)
+            if item and item[1] > time.monotonic():
+                self._itens.move_to_end(chave)
+                self.acertos += 1
+                return item[0], None
+            self.faltas += 1
+            return None, self._geracao
+    
+    def guardar(self, chave, valor, geracao):
+        if valor is None or self.tamanho_maximo <= 0:
+            return
+        with self._lock:
+            if geracao == self._geracao:
+                self._itens[chave] = (valor, time.monotonic() + self.ttl)
+                self._itens.move_to_end(chave)
+                while len(self._itens) > self.tamanho_maximo:
+                    self._itens.popitem(last=False)
+                    self.remocoes += 1
+    
+    def invalidar(self, *chaves):
+        with self._lock:
+            self._geracao += 1
+            for chave in chaves:
+                self._itens.pop(chave, None)
+    
+    def limpar(self):
+        with self._lock:
+            self._geracao += 1
+            self._itens.clear()
+    
+    def estatisticas(self):
+        with self._lock:
+            return {
+                'itens': len(self._itens),
+                'tamanho_maximo': self.tamanho_maximo,
+                'acertos': self.acertos,
+                'faltas': self.faltas,
+                'remocoes': self.remocoes
+            }
+
+cache_entidades = CacheEntidades(app.config['CACHE_ENTIDADES_TAMANHO'], app.config['CACHE_ENTIDADES_TTL'])
+MODELOS_EM_CACHE = (Usuario, Paciente)
+
+# Invalidações entre processos: triggers registram cada alteração ou exclusão de usuários
+# e pacientes (por qualquer processo, inclusive fora da API) em cache_invalidacoes, e cada
+# processo lê periodicamente o que foi registrado desde a última leitura. Só as últimas
+# 10000 invalidações são mantidas; um processo que ficou para trás limpa o cache inteiro.
+DDL_INVALIDACAO_CACHE = [
+    """CREATE TABLE IF NOT EXISTS cache_invalidacoes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        tabela VARCHAR(20) NOT NULL,
+        entidade_id INTEGER NOT NULL
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS cache_invalidacoes_limpeza AFTER INSERT ON cache_invalidacoes
+    BEGIN
+        DELETE FROM cache_invalidacoes WHERE seq <= new.seq - 10000;
+    END""",
+] + [
+    f"""CREATE TRIGGER IF NOT EXISTS cache_invalidacoes_{modelo.__tablename__}_{sufixo} AFTER {evento} ON {modelo.__tablename__}
+    BEGIN
+        INSERT INTO cache_invalidacoes (tabela, entidade_id) VALUES ('{modelo.__tablename__}', old.id);
+    END"""
+    for modelo in MODELOS_EM_CACHE
+    for sufixo, evento in [('au', 'UPDATE'), ('ad', 'DELETE')]
+]
+
+SQL_FAIXA_INVALIDACOES = 'SELECT MIN(seq), MAX(seq) FROM cache_invalidacoes'
+SQL_INVALIDACOES = 'SELECT seq, tabela, entidade_id FROM cache_invalidacoes WHERE seq > :ultimo ORDER BY seq'
+
+@event.listens_for(db.metadata, 'after_create')
+def criar_invalidacao_cache(target, connection, **kw):
+    """Cria a tabela de invalidações e seus triggers depois que usuários e pacientes existem"""
+    if connection.dialect.name != 'sqlite':
+        return
+    for ddl in DDL_INVALIDACAO_CACHE:
+        connection.exec_driver_sql(ddl)
+
+@event.listens_for(db.metadata, 'before_drop')
+def remover_invalidacao_cache(target, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        connection.exec_driver_sql('DROP TABLE IF EXISTS cache_invalidacoes')
+
+class SincronizacaoCache:
+    """Aplica ao cache deste processo as invalidações registradas pelos demais, consultando
+    cache_invalidacoes no máximo uma vez a cada `intervalo` segundos"""
+    
+    def __init__(self, cache, intervalo):
+        self.cache = cache
+        self.intervalo = intervalo
+        self._ultimo = None
+        self._proxima = 0.0
+        self._lock = threading.Lock()
+    
+    def pendente(self):
+        """Indica se é hora de consultar as invalidações (e reserva a vez para quem chamou)"""
+        with self._lock:
+            agora = time.monotonic()
+            if agora < self._proxima:
+                return False
+            self._proxima = agora + self.intervalo
+            return True
+    
+    def verificar_faixa(self, minimo, maximo):
+        """Recebe MIN(seq) e MAX(seq); retorna a partir de qual seq ler as invalidações,
+        ou None se não há nada novo"""
+        maximo = maximo or 0
+        with self._lock:
+            ultimo = self._ultimo
+            if ultimo is None or maximo < ultimo or (minimo or 0) > ultimo + 1:
+                # Primeira leitura, tabela recriada ou invalidações já descartadas
+                self.cache.limpar()
+                self._ultimo = maximo
+                return None
+            return ultimo if maximo > ultimo else None
+    
+    def aplicar(self, linhas):
+        if not linhas:
+            return
+        self.cache.invalidar(*[(tabela, entidade_id) for _, tabela, entidade_id in linhas])
+        with self._lock:
+            self._ultimo = max(self._ultimo or 0, linhas[-1][0])
+
+sincronizacao_cache = SincronizacaoCache(cache_entidades, app.config['CACHE_ENTIDADES_SINCRONIZACAO'])
+
+def sincronizar_cache_entidades():
+    """Lê as invalidações de outros processos, se o intervalo de verificação já passou"""
+    if db.engine.dialect.name != 'sqlite' or not sincronizacao_cache.pendente():
+        return
+    minimo, maximo = yield 'linha', text(SQL_FAIXA_INVALIDACOES)
+    ultimo = sincronizacao_cache.verificar_faixa(minimo, maximo)
+    if ultimo is not None:
+        sincronizacao_cache.aplicar((yield 'linhas', text(SQL_INVALIDACOES).bindparams(ultimo=ultimo)))
+
+def obter_em_cache(modelo, entidade_id):
+    """Retorna um Instantaneo da entidade (ou None se não existir), passando pelo cache"""
+    entidade_id = int(entidade_id)
+    yield from sincronizar_cache_entidades()
+    chave = (modelo.__tablename__, entidade_id)
+    valor, geracao = cache_entidades.consultar(chave)
+    if geracao is None:
+        return valor
+    
+    entidade = yield 'primeiro', select(modelo).filter(modelo.id == entidade_id)
+    valor = Instantaneo(entidade) if entidade else None
+    cache_entidades.guardar(chave, valor, geracao)
+    return valor
+
+def obter_varios_em_cache(modelo, ids):
+    """Retorna {id: Instantaneo} das entidades existentes; as que não estão no cache
+    são carregadas juntas, com um único SELECT ... WHERE id IN (...)"""
+    yield from sincronizar_cache_entidades()
+    encontrados = {}
+    faltando = {}
+    for entidade_id in ids:
+        valor, geracao = cache_entidades.consultar((modelo.__tablename__, entidade_id))
+        if geracao is None:
+            encontrados[entidade_id] = valor
+        else:
+            faltando[entidade_id] = geracao
+    
+    if faltando:
+        for entidade in (yield 'todos', select(modelo).filter(modelo.id.in_(faltando))):
+            instantaneo = Instantaneo(entidade)
+            cache_entidades.guardar((modelo.__tablename__, entidade.id), instantaneo, faltando[entidade.id])
+            encontrados[entidade.id] = instantaneo
+    return encontrados
+
+# Toda escrita de usuários e pacientes pelo ORM (PUT, DELETE, soft delete, rehash de
+# senha) invalida o cache depois do commit, quando os novos dados já estão visíveis
+@event.listens_for(db.session, 'after_flush')
+def registrar_entidades_alteradas(session, flush_context):
+    alteradas = session.info.setdefault('entidades_alteradas', set())
+    for entidade in list(session.dirty) + list(session.deleted):
+        if isinstance(entidade, MODELOS_EM_CACHE):
+            alteradas.add((entidade.__tablename__, entidade.id))
+
+@event.listens_for(db.session, 'after_commit')
+def invalidar_entidades_alteradas(session):
+    alteradas = session.info.pop('entidades_alteradas', None)
+    if alteradas:
+        cache_entidades.invalidar(*alteradas)
+
+@event.listens_for(db.session, 'after_rollback')
+def descartar_entidades_alteradas(session):
+    session.info.pop('entidades_alteradas', None)
+
+# Resumo diário da agenda (dia, médico, status) para os painéis
+class ResumoAgenda(db.Model):
+    __tablename__ = 'agenda_resumo'
+    
+    dia = db.Column(db.Date, primary_key=True)
+    medico_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), primary_key=True)
+    status = db.Column(db.String(20), primary_key=True)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    
+    def to_dict(self):
+        return {
+            'dia': self.dia.isoformat(),
+            'medico_id': self.medico_id,
+            'status': self.status,
+            'total': self.total
+        }
+
+# O resumo é mantido por triggers na mesma transação de cada INSERT/UPDATE/DELETE em
+# consultas, inclusive atualizações em massa feitas fora do ORM
+DDL_RESUMO_AGENDA = [
+    """CREATE TRIGGER IF NOT EXISTS agenda_resumo_ai AFTER INSERT ON consultas
+    BEGIN
+        INSERT INTO agenda_resumo (dia, medico_id, status, total)
+        VALUES (date(new.data_consulta), new.medico_id, new.status, 1)
+        ON CONFLICT (dia, medico_id, status) DO UPDATE SET total = total + 1;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS agenda_resumo_au AFTER UPDATE OF data_consulta, medico_id, status ON consultas
+    WHEN date(old.data_consulta) IS NOT date(new.data_consulta)
+        OR old.medico_id IS NOT new.medico_id OR old.status IS NOT new.status
+    BEGIN
+        UPDATE agenda_resumo SET total = total - 1
+        WHERE dia = date(old.data_consulta) AND medico_id = old.medico_id AND status = old.status;
+        DELETE FROM agenda_resumo
+        WHERE dia = date(old.data_consulta) AND medico_id = old.medico_id AND status = old.status AND total <= 0;
+        INSERT INTO agenda_resumo (dia, medico_id, status, total)
+        VALUES (date(new.data_consulta), new.medico_id, new.status, 1)
+        ON CONFLICT (dia, medico_id, status) DO UPDATE SET total = total + 1;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS agenda_resumo_ad AFTER DELETE ON consultas
+    BEGIN
+        UPDATE agenda_resumo SET total = total - 1
+        WHERE dia = date(old.data_consulta) AND medico_id = old.medico_id AND status = old.status;
+        DELETE FROM agenda_resumo
+        WHERE dia = date(old.data_consulta) AND medico_id = old.medico_id AND status = old.status AND total <= 0;
+    END""",
+]
+
+SQL_RECONTAGEM_AGENDA = """
+    SELECT date(data_consulta) AS dia, medico_id, status, COUNT(*) AS total
+    FROM consultas GROUP BY date(data_consulta), medico_id, status
+"""
+
+@event.listens_for(db.metadata, 'after_create')
+def criar_gatilhos_resumo(target, connection, **kw):
+    """Cria os triggers do resumo depois que consultas e agenda_resumo existem"""
+    if connection.dialect.name != 'sqlite':
+        return
+    for ddl in DDL_RESUMO_AGENDA:
+        connection.exec_driver_sql(ddl)
+
+def verificar_resumo_agenda():
+    """Compara o resumo com uma recontagem completa; retorna as divergências"""
+    esperado = {
+        (dia, medico_id, status): total
+        for dia, medico_id, status, total in db.session.execute(text(SQL_RECONTAGEM_AGENDA))
+    }
+    atual = {
+        (dia, medico_id, status): total
+        for dia, medico_id, status, total in db.session.execute(
+            text('SELECT dia, medico_id, status, total FROM agenda_resumo')
+        )
+    }
+    return [
+        {'dia': chave[0], 'medico_id': chave[1], 'status': chave[2],
+         'esperado': esperado.get(chave, 0), 'atual': atual.get(chave, 0)}
+        for chave in sorted(set(esperado) | set(atual), key=str)
+        if esperado.get(chave, 0) != atual.get(chave, 0)
+    ]
+
+def reconstruir_resumo_agenda():
+    """Refaz o resumo a partir de uma recontagem completa das consultas"""
+    db.session.execute(text('DELETE FROM agenda_resumo'))
+    db.session.execute(text(
+        f'INSERT INTO agenda_resumo (dia, medico_id, status, total) {SQL_RECONTAGEM_AGENDA}'
+    ))
+    db.session.commit()
+
+@app.cli.command('resumo-agenda')
+def comando_resumo_agenda():
+    """Verifica o resumo da agenda contra uma recontagem completa e o reconstrói"""
+    divergencias = verificar_resumo_agenda()
+    if not divergencias:
+        print('✓ Resumo da agenda confere com a recontagem')
+        return
+    
+    print(f'✗ {len(divergencias)} divergências encontradas:')
+    for divergencia in divergencias:
+        print(f"  - {divergencia['dia']} médico {divergencia['medico_id']} {divergencia['status']}: "
+              f"esperado {divergencia['esperado']}, atual {divergencia['atual']}")
+    reconstruir_resumo_agenda()
+    print('✓ Resumo da agenda reconstruído')
+
+# Agenda dos médicos
+def consultas_do_medico(medico_id, inicio, fim, ignorar_id=None):
+    """Retorna (id, início, fim) das consultas não canceladas do médico que cruzam [inicio, fim).
+    
+    Usa o índice (medico_id, data_consulta): como nenhuma consulta dura mais que
+    DURACAO_MAXIMA_CONSULTA, basta ler as que começam a partir de inicio menos esse limite.
+    """
+    limite_inferior = inicio - timedelta(minutes=app.config['DURACAO_MAXIMA_CONSULTA'])
+    query = db.session.query(Consulta.id, Consulta.data_consulta, Consulta.duracao_minutos).filter(
+        Consulta.medico_id == medico_id,
+        Consulta.data_consulta > limite_inferior,
+        Consulta.data_consulta < fim,
+        Consulta.status != 'cancelada'
+    )
+    if ignorar_id is not None:
+        query = query.filter(Consulta.id != ignorar_id)
+    
+    intervalos = []
+    for id_, data_consulta, duracao in query.order_by(Consulta.data_consulta):
+        data_fim = data_consulta + timedelta(minutes=duracao)
+        if data_fim > inicio:
+            intervalos.append((id_, data_consulta, data_fim))
+    return intervalos
+
+def buscar_conflito(medico_id, inicio, duracao_minutos, ignorar_id=None):
+    """Retorna o id de uma consulta do médico que se sobrepõe ao horário, ou None"""
+    fim = inicio + timedelta(minutes=duracao_minutos)
+    intervalos = consultas_do_medico(medico_id, inicio, fim, ignorar_id)
+    return intervalos[0][0] if intervalos else None
+
+def validar_duracao(duracao_minutos):
+    """Valida a duração da consulta em minutos"""
+    if not isinstance(duracao_minutos, int) or isinstance(duracao_minutos, bool):
+        raise ValueError('Duração deve ser um número inteiro de minutos')
+    if not 1 <= duracao_minutos <= app.config['DURACAO_MAXIMA_CONSULTA']:
+        raise ValueError(f"Duração deve estar entre 1 e {app.config['DURACAO_MAXIMA_CONSULTA']} minutos")
+    return duracao_minutos
+
+# Funções de paginação por cursor (keyset)
+def codificar_cursor(valores):
+    """Gera um cursor opaco a partir dos valores da chave de ordenação"""
+    valores = [v.isoformat() if isinstance(v, datetime) else v for v in valores]
+    return base64.urlsafe_b64encode(json.dumps(valores).encode()).decode().rstrip('=')
+
+def decodificar_cursor(cursor, colunas):
+    """Converte um cursor opaco de volta nos valores da chave de ordenação"""
+    try:
+        preenchimento = '=' * (-len(cursor) % 4)
+        valores = json.loads(base64.urlsafe_b64decode(cursor + preenchimento))
+        if not isinstance(valores, list) or len(valores) != len(colunas):
+            raise ValueError
+        return [
+            datetime.fromisoformat(valor) if isinstance(coluna.type, db.DateTime) else int(valor)
+            for coluna, valor in zip(colunas, valores)
+        ]
+    except (ValueError, TypeError):
+        raise ValueError('Cursor inválido')
+
+def paginar_por_cursor(comando, colunas, cursor, limite):
+    """Pagina o select() buscando a partir da chave do cursor, sem OFFSET nem COUNT"""
+    itens = yield 'todos', filtrar_por_cursor(comando, colunas, cursor, limite)
+    return montar_pagina_cursor(itens, colunas, limite)
+
+def filtrar_por_cursor(query, colunas, cursor, limite):
+    """Aplica à query (Query ou select()) o filtro, a ordem e o limite da página"""
+    if cursor:
+        valores = decodificar_cursor(cursor, colunas)
+        if len(colunas) == 1:
+            query = query.filter(colunas[0] > valores[0])
+        else:
+            query = query.filter(db.tuple_(*colunas) > db.tuple_(*valores))
+    return query.order_by(*colunas).limit(limite + 1)
+
+def montar_pagina_cursor(itens, colunas, limite):
+    """Separa os itens da página e gera o cursor da próxima"""
+    tem_proxima = len(itens) > limite
+    itens = itens[:limite]
+    
+    proxima_cursor = None
+    if tem_proxima:
+        ultimo = itens[-1]
+        proxima_cursor = codificar_cursor([getattr(ultimo, coluna.key) for coluna in colunas])
+    
+    return itens, {
+        'limite': limite,
+        'proxima_cursor': proxima_cursor,
+        'tem_proxima': tem_proxima
+    }
+
+class PaginaCarregada(Pagination):
+    """Paginação do Flask-SQLAlchemy com itens e total já buscados pela leitura"""
+    
+    def _query_items(self):
+        return self._query_args['itens']
+    
+    def _query_count(self):
+        return self._query_args['total']
+
+def paginar(comando, pagina, por_pagina):
+    """Paginação por número de página, com a contagem total, como o paginate() do
+    Flask-SQLAlchemy (error_out=False)"""
+    pagina, por_pagina = Pagination._prepare_page_args(
+        page=pagina, per_page=por_pagina, max_per_page=100, error_out=False
+    )
+    itens = yield 'todos', comando.limit(por_pagina).offset((pagina - 1) * por_pagina)
+    total = yield 'valor', select(func.count()).select_from(comando.order_by(None).subquery())
+    return PaginaCarregada(page=pagina, per_page=por_pagina, error_out=False, itens=itens, total=total)
+
+def obter_limite():
+    """Lê o parâmetro limite da requisição, respeitando o máximo de 100 itens"""
+    limite = request.args.get('limite', 10, type=int)
+    return max(1, min(limite, 100))
+
+# Campos parciais (?campos=id,nome,data_consulta)
+def obter_campos(serializador):
+    """Lê o parâmetro campos, validando-o contra as chaves do serializador; None indica todos"""
+    valor = request.args.get('campos', '').strip()
+    if not valor:
+        return None
+    campos = tuple(dict.fromkeys(campo.strip() for campo in valor.split(',') if campo.strip()))
+    invalidos = [campo for campo in campos if campo not in serializador.caminhos]
+    if invalidos:
+        raise ValueError(f"Campos inválidos: {', '.join(invalidos)}. "
+                         f"Disponíveis: {', '.join(serializador.chaves)}")
+    return campos
+
+def opcoes_de_campos(modelo, serializador, campos, colunas=()):
+    """Opções de carga que limitam o SELECT às colunas dos campos pedidos (load_only).
+    
+    Além delas, carrega sempre a chave primária, atualizado_em (ETag e Last-Modified) e as
+    colunas extras. Campos de relacionamentos (ex.: 'paciente.nome') incluem o JOIN só
+    quando pedidos, também com apenas as colunas necessárias.
+    """
+    if campos is None:
+        return ()
+    carregar = [modelo.atualizado_em, *colunas]
+    relacionamentos = {}
+    for campo in campos:
+        caminho = serializador.caminhos[campo]
+        if '.' in caminho:
+            relacao, atributo = caminho.split('.')
+            relacionamentos.setdefault(relacao, []).append(atributo)
+        else:
+            carregar.append(getattr(modelo, caminho))
+    
+    opcoes = [db.load_only(*carregar)]
+    for relacao, atributos in relacionamentos.items():
+        relacionamento = getattr(modelo, relacao)
+        destino = relacionamento.property.mapper.class_
+        opcoes.append(db.joinedload(relacionamento).load_only(
+            destino.atualizado_em, *(getattr(destino, atributo) for atributo in atributos)
+        ))
+    return opcoes
+
+# Buscas em lote (?ids=1,2,3)
+def obter_ids():
+    """Lê o parâmetro ids das buscas em lote; None indica a listagem usual"""
+    valor = request.args.get('ids')
+    if valor is None:
+        return None
+    try:
+        ids = list(dict.fromkeys(int(parte) for parte in valor.split(',') if parte.strip()))
+    except ValueError:
+        raise ValueError('O parâmetro ids deve ser uma lista de números separados por vírgula')
+    if not ids:
+        raise ValueError('O parâmetro ids deve ser uma lista de números separados por vírgula')
+    if len(ids) > app.config['LOTE_MAXIMO_IDS']:
+        raise ValueError(f"No máximo {app.config['LOTE_MAXIMO_IDS']} ids por requisição")
+    return ids
+
+def resposta_por_ids(nome, ids, encontrados, serializar_lista):
+    """Resposta de uma busca em lote: os itens na ordem dos ids pedidos e os ids inexistentes"""
+    objetos = [encontrados[id_] for id_ in ids if id_ in encontrados]
+    nao_encontrados = [id_ for id_ in ids if id_ not in encontrados]
+    return resposta_condicional(objetos, lambda: {
+        nome: serializar_lista(objetos),
+        'nao_encontrados': nao_encontrados
+    }, extra={'nao_encontrados': nao_encontrados})
+
+# Exportação em fluxo (NDJSON/CSV)
+FORMATOS_EXPORTACAO = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+EXPORTACAO_LOTE = 1000
+
+def exportar(comando, formato, nome_arquivo, serializar=None):
+    """Transmite os resultados do select() linha a linha, sem carregá-los todos na memória.
+    
+    Com um serializador (campos parciais), as datas são escritas em ISO 8601, como no to_dict().
+    """
+    def gerar():
+        buffer = io.StringIO()
+        escritor = None
+        for numero, item in enumerate(db.session.scalars(comando.execution_options(yield_per=EXPORTACAO_LOTE)), start=1):
+            if serializar is None:
+                registro = item.to_dict()
+            else:
+                registro = {chave: valor.isoformat() if hasattr(valor, 'isoformat') else valor
+                            for chave, valor in serializar(item).items()}
+            if formato == 'csv':
+                if escritor is None:
+                    escritor = csv.DictWriter(buffer, fieldnames=list(registro))
+                    escritor.writeheader()
+                escritor.writerow(registro)
+            else:
+                buffer.write(json.dumps(registro, ensure_ascii=False))
+                buffer.write('\n')
+            
+            # Envia o que já foi serializado a cada lote
+            if numero % EXPORTACAO_LOTE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    
+    return Response(
+        stream_with_context(gerar()),
+        mimetype=FORMATOS_EXPORTACAO[formato],
+        headers={'Content-Disposition': f'attachment; filename={nome_arquivo}.{formato}'}
+    )
+
+def obter_formato_exportacao():
+    """Lê o parâmetro formato; None indica a resposta JSON usual"""
+    formato = request.args.get('formato')
+    if formato in (None, '', 'json'):
+        return None
+    if formato not in FORMATOS_EXPORTACAO:
+        raise ValueError('Formato inválido. Use json, ndjson ou csv')
+    return formato
+
+# Requisições condicionais (ETag / Last-Modified)
+def resposta_condicional(objetos, gerar_corpo, extra=None, colecao=True):
+    """Responde 304 se o cliente já tem a versão atual; senão serializa o corpo.
+    
+    A ETag é derivada dos ids e das datas de modificação dos objetos (e de dados extras,
+    como a paginação), então é calculada sem serializar nada. Coleções não levam
+    Last-Modified: excluir um item não muda a data de nenhum dos restantes, então só a
+    ETag (que muda com a lista de ids) diz se a listagem mudou.
+    """
+    marcas = []
+    ultima_modificacao = None
+    for objeto in objetos:
+        versoes = objeto.versoes()
+        marcas.append(f"{objeto.id}:{','.join(str(v) for v in versoes)}")
+        for versao in versoes:
+            if versao and (ultima_modificacao is None or versao > ultima_modificacao):
+                ultima_modificacao = versao
+    marcas.append(json.dumps(extra, sort_keys=True, default=str))
+    # Os mesmos objetos com outros campos (?campos=) são outra representação
+    if request.args.get('campos'):
+        marcas.append(request.args['campos'])
+    etag = hashlib.sha1('|'.join(marcas).encode()).hexdigest()
+    
+    if colecao:
+        ultima_modificacao = None
+    elif ultima_modificacao:
+        ultima_modificacao = ultima_modificacao.replace(microsecond=0, tzinfo=timezone.utc)
+    
+    # If-None-Match tem precedência sobre If-Modified-Since. A comparação é fraca, pois
+    # respostas comprimidas levam a ETag como fraca (W/"...")
+    if request.if_none_match:
+        nao_modificado = request.if_none_match.contains_weak(etag)
+    else:
+        nao_modificado = bool(
+            ultima_modificacao and request.if_modified_since
+            and ultima_modificacao <= request.if_modified_since
+        )
+    
+    response = app.response_class(status=304) if nao_modificado else jsonify(gerar_corpo())
+    response.set_etag(etag)
+    if ultima_modificacao:
+        response.last_modified = ultima_modificacao
+    return response
+
+# Compressão das respostas (gzip/brotli)
+def criar_compressor(codificacao, nivel):
+    """Retorna (comprimir, finalizar) para compressão incremental na codificação pedida"""
+    if codificacao == 'br':
+        compressor = brotli.Compressor(quality=nivel)
+        return (lambda dados: compressor.process(dados) + compressor.flush()), compressor.finish
+    # wbits 16 + MAX_WBITS gera o formato gzip (cabeçalho e CRC)
+    compressor = zlib.compressobj(nivel, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return (lambda dados: compressor.compress(dados) + compressor.flush(zlib.Z_SYNC_FLUSH)), compressor.flush
+
+def comprimir(dados, codificacao, nivel):
+    """Comprime um corpo completo"""
+    if codificacao == 'br':
+        return brotli.compress(dados, quality=nivel)
+    compressor = zlib.compressobj(nivel, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(dados) + compressor.flush()
+
+def comprimir_fluxo(pedacos, codificacao, nivel):
+    """Comprime uma resposta em fluxo pedaço a pedaço; cada pedaço é enviado assim que comprimido"""
+    comprimir_pedaco, finalizar = criar_compressor(codificacao, nivel)
+    try:
+        for pedaco in pedacos:
+            if isinstance(pedaco, str):
+                pedaco = pedaco.encode('utf-8')
+            if pedaco:
+                yield comprimir_pedaco(pedaco)
+        yield finalizar()
+    finally:
+        # Encerra o gerador original (e o contexto de stream_with_context)
+        if hasattr(pedacos, 'close'):
+            pedacos.close()
+
+def codificacao_aceita():
+    """Melhor codificação aceita pelo cliente (brotli tem preferência em caso de empate)"""
+    disponiveis = ['br', 'gzip'] if brotli is not None else ['gzip']
+    return request.accept_encodings.best_match(disponiveis)
+
+@app.after_request
+def comprimir_resposta(response):
+    if (not app.config['COMPRESSAO_HABILITADA'] or response.direct_passthrough
+            or response.mimetype not in app.config['COMPRESSAO_TIPOS']):
+        return response
+    response.vary.add('Accept-Encoding')
+    
+    if (response.status_code < 200 or response.status_code in (204, 206, 304)
+            or 'Content-Encoding' in response.headers or request.method == 'HEAD'):
+        return response
+    codificacao = codificacao_aceita()
+    if codificacao is None:
+        return response
+    nivel = app.config['COMPRESSAO_NIVEL_BROTLI' if codificacao == 'br' else 'COMPRESSAO_NIVEL_GZIP']
+    
+    if response.is_streamed:
+        response.response = comprimir_fluxo(response.response, codificacao, nivel)
+        response.headers.pop('Content-Length', None)
+    else:
+        dados = response.get_data()
+        # Corpos pequenos não compensam o custo da compressão
+        if len(dados) < app.config['COMPRESSAO_MINIMO_BYTES']:
+            return response
+        response.set_data(comprimir(dados, codificacao, nivel))
+    
+    response.headers['Content-Encoding'] = codificacao
+    # A representação comprimida não é idêntica byte a byte: a ETag passa a ser fraca
+    etag, fraca = response.get_etag()
+    if etag and not fraca:
+        response.set_etag(etag, weak=True)
+    return response
+
+# Autorização baseada nas claims do JWT
+UsuarioAtual = namedtuple('UsuarioAtual', ['id', 'tipo_usuario'])
+
+# Estado de autorização dos usuários (tipo e ativo), guardado por pouco tempo para
+# que desativações e mudanças de tipo valham sem consultar o banco a cada requisição
+_estado_usuarios = {}
+_estado_usuarios_lock = threading.Lock()
+
+def estado_usuario(usuario_id):
+    """Retorna (tipo_usuario, ativo) do usuário, usando o cache de curta duração"""
+    agora = time.monotonic()
+    with _estado_usuarios_lock:
+        item = _estado_usuarios.get(usuario_id)
+    if item and item[2] > agora:
+        return item[0], item[1]
+    
+    linha = db.session.query(Usuario.tipo_usuario, Usuario.ativo).filter_by(id=usuario_id).first()
+    tipo_usuario, ativo = linha if linha else (None, False)
+    with _estado_usuarios_lock:
+        _estado_usuarios[usuario_id] = (
+            tipo_usuario, ativo, agora + app.config['AUTORIZACAO_CACHE_TTL']
+        )
+    return tipo_usuario, ativo
+
+def invalidar_estado_usuario(usuario_id):
+    """Descarta o estado em cache do usuário após alterações de tipo ou remoção"""
+    with _estado_usuarios_lock:
+        _estado_usuarios.pop(usuario_id, None)
+
+def autorizar(*tipos, mensagem='Acesso não permitido para este tipo de usuário'):
+    """Exige JWT válido e, se informado, um dos tipos de usuário.
+    
+    O usuário autenticado fica disponível em g.usuario_atual.
+    """
+    def decorador(funcao):
+        @wraps(funcao)
+        @jwt_required()
+        def wrapper(*args, **kwargs):
+            usuario_id = int(get_jwt_identity())
+            tipo_usuario, ativo = estado_usuario(usuario_id)
+            
+            # Tokens de usuários desativados ou com tipo alterado deixam de valer
+            tipo_token = get_jwt().get('tipo_usuario', tipo_usuario)
+            if not ativo or tipo_token != tipo_usuario:
+                return jsonify({'erro': 'Sessão inválida. Faça login novamente'}), 401
+            
+            if tipos and tipo_usuario not in tipos:
+                return jsonify({'erro': mensagem}), 403
+            
+            g.usuario_atual = UsuarioAtual(usuario_id, tipo_usuario)
+            return funcao(*args, **kwargs)
+        return wrapper
+    return decorador
+
+# Verificação de senhas com concorrência limitada
+# O hash de senha é a parte mais cara do login; limitar quantos rodam ao mesmo tempo
+# evita que um pico de logins ocupe toda a CPU e atrase as demais requisições
+class ServidorOcupado(Exception):
+    """Não houve vaga para calcular o hash dentro do tempo limite"""
+
+_vagas_hash_senha = threading.BoundedSemaphore(app.config['SENHA_HASH_CONCORRENCIA'])
+
+def gerar_hash_senha(senha):
+    """Gera o hash da senha com o método e custo configurados"""
+    return generate_password_hash(senha, method=app.config['SENHA_HASH_METODO'])
+
+# Prefixo (método e custo) dos hashes gerados com a configuração atual. Vem de um hash de
+# verdade porque SENHA_HASH_METODO pode omitir o custo (ex.: 'pbkdf2:sha256', 'scrypt'),
+# que o werkzeug completa com o padrão dele
+PREFIXO_HASH_SENHA = gerar_hash_senha('').split('$', 1)[0]
+
+def verificar_senha(usuario, senha):
+    """Confere a senha do usuário e refaz o hash se o custo configurado mudou.
+    
+    Encerra a transação de leitura antes do hash, para não segurar o banco durante a
+    espera na fila e o cálculo; a regravação do hash abre uma transação nova."""
+    senha_hash = usuario.senha_hash
+    db.session.rollback()
+    
+    if not _vagas_hash_senha.acquire(timeout=app.config['SENHA_HASH_FILA_TIMEOUT']):
+        raise ServidorOcupado('Servidor ocupado, tente novamente em instantes')
+    try:
+        if not check_password_hash(senha_hash, senha):
+            return False
+        
+        # O prefixo do hash guarda método e custo (ex.: pbkdf2:sha256:600000)
+        novo_hash = None
+        if senha_hash.split('$', 1)[0] != PREFIXO_HASH_SENHA:
+            novo_hash = gerar_hash_senha(senha)
+    finally:
+        _vagas_hash_senha.release()
+    
+    if novo_hash:
+        usuario.senha_hash = novo_hash
+        db.session.commit()
+    return True
 
 # Rotas de Autenticação
 @app.route('/api/auth/login', methods=['POST'])
@@ -162,8 +1461,11 @@ def login():
         
         usuario = Usuario.query.filter_by(email=data['email'], ativo=True).first()
         
-        if usuario and check_password_hash(usuario.senha_hash, data['senha']):
-            access_token = create_access_token(identity=str(usuario.id))
+        if usuario and verificar_senha(usuario, data['senha']):
+            access_token = create_access_token(
+                identity=str(usuario.id),
+                additional_claims={'tipo_usuario': usuario.tipo_usuario, 'ativo': usuario.ativo}
+            )
             return jsonify({
                 'mensagem': 'Login realizado com sucesso',
                 'access_token': access_token,
@@ -171,22 +1473,19 @@ def login():
             }), 200
         else:
             return jsonify({'erro': 'Credenciais inválidas'}), 401
+    
+    except ServidorOcupado as e:
+        return jsonify({'erro': str(e)}), 503, {'Retry-After': '1'}
             
     except Exception as e:
         return jsonify({'erro': f'Erro interno do servidor: {str(e)}'}), 500
 
 # Rotas de Usuários
 @app.route('/api/usuarios', methods=['POST'])
-@jwt_required()
+@autorizar('admin', mensagem='Apenas administradores podem criar usuários')
 def criar_usuario():
     try:
         data = request.get_json()
-        usuario_atual_id = get_jwt_identity()
-        usuario_atual = Usuario.query.get(usuario_atual_id)
-        
-        # Verificar se o usuário atual é admin
-        if usuario_atual.tipo_usuario != 'admin':
-            return jsonify({'erro': 'Apenas administradores podem criar usuários'}), 403
         
         # Validar dados obrigatórios
         campos_obrigatorios = ['nome', 'email', 'senha', 'tipo_usuario']
@@ -202,7 +1501,7 @@ def criar_usuario():
         novo_usuario = Usuario(
             nome=data['nome'],
             email=data['email'],
-            senha_hash=generate_password_hash(data['senha']),
+            senha_hash=gerar_hash_senha(data['senha']),
             tipo_usuario=data['tipo_usuario'],
             telefone=data.get('telefone'),
             endereco=data.get('endereco')
@@ -222,6 +1521,7 @@ def criar_usuario():
 
 @app.route('/api/usuarios', methods=['GET'])
 @jwt_required()
+@rota_de_leitura
 def listar_usuarios():
     try:
         # Parâmetros de paginação
@@ -233,8 +1533,16 @@ def listar_usuarios():
         if por_pagina > 100:
             por_pagina = 100
         
-        # Query base
-        query = Usuario.query.filter_by(ativo=True)
+        # Busca em lote por ids, passando pelo cache de entidades
+        campos = obter_campos(serializar_usuario)
+        ids = obter_ids()
+        if ids:
+            usuarios = yield from obter_varios_em_cache(Usuario, ids)
+            return resposta_por_ids('usuarios', ids, usuarios,
+                                    lambda usuarios: [usuario.to_dict(campos) for usuario in usuarios])
+        
+        # Query base, com apenas as colunas dos campos pedidos
+        query = select(Usuario).filter_by(ativo=True).options(*opcoes_de_campos(Usuario, serializar_usuario, campos))
         
         # Filtrar por tipo de usuário
         if tipo_usuario:
@@ -242,48 +1550,63 @@ def listar_usuarios():
                 return jsonify({'erro': 'Tipo de usuário inválido'}), 400
             query = query.filter(Usuario.tipo_usuario == tipo_usuario)
         
+        # Paginação por cursor (opcional)
+        if 'cursor' in request.args:
+            usuarios, paginacao = yield from paginar_por_cursor(
+                query, [Usuario.id], request.args.get('cursor'), obter_limite()
+            )
+            return resposta_condicional(usuarios, lambda: {
+                'usuarios': serializar_usuario.parcial(campos).lista(usuarios),
+                'paginacao': paginacao
+            }, extra=paginacao)
+        
         # Paginação
-        paginacao = query.paginate(
-            page=pagina, 
-            per_page=por_pagina, 
-            error_out=False
-        )
+        paginacao = yield from paginar(query, pagina, por_pagina)
+        
+        dados_paginacao = {
+            'pagina_atual': paginacao.page,
+            'total_paginas': paginacao.pages,
+            'total_itens': paginacao.total,
+            'itens_por_pagina': por_pagina,
+            'tem_proxima': paginacao.has_next,
+            'tem_anterior': paginacao.has_prev
+        }
         
-        return jsonify({
-            'usuarios': [usuario.to_dict() for usuario in paginacao.items],
-            'paginacao': {
-                'pagina_atual': paginacao.page,
-                'total_paginas': paginacao.pages,
-                'total_itens': paginacao.total,
-                'itens_por_pagina': por_pagina,
-                'tem_proxima': paginacao.has_next,
-                'tem_anterior': paginacao.has_prev
-            }
-        }), 200
+        return resposta_condicional(paginacao.items, lambda: {
+            'usuarios': serializar_usuario.parcial(campos).lista(paginacao.items),
+            'paginacao': dados_paginacao
+        }, extra=dados_paginacao)
         
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
     except Exception as e:
         return jsonify({'erro': f'Erro interno do servidor: {str(e)}'}), 500
 
 @app.route('/api/usuarios/<int:usuario_id>', methods=['GET'])
 @jwt_required()
+@rota_de_leitura
 def obter_usuario(usuario_id):
     try:
-        usuario = Usuario.query.get_or_404(usuario_id)
-        return jsonify({'usuario': usuario.to_dict()}), 200
-        
+        campos = obter_campos(serializar_usuario)
+        usuario = yield from obter_em_cache(Usuario, usuario_id)
+        if not usuario:
+            return jsonify({'erro': 'Usuário não encontrado'}), 404
+        return resposta_condicional([usuario], lambda: {'usuario': usuario.to_dict(campos)}, colecao=False)
+        
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
     except Exception as e:
         return jsonify({'erro': f'Erro interno do servidor: {str(e)}'}), 500
 
 @app.route('/api/usuarios/<int:usuario_id>', methods=['PUT'])
-@jwt_required()
+@autorizar()
 def atualizar_usuario(usuario_id):
     try:
         data = request.get_json()
-        usuario_atual_id = get_jwt_identity()
-        usuario_atual = Usuario.query.get(usuario_atual_id)
+        usuario_atual = g.usuario_atual
         
         # Verificar se o usuário atual é admin ou está atualizando seu próprio perfil
-        if usuario_atual.tipo_usuario != 'admin' and usuario_atual_id != usuario_id:
+        if usuario_atual.tipo_usuario != 'admin' and usuario_atual.id != usuario_id:
             return jsonify({'erro': 'Você só pode atualizar seu próprio perfil'}), 403
         
         usuario = Usuario.query.get_or_404(usuario_id)
@@ -298,7 +1621,7 @@ def atualizar_usuario(usuario_id):
                 return jsonify({'erro': 'Email já cadastrado'}), 400
             usuario.email = data['email']
         if 'senha' in data:
-            usuario.senha_hash = generate_password_hash(data['senha'])
+            usuario.senha_hash = gerar_hash_senha(data['senha'])
         if 'tipo_usuario' in data and usuario_atual.tipo_usuario == 'admin':
             usuario.tipo_usuario = data['tipo_usuario']
         if 'telefone' in data:
@@ -307,6 +1630,7 @@ def atualizar_usuario(usuario_id):
             usuario.endereco = data['endereco']
         
         db.session.commit()
+        invalidar_estado_usuario(usuario_id)
         
         return jsonify({
             'mensagem': 'Usuário atualizado com sucesso',
@@ -318,21 +1642,15 @@ def atualizar_usuario(usuario_id):
         return jsonify({'erro': f'Erro interno do servidor: {str(e)}'}), 500
 
 @app.route('/api/usuarios/<int:usuario_id>', methods=['DELETE'])
-@jwt_required()
+@autorizar('admin', mensagem='Apenas administradores podem remover usuários')
 def remover_usuario(usuario_id):
     try:
-        usuario_atual_id = get_jwt_identity()
-        usuario_atual = Usuario.query.get(usuario_atual_id)
-        
-        # Verificar se o usuário atual é admin
-        if usuario_atual.tipo_usuario != 'admin':
-            return jsonify({'erro': 'Apenas administradores podem remover usuários'}), 403
-        
         usuario = Usuario.query.get_or_404(usuario_id)
         
         # Soft delete - marcar como inativo
         usuario.ativo = False
         db.session.commit()
+        invalidar_estado_usuario(usuario_id)
         
         return jsonify({'mensagem': 'Usuário removido com sucesso'}), 200
         
@@ -357,8 +1675,8 @@ def criar_paciente():
         if not validar_cpf(data['cpf']):
             return jsonify({'erro': 'CPF inválido'}), 400
         
-        # Verificar se CPF já existe
-        if Paciente.query.filter_by(cpf=data['cpf']).first():
+        # Verificar se CPF já existe (em qualquer formatação)
+        if Paciente.buscar_por_cpf(data['cpf']):
             return jsonify({'erro': 'CPF já cadastrado'}), 400
         
         # Criar novo paciente
@@ -383,8 +1701,187 @@ def criar_paciente():
         db.session.rollback()
         return jsonify({'erro': f'Erro interno do servidor: {str(e)}'}), 500
 
+# Importação de pacientes em lote
+CAMPOS_IMPORTACAO_PACIENTE = ['nome', 'cpf', 'data_nascimento', 'telefone', 'email', 'endereco']
+
+def ler_registros_importacao(formato):
+    """Lê os registros do corpo da requisição linha a linha, sem carregá-lo inteiro na memória"""
+    texto = io.TextIOWrapper(request.stream, encoding='utf-8-sig', newline='')
+    
+    if formato == 'csv':
+        # A linha 1 é o cabeçalho
+        for numero, registro in enumerate(csv.DictReader(texto), start=2):
+            yield numero, registro
+        return
+    
+    for numero, linha in enumerate(texto, start=1):
+        if not linha.strip():
+            continue
+        try:
+            registro = json.loads(linha)
+        except ValueError:
+            registro = None
+        yield numero, registro
+
+def preparar_paciente_importacao(registro, cpf_valido):
+    """Valida um registro importado e retorna (erro, linha para inserção)"""
+    if not isinstance(registro, dict):
+        return 'Registro inválido', None
+    
+    for campo in ['nome', 'cpf', 'data_nascimento']:
+        if not registro.get(campo):
+            return f'Campo {campo} é obrigatório', None
+    
+    # Campos de texto: tipo e tamanho das colunas (o CPF também pode vir como número)
+    for campo in CAMPOS_IMPORTACAO_PACIENTE:
+        valor = registro.get(campo)
+        if campo == 'data_nascimento' or valor is None:
+            continue
+        if campo == 'cpf' and isinstance(valor, int) and not isinstance(valor, bool):
+            continue
+        if not isinstance(valor, str):
+            return f'Campo {campo} deve ser texto', None
+        tamanho = Paciente.__table__.c[campo].type.length
+        if len(valor) > tamanho:
+            return f'Campo {campo} deve ter no máximo {tamanho} caracteres', None
+    
+    if not cpf_valido:
+        return 'CPF inválido', None
+    
+    try:
+        data_nascimento = datetime.strptime(registro['data_nascimento'], '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return 'Formato de data inválido. Use YYYY-MM-DD', None
+    
+    linha = {campo: registro.get(campo) or None for campo in CAMPOS_IMPORTACAO_PACIENTE}
+    linha['cpf'] = str(registro['cpf'])
+    linha['cpf_normalizado'] = normalizar_cpf(linha['cpf'])
+    linha['data_nascimento'] = data_nascimento
+    return None, linha
+
+def registrar_erro_importacao(relatorio, numero, erro):
+    """Conta o erro da linha; só os primeiros IMPORTACAO_MAXIMO_ERROS são detalhados"""
+    relatorio['rejeitados'] += 1
+    if len(relatorio['erros']) < app.config['IMPORTACAO_MAXIMO_ERROS']:
+        relatorio['erros'].append({'linha': numero, 'erro': erro})
+
+def importar_lote_pacientes(lote, relatorio):
+    """Valida e insere um lote de registros, somando o resultado ao relatório"""
+    # CPFs do lote validados de uma só vez
+    cpfs_validos = validar_cpfs([
+        str(registro.get('cpf')) if isinstance(registro, dict) else None
+        for _, registro in lote
+    ])
+    
+    validos = []
+    for (numero, registro), cpf_valido in zip(lote, cpfs_validos):
+        erro, linha = preparar_paciente_importacao(registro, cpf_valido)
+        if erro:
+            registrar_erro_importacao(relatorio, numero, erro)
+        else:
+            validos.append((numero, linha))
+    
+    if not validos:
+        return
+    
+    # Uma única consulta por lote para achar CPFs já cadastrados
+    cpfs = [linha['cpf_normalizado'] for _, linha in validos]
+    vistos = {
+        cpf for (cpf,) in db.session.query(Paciente.cpf_normalizado).filter(
+            Paciente.cpf_normalizado.in_(cpfs)
+        )
+    }
+    
+    novos = []
+    for numero, linha in validos:
+        if linha['cpf_normalizado'] in vistos:
+            registrar_erro_importacao(relatorio, numero, 'CPF já cadastrado')
+            continue
+        vistos.add(linha['cpf_normalizado'])
+        novos.append((numero, linha))
+    
+    if not novos:
+        return
+    try:
+        db.session.execute(insert(Paciente), [linha for _, linha in novos])
+        db.session.commit()
+        relatorio['importados'] += len(novos)
+    except IntegrityError:
+        # Outro cadastro gravou um destes CPFs depois da verificação: o lote é
+        # refeito linha a linha, e só as linhas em conflito são rejeitadas
+        db.session.rollback()
+        for numero, linha in novos:
+            try:
+                db.session.execute(insert(Paciente), [linha])
+                db.session.commit()
+                relatorio['importados'] += 1
+            except IntegrityError:
+                db.session.rollback()
+                registrar_erro_importacao(relatorio, numero, 'CPF já cadastrado')
+
+@app.route('/api/pacientes/lote', methods=['POST'])
+@jwt_required()
+def importar_pacientes():
+    # Os lotes já gravados continuam gravados; o relatório parcial volta mesmo em caso de erro
+    relatorio = {'importados': 0, 'rejeitados': 0, 'erros': []}
+    try:
+        formato = request.args.get('formato')
+        if not formato:
+            formato = 'csv' if request.mimetype == 'text/csv' else 'ndjson'
+        if formato not in ['ndjson', 'csv']:
+            return jsonify({'erro': 'Formato inválido. Use ndjson ou csv'}), 400
+        
+        tamanho_lote = request.args.get('lote', app.config['IMPORTACAO_LOTE_TAMANHO'], type=int)
+        tamanho_lote = max(1, min(tamanho_lote, 5000))
+        
+        lote = []
+        for numero, registro in ler_registros_importacao(formato):
+            lote.append((numero, registro))
+            if len(lote) >= tamanho_lote:
+                importar_lote_pacientes(lote, relatorio)
+                lote = []
+        if lote:
+            importar_lote_pacientes(lote, relatorio)
+        
+        return jsonify({'mensagem': 'Importação concluída', **relatorio}), 200
+        
+    except UnicodeDecodeError:
+        db.session.rollback()
+        return jsonify({'erro': 'O arquivo deve estar em UTF-8', **relatorio}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'erro': f'Erro interno do servidor: {str(e)}', **relatorio}), 500
+
+LIMITE_VALIDACAO_CPF = 10000
+
+@app.route('/api/pacientes/validar-cpf', methods=['POST'])
+@jwt_required()
+def validar_cpfs_em_lote():
+    try:
+        data = request.get_json()
+        
+        cpfs = data.get('cpfs') if isinstance(data, dict) else None
+        if not isinstance(cpfs, list):
+            return jsonify({'erro': 'Campo cpfs é obrigatório e deve ser uma lista'}), 400
+        if len(cpfs) > LIMITE_VALIDACAO_CPF:
+            return jsonify({'erro': f'Envie no máximo {LIMITE_VALIDACAO_CPF} CPFs por requisição'}), 400
+        
+        mascara = validar_cpfs(cpfs)
+        
+        return jsonify({
+            'resultados': [
+                {'cpf': cpf, 'valido': bool(valido)} for cpf, valido in zip(cpfs, mascara)
+            ],
+            'validos': int(mascara.sum()),
+            'invalidos': int(len(cpfs) - mascara.sum())
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'erro': f'Erro interno do servidor: {str(e)}'}), 500
+
 @app.route('/api/pacientes', methods=['GET'])
 @jwt_required()
+@rota_de_leitura
 def listar_pacientes():
     try:
         # Parâmetros de paginação
@@ -395,38 +1892,68 @@ def listar_pacientes():
         if por_pagina > 100:
             por_pagina = 100
         
-        # Query base
-        query = Paciente.query.filter_by(ativo=True)
+        # Busca em lote por ids, passando pelo cache de entidades
+        campos = obter_campos(serializar_paciente)
+        ids = obter_ids()
+        if ids:
+            pacientes = yield from obter_varios_em_cache(Paciente, ids)
+            return resposta_por_ids('pacientes', ids, pacientes,
+                                    lambda pacientes: [paciente.to_dict(campos) for paciente in pacientes])
+        
+        # Query base, com apenas as colunas dos campos pedidos
+        query = select(Paciente).filter_by(ativo=True).options(*opcoes_de_campos(Paciente, serializar_paciente, campos))
+        
+        # Exportação de todos os pacientes ativos (opcional)
+        formato = obter_formato_exportacao()
+        if formato:
+            return exportar(query.order_by(Paciente.id), formato, 'pacientes',
+                            serializar_paciente.parcial(campos) if campos else None)
+        
+        # Paginação por cursor (opcional)
+        if 'cursor' in request.args:
+            pacientes, paginacao = yield from paginar_por_cursor(
+                query, [Paciente.id], request.args.get('cursor'), obter_limite()
+            )
+            return resposta_condicional(pacientes, lambda: {
+                'pacientes': serializar_paciente.parcial(campos).lista(pacientes),
+                'paginacao': paginacao
+            }, extra=paginacao)
         
         # Paginação
-        paginacao = query.paginate(
-            page=pagina, 
-            per_page=por_pagina, 
-            error_out=False
-        )
+        paginacao = yield from paginar(query, pagina, por_pagina)
+        
+        dados_paginacao = {
+            'pagina_atual': paginacao.page,
+            'total_paginas': paginacao.pages,
+            'total_itens': paginacao.total,
+            'itens_por_pagina': por_pagina,
+            'tem_proxima': paginacao.has_next,
+            'tem_anterior': paginacao.has_prev
+        }
         
-        return jsonify({
-            'pacientes': [paciente.to_dict() for paciente in paginacao.items],
-            'paginacao': {
-                'pagina_atual': paginacao.page,
-                'total_paginas': paginacao.pages,
-                'total_itens': paginacao.total,
-                'itens_por_pagina': por_pagina,
-                'tem_proxima': paginacao.has_next,
-                'tem_anterior': paginacao.has_prev
-            }
-        }), 200
+        return resposta_condicional(paginacao.items, lambda: {
+            'pacientes': serializar_paciente.parcial(campos).lista(paginacao.items),
+            'paginacao': dados_paginacao
+        }, extra=dados_paginacao)
         
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
     except Exception as e:
         return jsonify({'erro': f'Erro interno do servidor: {str(e)}'}), 500
 
 @app.route('/api/pacientes/<int:paciente_id>', methods=['GET'])
 @jwt_required()
+@rota_de_leitura
 def obter_paciente(paciente_id):
     try:
-        paciente = Paciente.query.get_or_404(paciente_id)
-        return jsonify({'paciente': paciente.to_dict()}), 200
+        campos = obter_campos(serializar_paciente)
+        paciente = yield from obter_em_cache(Paciente, paciente_id)
+        if not paciente:
+            return jsonify({'erro': 'Paciente não encontrado'}), 404
+        return resposta_condicional([paciente], lambda: {'paciente': paciente.to_dict(campos)}, colecao=False)
         
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
     except Exception as e:
         return jsonify({'erro': f'Erro interno do servidor: {str(e)}'}), 500
 
@@ -446,7 +1973,7 @@ def atualizar_paciente(paciente_id):
                 return jsonify({'erro': 'CPF inválido'}), 400
             
             # Verificar se CPF já existe em outro paciente
-            paciente_existente = Paciente.query.filter_by(cpf=data['cpf']).first()
+            paciente_existente = Paciente.buscar_por_cpf(data['cpf'])
             if paciente_existente and paciente_existente.id != paciente_id:
                 return jsonify({'erro': 'CPF já cadastrado'}), 400
             paciente.cpf = data['cpf']
@@ -471,16 +1998,10 @@ def atualizar_paciente(paciente_id):
         return jsonify({'erro': f'Erro interno do servidor: {str(e)}'}), 500
 
 @app.route('/api/pacientes/<int:paciente_id>', methods=['DELETE'])
-@jwt_required()
+@autorizar('admin', 'recepcionista',
+           mensagem='Apenas administradores e recepcionistas podem remover pacientes')
 def remover_paciente(paciente_id):
     try:
-        usuario_atual_id = get_jwt_identity()
-        usuario_atual = Usuario.query.get(usuario_atual_id)
-        
-        # Verificar se o usuário atual é admin ou recepcionista
-        if usuario_atual.tipo_usuario not in ['admin', 'recepcionista']:
-            return jsonify({'erro': 'Apenas administradores e recepcionistas podem remover pacientes'}), 403
-        
         paciente = Paciente.query.get_or_404(paciente_id)
         
         # Soft delete - marcar como inativo
@@ -495,22 +2016,60 @@ def remover_paciente(paciente_id):
 
 @app.route('/api/pacientes/buscar', methods=['GET'])
 @jwt_required()
+@rota_de_leitura
 def buscar_pacientes():
     try:
-        query = request.args.get('q', '')
+        query = request.args.get('q', '').strip()
         if not query:
             return jsonify({'erro': 'Parâmetro de busca é obrigatório'}), 400
         
-        # Buscar por nome ou CPF
-        pacientes = Paciente.query.filter(
-            Paciente.ativo == True,
-            (Paciente.nome.contains(query)) | (Paciente.cpf.contains(query))
-        ).all()
+        # Parâmetros de paginação
+        pagina = max(request.args.get('pagina', 1, type=int), 1)
+        por_pagina = request.args.get('por_pagina', 20, type=int)
         
-        return jsonify({
-            'pacientes': [paciente.to_dict() for paciente in pacientes]
-        }), 200
+        # Limitar o número de itens por página
+        por_pagina = max(1, min(por_pagina, 100))
+        
+        deslocamento = (pagina - 1) * por_pagina
+        campos = obter_campos(serializar_paciente)
+        opcoes = opcoes_de_campos(Paciente, serializar_paciente, campos)
+        
+        # Buscar um item a mais para saber se existe próxima página
+        if re.search(r'[^\W\d_]', query):
+            # Texto com letras: busca por nome no índice textual
+            pacientes = yield from buscar_pacientes_por_nome(query, por_pagina + 1, deslocamento, opcoes)
+        else:
+            # Apenas números e pontuação: busca pelo CPF normalizado, usando o índice único
+            digitos = normalizar_cpf(query)
+            query_cpf = select(Paciente).options(*opcoes).filter(Paciente.ativo == True)
+            if len(digitos) == 11:
+                # CPF completo: igualdade exata
+                query_cpf = query_cpf.filter(Paciente.cpf_normalizado == digitos)
+            else:
+                # CPF parcial: faixa de prefixo (':' é o caractere seguinte a '9')
+                query_cpf = query_cpf.filter(
+                    Paciente.cpf_normalizado >= digitos,
+                    Paciente.cpf_normalizado < digitos + ':'
+                )
+            pacientes = yield 'todos', query_cpf.order_by(Paciente.cpf_normalizado).limit(
+                por_pagina + 1
+            ).offset(deslocamento)
+        
+        dados_paginacao = {
+            'pagina_atual': pagina,
+            'itens_por_pagina': por_pagina,
+            'tem_proxima': len(pacientes) > por_pagina,
+            'tem_anterior': pagina > 1
+        }
+        pacientes = pacientes[:por_pagina]
         
+        return resposta_condicional(pacientes, lambda: {
+            'pacientes': serializar_paciente.parcial(campos).lista(pacientes),
+            'paginacao': dados_paginacao
+        }, extra=dados_paginacao)
+        
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
     except Exception as e:
         return jsonify({'erro': f'Erro interno do servidor: {str(e)}'}), 500
 
@@ -527,20 +2086,30 @@ def criar_consulta():
             if not data.get(campo):
                 return jsonify({'erro': f'Campo {campo} é obrigatório'}), 400
         
-        # Verificar se paciente e médico existem
-        paciente = Paciente.query.get(data['paciente_id'])
-        medico = Usuario.query.get(data['medico_id'])
+        # Verificar se paciente e médico existem, direto no banco (dentro da transação de
+        # escrita), e não no cache, que pode estar atrás de outro processo
+        paciente = db.session.get(Paciente, data['paciente_id'])
+        medico = db.session.get(Usuario, data['medico_id'])
         
         if not paciente:
             return jsonify({'erro': 'Paciente não encontrado'}), 404
         if not medico or medico.tipo_usuario != 'medico':
             return jsonify({'erro': 'Médico não encontrado'}), 404
         
+        data_consulta = datetime.strptime(data['data_consulta'], '%Y-%m-%d %H:%M')
+        duracao_minutos = validar_duracao(data.get('duracao_minutos', app.config['DURACAO_PADRAO_CONSULTA']))
+        
+        # Verificar se o médico já tem consulta no horário
+        conflito = buscar_conflito(data['medico_id'], data_consulta, duracao_minutos)
+        if conflito:
+            return jsonify({'erro': 'O médico já possui consulta neste horário', 'consulta_conflitante': conflito}), 409
+        
         # Criar nova consulta
         nova_consulta = Consulta(
             paciente_id=data['paciente_id'],
             medico_id=data['medico_id'],
-            data_consulta=datetime.strptime(data['data_consulta'], '%Y-%m-%d %H:%M'),
+            data_consulta=data_consulta,
+            duracao_minutos=duracao_minutos,
             tipo_consulta=data['tipo_consulta'],
             observacoes=data.get('observacoes')
         )
@@ -553,12 +2122,16 @@ def criar_consulta():
             'consulta': nova_consulta.to_dict()
         }), 201
         
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'erro': str(e)}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'erro': f'Erro interno do servidor: {str(e)}'}), 500
 
 @app.route('/api/consultas', methods=['GET'])
 @jwt_required()
+@rota_de_leitura
 def listar_consultas():
     try:
         # Parâmetros de paginação
@@ -569,53 +2142,78 @@ def listar_consultas():
         if por_pagina > 100:
             por_pagina = 100
         
-        # Query base
-        query = Consulta.query
-        
-        # Paginação
-        paginacao = query.paginate(
-            page=pagina, 
-            per_page=por_pagina, 
-            error_out=False
-        )
+        # Query base, com apenas as colunas (e os nomes) dos campos pedidos
+        campos = obter_campos(serializar_consulta)
+        query = Consulta.select_com_nomes(campos)
+        
+        # Busca em lote por ids, em um único SELECT ... WHERE id IN (...)
+        ids = obter_ids()
+        if ids:
+            consultas = {consulta.id: consulta for consulta in (yield 'todos', query.filter(Consulta.id.in_(ids)))}
+            return resposta_por_ids('consultas', ids, consultas, serializar_consulta.parcial(campos).lista)
+        
+        # Paginação por cursor (opcional)
+        if 'cursor' in request.args:
+            consultas, paginacao = yield from paginar_por_cursor(
+                query,
+                [Consulta.data_consulta, Consulta.id],
+                request.args.get('cursor'),
+                obter_limite()
+            )
+            return resposta_condicional(consultas, lambda: {
+                'consultas': serializar_consulta.parcial(campos).lista(consultas),
+                'paginacao': paginacao
+            }, extra=paginacao)
+        
+        # Paginação, em ordem de data (como no cursor), pelo índice idx_consultas_data
+        paginacao = yield from paginar(query.order_by(Consulta.data_consulta, Consulta.id), pagina, por_pagina)
+        
+        dados_paginacao = {
+            'pagina_atual': paginacao.page,
+            'total_paginas': paginacao.pages,
+            'total_itens': paginacao.total,
+            'itens_por_pagina': por_pagina,
+            'tem_proxima': paginacao.has_next,
+            'tem_anterior': paginacao.has_prev
+        }
         
-        return jsonify({
-            'consultas': [consulta.to_dict() for consulta in paginacao.items],
-            'paginacao': {
-                'pagina_atual': paginacao.page,
-                'total_paginas': paginacao.pages,
-                'total_itens': paginacao.total,
-                'itens_por_pagina': por_pagina,
-                'tem_proxima': paginacao.has_next,
-                'tem_anterior': paginacao.has_prev
-            }
-        }), 200
+        return resposta_condicional(paginacao.items, lambda: {
+            'consultas': serializar_consulta.parcial(campos).lista(paginacao.items),
+            'paginacao': dados_paginacao
+        }, extra=dados_paginacao)
         
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
     except Exception as e:
         return jsonify({'erro': f'Erro interno do servidor: {str(e)}'}), 500
 
 @app.route('/api/consultas/<int:consulta_id>', methods=['GET'])
 @jwt_required()
+@rota_de_leitura
 def obter_consulta(consulta_id):
     try:
-        consulta = Consulta.query.get_or_404(consulta_id)
-        return jsonify({'consulta': consulta.to_dict()}), 200
-        
+        campos = obter_campos(serializar_consulta)
+        consulta = yield 'primeiro', Consulta.select_com_nomes(campos).filter(Consulta.id == consulta_id)
+        if not consulta:
+            return jsonify({'erro': 'Consulta não encontrada'}), 404
+        return resposta_condicional([consulta], lambda: {'consulta': serializar_consulta.parcial(campos)(consulta)}, colecao=False)
+        
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
     except Exception as e:
         return jsonify({'erro': f'Erro interno do servidor: {str(e)}'}), 500
 
 @app.route('/api/consultas/<int:consulta_id>', methods=['PUT'])
-@jwt_required()
+@autorizar()
 def atualizar_consulta(consulta_id):
     try:
         data = request.get_json()
-        usuario_atual_id = get_jwt_identity()
-        usuario_atual = Usuario.query.get(usuario_atual_id)
+        usuario_atual = g.usuario_atual
         
         consulta = Consulta.query.get_or_404(consulta_id)
         
         # Verificar se o usuário pode atualizar a consulta
-        if usuario_atual.tipo_usuario not in ['admin', 'medico'] and consulta.medico_id != usuario_atual_id:
+        if usuario_atual.tipo_usuario not in ['admin', 'medico'] and consulta.medico_id != usuario_atual.id:
             return jsonify({'erro': 'Você só pode atualizar suas próprias consultas'}), 403
         
         # Atualizar campos
@@ -636,6 +2234,9 @@ def atualizar_consulta(consulta_id):
         if 'data_consulta' in data:
             consulta.data_consulta = datetime.strptime(data['data_consulta'], '%Y-%m-%d %H:%M')
         
+        if 'duracao_minutos' in data:
+            consulta.duracao_minutos = validar_duracao(data['duracao_minutos'])
+        
         if 'tipo_consulta' in data:
             consulta.tipo_consulta = data['tipo_consulta']
         
@@ -647,6 +2248,17 @@ def atualizar_consulta(consulta_id):
                 return jsonify({'erro': 'Status inválido'}), 400
             consulta.status = data['status']
         
+        # Verificar conflito de horário se a agenda do médico foi alterada
+        alterou_agenda = any(campo in data for campo in ['medico_id', 'data_consulta', 'duracao_minutos', 'status'])
+        if alterou_agenda and consulta.status != 'cancelada':
+            with db.session.no_autoflush:
+                conflito = buscar_conflito(
+                    consulta.medico_id, consulta.data_consulta, consulta.duracao_minutos, consulta.id
+                )
+            if conflito:
+                db.session.rollback()
+                return jsonify({'erro': 'O médico já possui consulta neste horário', 'consulta_conflitante': conflito}), 409
+        
         db.session.commit()
         
         return jsonify({
@@ -654,21 +2266,99 @@ def atualizar_consulta(consulta_id):
             'consulta': consulta.to_dict()
         }), 200
         
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'erro': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'erro': f'Erro interno do servidor: {str(e)}'}), 500
+
+# Transições de status em lote: status de destino -> status de origem permitidos.
+# Voltar para 'agendada' exige verificar conflitos de agenda e continua sendo feito
+# consulta a consulta, pelo PUT /api/consultas/<id>
+TRANSICOES_STATUS_LOTE = {
+    'realizada': ('agendada',),
+    'cancelada': ('agendada',),
+}
+
+@app.route('/api/consultas/status-lote', methods=['PUT'])
+@autorizar()
+def atualizar_status_em_lote():
+    try:
+        data = request.get_json(silent=True) or {}
+        usuario_atual = g.usuario_atual
+        ids = data.get('ids')
+        status = data.get('status')
+        
+        if status not in TRANSICOES_STATUS_LOTE:
+            return jsonify({'erro': f"Status inválido. Use: {', '.join(TRANSICOES_STATUS_LOTE)}"}), 400
+        if (not isinstance(ids, list) or not ids
+                or not all(isinstance(id_, int) and not isinstance(id_, bool) for id_ in ids)):
+            return jsonify({'erro': 'Informe ids: uma lista de ids de consultas'}), 400
+        ids = list(dict.fromkeys(ids))
+        if len(ids) > app.config['LOTE_MAXIMO_IDS']:
+            return jsonify({'erro': f"No máximo {app.config['LOTE_MAXIMO_IDS']} consultas por requisição"}), 400
+        
+        # Situação atual de todas as consultas em um único SELECT
+        atuais = {
+            linha.id: linha for linha in db.session.query(
+                Consulta.id, Consulta.status, Consulta.medico_id
+            ).filter(Consulta.id.in_(ids))
+        }
+        
+        # Mesma regra de permissão do PUT individual
+        restrito = usuario_atual.tipo_usuario not in ['admin', 'medico']
+        origens = TRANSICOES_STATUS_LOTE[status]
+        resultados = []
+        atualizar = []
+        for id_ in ids:
+            atual = atuais.get(id_)
+            if atual is None:
+                resultados.append({'id': id_, 'resultado': 'nao_encontrada'})
+            elif restrito and atual.medico_id != usuario_atual.id:
+                resultados.append({'id': id_, 'resultado': 'sem_permissao'})
+            elif atual.status == status:
+                resultados.append({'id': id_, 'resultado': 'inalterada'})
+            elif atual.status not in origens:
+                resultados.append({'id': id_, 'resultado': 'transicao_invalida', 'status_atual': atual.status})
+            else:
+                resultados.append({'id': id_, 'resultado': 'atualizada'})
+                atualizar.append(id_)
+        
+        if atualizar:
+            # Um único UPDATE; a condição de origem se repete para não sobrescrever
+            # uma alteração feita por outra requisição desde o SELECT
+            alteradas = db.session.execute(
+                update(Consulta)
+                .where(Consulta.id.in_(atualizar), Consulta.status.in_(origens))
+                .values(status=status, atualizado_em=datetime.utcnow())
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if alteradas != len(atualizar):
+                db.session.rollback()
+                return jsonify({'erro': 'Consultas alteradas por outra requisição. Tente novamente'}), 409
+            db.session.commit()
+        
+        return jsonify({
+            'mensagem': f'{len(atualizar)} consulta(s) atualizada(s)',
+            'atualizadas': len(atualizar),
+            'resultados': resultados
+        }), 200
+        
     except Exception as e:
         db.session.rollback()
         return jsonify({'erro': f'Erro interno do servidor: {str(e)}'}), 500
 
 @app.route('/api/consultas/<int:consulta_id>', methods=['DELETE'])
-@jwt_required()
+@autorizar()
 def remover_consulta(consulta_id):
     try:
-        usuario_atual_id = get_jwt_identity()
-        usuario_atual = Usuario.query.get(usuario_atual_id)
+        usuario_atual = g.usuario_atual
         
         consulta = Consulta.query.get_or_404(consulta_id)
         
         # Verificar se o usuário pode remover a consulta
-        if usuario_atual.tipo_usuario not in ['admin', 'recepcionista'] and consulta.medico_id != usuario_atual_id:
+        if usuario_atual.tipo_usuario not in ['admin', 'recepcionista'] and consulta.medico_id != usuario_atual.id:
             return jsonify({'erro': 'Você só pode remover suas próprias consultas'}), 403
         
         # Verificar se a consulta pode ser removida (apenas agendadas)
@@ -686,6 +2376,7 @@ def remover_consulta(consulta_id):
 
 @app.route('/api/consultas/buscar', methods=['GET'])
 @jwt_required()
+@rota_de_leitura
 def buscar_consultas():
     try:
         data_inicio = request.args.get('data_inicio')
@@ -693,7 +2384,8 @@ def buscar_consultas():
         medico_id = request.args.get('medico_id')
         status = request.args.get('status')
         
-        query = Consulta.query
+        campos = obter_campos(serializar_consulta)
+        query = Consulta.select_com_nomes(campos)
         
         # Filtrar por data
         if data_inicio:
@@ -726,25 +2418,323 @@ def buscar_consultas():
                 return jsonify({'erro': 'Status inválido'}), 400
             query = query.filter(Consulta.status == status)
         
-        consultas = query.all()
+        # Exportação em fluxo (opcional)
+        formato = obter_formato_exportacao()
+        if formato:
+            return exportar(query.order_by(Consulta.id), formato, 'consultas',
+                            serializar_consulta.parcial(campos) if campos else None)
+        
+        consultas = yield 'todos', query
+        
+        return resposta_condicional(consultas, lambda: {
+            'consultas': serializar_consulta.parcial(campos).lista(consultas)
+        })
+        
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
+    except Exception as e:
+        return jsonify({'erro': f'Erro interno do servidor: {str(e)}'}), 500
+
+@app.route('/api/consultas/resumo', methods=['GET'])
+@jwt_required()
+def resumo_consultas():
+    try:
+        data_inicio = request.args.get('data_inicio')
+        data_fim = request.args.get('data_fim')
+        medico_id = request.args.get('medico_id', type=int)
+        
+        query = ResumoAgenda.query
+        
+        try:
+            if data_inicio:
+                query = query.filter(ResumoAgenda.dia >= datetime.strptime(data_inicio, '%Y-%m-%d').date())
+            if data_fim:
+                query = query.filter(ResumoAgenda.dia <= datetime.strptime(data_fim, '%Y-%m-%d').date())
+        except ValueError:
+            return jsonify({'erro': 'Formato de data inválido. Use YYYY-MM-DD'}), 400
+        
+        if medico_id:
+            query = query.filter(ResumoAgenda.medico_id == medico_id)
+        
+        resumo = query.order_by(ResumoAgenda.dia, ResumoAgenda.medico_id, ResumoAgenda.status).all()
         
         return jsonify({
-            'consultas': [consulta.to_dict() for consulta in consultas]
+            'resumo': [linha.to_dict() for linha in resumo]
         }), 200
         
     except Exception as e:
         return jsonify({'erro': f'Erro interno do servidor: {str(e)}'}), 500
 
+@app.route('/api/medicos/<int:medico_id>/horarios-livres', methods=['GET'])
+@jwt_required()
+def horarios_livres(medico_id):
+    try:
+        medico = Usuario.query.get(medico_id)
+        if not medico or medico.tipo_usuario != 'medico':
+            return jsonify({'erro': 'Médico não encontrado'}), 404
+        
+        try:
+            dia = datetime.strptime(request.args.get('dia', ''), '%Y-%m-%d')
+        except ValueError:
+            return jsonify({'erro': 'Parâmetro dia é obrigatório no formato YYYY-MM-DD'}), 400
+        
+        duracao_minutos = validar_duracao(
+            request.args.get('duracao', app.config['DURACAO_PADRAO_CONSULTA'], type=int)
+        )
+        duracao = timedelta(minutes=duracao_minutos)
+        
+        # Expediente do dia
+        hora_inicio, minuto_inicio = map(int, app.config['EXPEDIENTE_INICIO'].split(':'))
+        hora_fim, minuto_fim = map(int, app.config['EXPEDIENTE_FIM'].split(':'))
+        inicio_expediente = dia.replace(hour=hora_inicio, minute=minuto_inicio)
+        fim_expediente = dia.replace(hour=hora_fim, minute=minuto_fim)
+        
+        # Uma única leitura ordenada da agenda do médico no dia; os horários livres
+        # são os intervalos entre as consultas
+        horarios = []
+        cursor = inicio_expediente
+        ocupados = consultas_do_medico(medico_id, inicio_expediente, fim_expediente)
+        for _, inicio_ocupado, fim_ocupado in ocupados + [(None, fim_expediente, fim_expediente)]:
+            while cursor + duracao <= inicio_ocupado:
+                horarios.append({'inicio': cursor.isoformat(), 'fim': (cursor + duracao).isoformat()})
+                cursor += duracao
+            cursor = max(cursor, fim_ocupado)
+        
+        return jsonify({
+            'medico_id': medico_id,
+            'dia': dia.date().isoformat(),
+            'duracao_minutos': duracao_minutos,
+            'horarios_livres': horarios
+        }), 200
+        
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
+    except Exception as e:
+        return jsonify({'erro': f'Erro interno do servidor: {str(e)}'}), 500
+
+# Métricas por rota e instrumentação do SQL (formato Prometheus em /api/metrics)
+logger_sql = logging.getLogger('consultorio.sql')
+
+class MetricasRequisicoes:
+    """Acumula, por rota e método, latência (histograma), status e tempo de SQL.
+    
+    Os valores são do processo atual; com vários workers, cada um expõe os seus.
+    """
+    
+    def __init__(self, faixas):
+        self.faixas = tuple(faixas)
+        self._lock = threading.Lock()
+        self._rotas = {}
+        self._status = {}
+        self.consultas_lentas = 0
+    
+    def registrar(self, endpoint, metodo, status, duracao, comandos_sql, tempo_sql):
+        chave = (endpoint, metodo)
+        with self._lock:
+            rota = self._rotas.get(chave)
+            if rota is None:
+                rota = self._rotas[chave] = {
+                    'faixas': [0] * (len(self.faixas) + 1),
+                    'soma': 0.0, 'total': 0, 'comandos_sql': 0, 'tempo_sql': 0.0
+                }
+            rota['faixas'][bisect.bisect_left(self.faixas, duracao)] += 1
+            rota['soma'] += duracao
+            rota['total'] += 1
+            rota['comandos_sql'] += comandos_sql
+            rota['tempo_sql'] += tempo_sql
+            chave_status = (endpoint, metodo, status)
+            self._status[chave_status] = self._status.get(chave_status, 0) + 1
+    
+    def registrar_consulta_lenta(self):
+        with self._lock:
+            self.consultas_lentas += 1
+    
+    def limpar(self):
+        with self._lock:
+            self._rotas.clear()
+            self._status.clear()
+            self.consultas_lentas = 0
+    
+    def exportar(self):
+        """Texto no formato de exposição do Prometheus"""
+        with self._lock:
+            rotas = {chave: {**rota, 'faixas': list(rota['faixas'])} for chave, rota in self._rotas.items()}
+            status = dict(self._status)
+            consultas_lentas = self.consultas_lentas
+        
+        linhas = [
+            '# HELP consultorio_requisicoes_total Requisições atendidas por rota, método e status',
+            '# TYPE consultorio_requisicoes_total counter'
+        ]
+        for (endpoint, metodo, codigo), total in sorted(status.items()):
+            linhas.append(f'consultorio_requisicoes_total{{endpoint="{endpoint}",metodo="{metodo}",status="{codigo}"}} {total}')
+        
+        linhas += [
+            '# HELP consultorio_requisicao_duracao_segundos Latência das requisições por rota e método',
+            '# TYPE consultorio_requisicao_duracao_segundos histogram'
+        ]
+        for (endpoint, metodo), rota in sorted(rotas.items()):
+            rotulos = f'endpoint="{endpoint}",metodo="{metodo}"'
+            acumulado = 0
+            for limite, quantidade in zip(self.faixas + ('+Inf',), rota['faixas']):
+                acumulado += quantidade
+                linhas.append(f'consultorio_requisicao_duracao_segundos_bucket{{{rotulos},le="{limite}"}} {acumulado}')
+            linhas.append(f'consultorio_requisicao_duracao_segundos_sum{{{rotulos}}} {rota["soma"]:.6f}')
+            linhas.append(f'consultorio_requisicao_duracao_segundos_count{{{rotulos}}} {rota["total"]}')
+        
+        linhas += [
+            '# HELP consultorio_sql_comandos_total Comandos SQL executados por rota e método',
+            '# TYPE consultorio_sql_comandos_total counter'
+        ]
+        linhas += [f'consultorio_sql_comandos_total{{endpoint="{endpoint}",metodo="{metodo}"}} {rota["comandos_sql"]}'
+                   for (endpoint, metodo), rota in sorted(rotas.items())]
+        linhas += [
+            '# HELP consultorio_sql_duracao_segundos_total Tempo gasto em SQL por rota e método',
+            '# TYPE consultorio_sql_duracao_segundos_total counter'
+        ]
+        linhas += [f'consultorio_sql_duracao_segundos_total{{endpoint="{endpoint}",metodo="{metodo}"}} {rota["tempo_sql"]:.6f}'
+                   for (endpoint, metodo), rota in sorted(rotas.items())]
+        
+        estatisticas = cache_entidades.estatisticas()
+        linhas += [
+            '# HELP consultorio_sql_lentos_total Comandos SQL acima de CONSULTA_LENTA_MS',
+            '# TYPE consultorio_sql_lentos_total counter',
+            f'consultorio_sql_lentos_total {consultas_lentas}',
+            '# HELP consultorio_cache_entidades_total Acertos, faltas e remoções do cache de entidades',
+            '# TYPE consultorio_cache_entidades_total counter',
+        ]
+        linhas += [f'consultorio_cache_entidades_total{{evento="{evento}"}} {estatisticas[evento]}'
+                   for evento in ('acertos', 'faltas', 'remocoes')]
+        return '\n'.join(linhas) + '\n'
+
+metricas = MetricasRequisicoes(app.config['METRICAS_FAIXAS_LATENCIA'])
+
+@app.before_request
+def iniciar_metricas():
+    if app.config['METRICAS_HABILITADAS']:
+        g.metricas = [time.perf_counter(), 0, 0.0]  # início, comandos SQL, tempo de SQL
+
+@app.after_request
+def registrar_metricas(response):
+    medicao = g.pop('metricas', None)
+    if medicao is not None:
+        inicio, comandos_sql, tempo_sql = medicao
+        endpoint = request.url_rule.rule if request.url_rule else 'desconhecida'
+        metricas.registrar(endpoint, request.method, response.status_code,
+                           time.perf_counter() - inicio, comandos_sql, tempo_sql)
+    return response
+
+# Uma conexão executa um comando por vez, então basta guardar o início do atual
+def iniciar_comando_sql(conn, cursor, statement, parameters, context, executemany):
+    if not app.config['METRICAS_HABILITADAS']:
+        return
+    conn.info['inicio_comando'] = time.perf_counter()
+
+def descartar_comando_sql(contexto):
+    """Comandos que falham não chegam a after_cursor_execute"""
+    if contexto.connection is not None:
+        contexto.connection.info.pop('inicio_comando', None)
+
+def finalizar_comando_sql(conn, cursor, statement, parameters, context, executemany):
+    inicio = conn.info.pop('inicio_comando', None)
+    if inicio is None:
+        return
+    duracao = time.perf_counter() - inicio
+    
+    medicao = g.get('metricas') if has_request_context() else None
+    if medicao is not None:
+        medicao[1] += 1
+        medicao[2] += duracao
+    
+    if duracao * 1000 >= app.config['CONSULTA_LENTA_MS']:
+        metricas.registrar_consulta_lenta()
+        logger_sql.warning('Comando SQL lento (%.1f ms) em %s: %s', duracao * 1000,
+                           request.path if has_request_context() else '-', statement)
+
+with app.app_context():
+    event.listen(db.engine, 'before_cursor_execute', iniciar_comando_sql)
+    event.listen(db.engine, 'after_cursor_execute', finalizar_comando_sql)
+    event.listen(db.engine, 'handle_error', descartar_comando_sql)
+
+@app.route('/api/metrics', methods=['GET'])
+def exportar_metricas():
+    return Response(metricas.exportar(), mimetype='text/plain; version=0.0.4')
+
+# Leituras em lote: várias sub-requisições GET em uma única requisição HTTP
+# Rotas aceitas no lote: listagens, buscas e leituras individuais. Exportações (?formato=)
+# e outras respostas em fluxo ficam de fora, pois o lote as carregaria inteiras na memória
+ENDPOINTS_LOTE = {
+    'listar_usuarios', 'obter_usuario', 'listar_pacientes', 'obter_paciente', 'buscar_pacientes',
+    'listar_consultas', 'obter_consulta', 'buscar_consultas',
+}
+
+def executar_subrequisicao(adaptador, caminho, cabecalhos):
+    """Executa um GET do lote e retorna {'caminho', 'status', 'corpo'}.
+    
+    A sub-requisição roda em um contexto de requisição próprio, mas no mesmo contexto de
+    aplicação da requisição do lote; por isso todas compartilham a sessão do banco.
+    """
+    if not isinstance(caminho, str) or not caminho.startswith('/api/'):
+        return {'caminho': caminho, 'status': 400, 'corpo': {'erro': 'Caminho inválido'}}
+    
+    rota, _, parametros = caminho.partition('?')
+    try:
+        endpoint, argumentos = adaptador.match(rota, 'GET')
+    except MethodNotAllowed:
+        return {'caminho': caminho, 'status': 405, 'corpo': {'erro': 'O lote aceita apenas leituras (GET)'}}
+    except HTTPException as e:
+        return {'caminho': caminho, 'status': e.code, 'corpo': {'erro': 'Rota não encontrada'}}
+    if endpoint not in ENDPOINTS_LOTE:
+        return {'caminho': caminho, 'status': 400, 'corpo': {'erro': 'Rota não disponível no lote'}}
+    
+    with app.test_request_context(rota, method='GET', query_string=parametros, headers=cabecalhos):
+        if 'formato' in request.args:
+            return {'caminho': caminho, 'status': 400, 'corpo': {'erro': 'Exportações não são aceitas no lote'}}
+        try:
+            response = app.make_response(app.view_functions[endpoint](**argumentos))
+        except HTTPException as e:
+            return {'caminho': caminho, 'status': e.code, 'corpo': {'erro': e.description}}
+        if response.is_streamed:
+            response.close()
+            return {'caminho': caminho, 'status': 400, 'corpo': {'erro': 'Respostas em fluxo não são aceitas no lote'}}
+        corpo = response.get_json() if response.is_json else response.get_data(as_text=True)
+    return {'caminho': caminho, 'status': response.status_code, 'corpo': corpo}
+
+@app.route('/api/lote', methods=['POST'])
+@jwt_required()
+def executar_lote():
+    try:
+        data = request.get_json(silent=True)
+        requisicoes = data.get('requisicoes') if isinstance(data, dict) else None
+        
+        if not isinstance(requisicoes, list) or not requisicoes:
+            return jsonify({'erro': 'Informe requisicoes: uma lista de caminhos GET'}), 400
+        if len(requisicoes) > app.config['LOTE_MAXIMO_REQUISICOES']:
+            return jsonify({'erro': f"No máximo {app.config['LOTE_MAXIMO_REQUISICOES']} requisições por lote"}), 400
+        
+        # As sub-requisições usam o mesmo token da requisição do lote
+        adaptador = app.url_map.bind_to_environ(request.environ)
+        cabecalhos = {'Authorization': request.headers.get('Authorization', '')}
+        
+        return jsonify({
+            'respostas': [executar_subrequisicao(adaptador, caminho, cabecalhos) for caminho in requisicoes]
+        })
+        
+    except Exception as e:
+        return jsonify({'erro': f'Erro interno do servidor: {str(e)}'}), 500
+
 # Rota de saúde da API
 @app.route('/api/health', methods=['GET'])
 def health_check():
     return jsonify({
         'status': 'OK',
         'mensagem': 'API do Consultório Médico funcionando corretamente',
-        'timestamp': datetime.utcnow().isoformat()
+        'timestamp': datetime.utcnow().isoformat(),
+        'cache_entidades': cache_entidades.estatisticas()
     }), 200
 
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
+        atualizar_esquema()
     app.run(debug=True, host='0.0.0.0', port=5000)
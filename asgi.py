@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Modo de serviço assíncrono (ASGI) da API do Consultório Médico
+
+As rotas de leitura (LEITURAS em app.py) rodam como corrotinas sobre um engine assíncrono
+do SQLAlchemy (aiosqlite no SQLite): são as mesmas funções das rotas síncronas, que só
+entregam os comandos SQL, executados aqui com await. As demais rotas e as exportações
+(?formato=) são repassadas à aplicação WSGI, executada em threads.
+
+Execute com: uvicorn asgi:aplicacao --host 0.0.0.0 --port 5000
+"""
+
+import io
+import sys
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+from flask_jwt_extended import verify_jwt_in_request
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from werkzeug.exceptions import HTTPException
+
+from app import (app, FORMAS_RESULTADO, LEITURAS, configurar_sqlite, descartar_comando_sql, finalizar_comando_sql,
+                 iniciar_comando_sql)
+
+# Drivers assíncronos equivalentes aos drivers síncronos da configuração
+DRIVERS_ASSINCRONOS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+    'mysql': 'mysql+aiomysql',
+}
+
+def url_assincrona(url):
+    """Converte a URL do banco da aplicação para o driver assíncrono correspondente"""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in DRIVERS_ASSINCRONOS:
+        raise ValueError(f'Banco sem driver assíncrono configurado: {backend}')
+    return url.set(drivername=DRIVERS_ASSINCRONOS[backend])
+
+def criar_engine_assincrono(url=None):
+    """Cria o engine assíncrono com o mesmo perfil (PRAGMAs, métricas) do engine síncrono"""
+    url = url or app.config['SQLALCHEMY_ASYNC_DATABASE_URI'] or url_assincrona(app.config['SQLALCHEMY_DATABASE_URI'])
+    engine = create_async_engine(url)
+    if engine.dialect.name == 'sqlite' and app.config['SQLITE_PRAGMAS']:
+        configurar_sqlite(
+            engine.sync_engine,
+            app.config['SQLITE_PRAGMAS'],
+            app.config['SQLITE_ESCRITA_TENTATIVAS'],
+            app.config['SQLITE_ESCRITA_ESPERA']
+        )
+    event.listen(engine.sync_engine, 'before_cursor_execute', iniciar_comando_sql)
+    event.listen(engine.sync_engine, 'after_cursor_execute', finalizar_comando_sql)
+    event.listen(engine.sync_engine, 'handle_error', descartar_comando_sql)
+    return engine
+
+async def executar_leitura(sessao, leitura):
+    """Versão assíncrona de app.executar_leitura: conduz a leitura pela sessão assíncrona"""
+    resultado = erro = None
+    while True:
+        try:
+            forma, comando = leitura.throw(erro) if erro else leitura.send(resultado)
+        except StopIteration as fim:
+            return fim.value
+        try:
+            resultado, erro = FORMAS_RESULTADO[forma](await sessao.execute(comando)), None
+        except Exception as e:
+            resultado, erro = None, e
+
+def montar_environ(scope, corpo):
+    """Monta o environ WSGI de uma requisição HTTP do ASGI, para o contexto do Flask"""
+    servidor = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': servidor[0],
+        'SERVER_PORT': str(servidor[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'CONTENT_LENGTH': str(len(corpo)),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(corpo),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+        'wsgi.version': (1, 0),
+    }
+    for nome, valor in scope.get('headers', []):
+        nome = nome.decode('latin-1').upper().replace('-', '_')
+        valor = valor.decode('latin-1')
+        if nome == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = valor
+        elif nome != 'CONTENT_LENGTH':
+            chave = f'HTTP_{nome}'
+            environ[chave] = f'{environ[chave]},{valor}' if chave in environ else valor
+    return environ
+
+class AplicacaoAssincrona:
+    """Aplicação ASGI: rotas de LEITURAS rodam como corrotinas; o restante (escritas,
+    exportações em fluxo) é atendido pela aplicação WSGI em threads"""
+
+    def __init__(self, url=None):
+        self.engine = criar_engine_assincrono(url)
+        self.sessoes = async_sessionmaker(self.engine, expire_on_commit=False)
+        self.wsgi = WsgiToAsgi(app)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.ciclo_de_vida(receive, send)
+        if scope['type'] != 'http':
+            return await self.wsgi(scope, receive, send)
+
+        adaptador = app.url_map.bind(
+            (scope.get('server') or ('localhost', 80))[0], script_name=scope.get('root_path') or None
+        )
+        try:
+            endpoint, argumentos = adaptador.match(scope['path'], scope['method'])
+        except HTTPException:
+            endpoint = None
+
+        leitura = LEITURAS.get(endpoint)
+        # Exportações transmitem o resultado com a sessão síncrona
+        if leitura is None or 'formato' in parse_qs(scope.get('query_string', b'').decode('latin-1')):
+            return await self.wsgi(scope, receive, send)
+
+        corpo = b''
+        while True:
+            mensagem = await receive()
+            corpo += mensagem.get('body', b'')
+            if not mensagem.get('more_body'):
+                break
+
+        response = await self.atender(leitura, argumentos, montar_environ(scope, corpo))
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': [(nome.lower().encode('latin-1'), valor.encode('latin-1'))
+                        for nome, valor in response.headers.items()],
+        })
+        await send({'type': 'http.response.body', 'body': response.get_data()})
+
+    async def atender(self, leitura, argumentos, environ):
+        """Executa a rota no contexto de requisição do Flask, com os mesmos hooks
+        (métricas), autenticação JWT e tratamento de erros das rotas síncronas"""
+        with app.request_context(environ):
+            try:
+                response = app.preprocess_request()
+                if response is None:
+                    verify_jwt_in_request()
+                    # As rotas de leitura tratam os próprios erros (400/500)
+                    async with self.sessoes() as sessao:
+                        response = await executar_leitura(sessao, leitura(**argumentos))
+            except Exception as e:
+                # Erros de autenticação usam os tratadores registrados pelo JWTManager
+                try:
+                    response = app.handle_user_exception(e)
+                except Exception as erro:
+                    response = app.handle_exception(erro)
+            return app.process_response(app.make_response(response))
+
+    async def ciclo_de_vida(self, receive, send):
+        while True:
+            mensagem = await receive()
+            if mensagem['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif mensagem['type'] == 'lifespan.shutdown':
+                await self.engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+async def chamar(aplicacao_asgi, metodo, caminho, cabecalhos=None, corpo=b''):
+    """Executa uma requisição diretamente na aplicação ASGI, sem rede (testes e benchmarks).
+    Retorna (status, cabeçalhos, corpo)."""
+    caminho, _, consulta = caminho.partition('?')
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': metodo, 'scheme': 'http', 'path': caminho, 'root_path': '',
+        'query_string': consulta.encode(), 'server': ('localhost', 80), 'client': ('127.0.0.1', 0),
+        'headers': [(nome.lower().encode(), valor.encode()) for nome, valor in (cabecalhos or {}).items()],
+    }
+    recebido = False
+    resposta = {'status': None, 'cabecalhos': {}, 'corpo': b''}
+
+    async def receive():
+        nonlocal recebido
+        if recebido:
+            return {'type': 'http.disconnect'}
+        recebido = True
+        return {'type': 'http.request', 'body': corpo, 'more_body': False}
+
+    async def send(mensagem):
+        if mensagem['type'] == 'http.response.start':
+            resposta['status'] = mensagem['status']
+            resposta['cabecalhos'] = {nome.decode(): valor.decode() for nome, valor in mensagem['headers']}
+        elif mensagem['type'] == 'http.response.body':
+            resposta['corpo'] += mensagem.get('body', b'')
+
+    await aplicacao_asgi(scope, receive, send)
+    return resposta['status'], resposta['cabecalhos'], resposta['corpo']
+
+aplicacao = AplicacaoAssincrona()
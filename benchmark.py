@@ -0,0 +1,774 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks da API do Consultório Médico
+Executa medições em processo sobre um banco SQLite temporário (o subcomando
+servidor sobe a aplicação via run.py e mede por HTTP).
+
+Uso:
+    python benchmark.py busca --pacientes 1000000
+    python benchmark.py login --logins 8 --duracao 10
+    python benchmark.py cpf --quantidade 1000000
+    python benchmark.py json --por-pagina 100
+    python benchmark.py metricas --repeticoes 2000
+    python benchmark.py suite --consultas 10000 100000 1000000 --saida resultado.json
+    python benchmark.py suite --consultas 10000 --base resultado.json --tolerancia 0.25
+    python benchmark.py asgi --concorrencia 1 8 32 128
+    python benchmark.py servidor --workers 4 --threads 4 --concorrencia 16
+    python benchmark.py compressao --consultas 5000 --link-kbps 2000
+    python benchmark.py status --por-lote 50
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import signal
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import requests
+
+# O banco do benchmark é criado em um arquivo temporário antes de importar a aplicação
+DIRETORIO_TEMPORARIO = tempfile.mkdtemp(prefix='consultorio_bench_')
+os.environ.setdefault('FLASK_ENV', 'production')
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(DIRETORIO_TEMPORARIO, 'bench.db')}")
+
+from flask.json.provider import DefaultJSONProvider
+from flask_jwt_extended import create_access_token
+from sqlalchemy import insert
+
+import app as aplicacao
+from app import (app, db, Usuario, Paciente, Consulta, ProvedorJSON, buscar_pacientes_por_nome,
+                 executar_leitura, gerar_hash_senha, serializar_consulta, validar_cpf, validar_cpfs)
+from init_db import PRIMEIROS_NOMES, SOBRENOMES, gerar_cpfs
+
+
+def gerar_nome(aleatorio):
+    """Gera um nome completo com dois sobrenomes"""
+    return (f'{aleatorio.choice(PRIMEIROS_NOMES)} {aleatorio.choice(SOBRENOMES)} '
+            f'{aleatorio.choice(SOBRENOMES)}')
+
+
+def popular_pacientes(quantidade, lote=50000):
+    """Insere pacientes sintéticos em lotes"""
+    aleatorio = random.Random(42)
+    for inicio in range(0, quantidade, lote):
+        db.session.execute(insert(Paciente), [
+            {
+                'nome': gerar_nome(aleatorio),
+                'cpf': f'{i:011d}',
+                'cpf_normalizado': f'{i:011d}',
+                'data_nascimento': date(1950 + i % 60, 1 + i % 12, 1 + i % 28),
+                'ativo': True
+            }
+            for i in range(inicio, min(inicio + lote, quantidade))
+        ])
+        db.session.commit()
+
+
+def percentil(amostras, p):
+    """Retorna o percentil p (0-100) das amostras"""
+    ordenadas = sorted(amostras)
+    return ordenadas[min(len(ordenadas) - 1, int(len(ordenadas) * p / 100))]
+
+
+def medir(funcao, repeticoes):
+    """Executa a função repetidas vezes e retorna as latências em milissegundos"""
+    amostras = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        amostras.append((time.perf_counter() - inicio) * 1000)
+    return amostras
+
+
+def imprimir_latencias(nome, amostras):
+    """Imprime o resumo das latências"""
+    print(f'{nome:<32} p50={statistics.median(amostras):7.2f}ms '
+          f'p95={percentil(amostras, 95):7.2f}ms p99={percentil(amostras, 99):7.2f}ms')
+
+
+def benchmark_busca(args):
+    """Mede a busca textual de pacientes"""
+    print(f'Populando {args.pacientes} pacientes...')
+    inicio = time.perf_counter()
+    popular_pacientes(args.pacientes)
+    print(f'✓ Carga concluída em {time.perf_counter() - inicio:.1f}s\n')
+
+    consultas = ['maria', 'jose silva', 'conceicao', 'pat souza oli', 'Tiago Mendes Rocha', 'sérgio']
+    for texto in consultas:
+        amostras = medir(lambda: executar_leitura(buscar_pacientes_por_nome(texto, 21, 0)), args.repeticoes)
+        imprimir_latencias(f"busca '{texto}'", amostras)
+
+
+def tempestade_de_logins(logins, concorrencia, duracao):
+    """Dispara logins contínuos enquanto mede a latência de /api/health"""
+    aplicacao._vagas_hash_senha = threading.BoundedSemaphore(concorrencia)
+    fim = time.perf_counter() + duracao
+    total_logins = []
+    latencias_health = []
+
+    def fazer_logins():
+        cliente = app.test_client()
+        feitos = 0
+        while time.perf_counter() < fim:
+            response = cliente.post('/api/auth/login', json={
+                'email': 'bench@consultorio.com', 'senha': '123456'
+            })
+            if response.status_code == 200:
+                feitos += 1
+        total_logins.append(feitos)
+
+    def medir_health():
+        cliente = app.test_client()
+        while time.perf_counter() < fim:
+            inicio = time.perf_counter()
+            cliente.get('/api/health')
+            latencias_health.append((time.perf_counter() - inicio) * 1000)
+            time.sleep(0.01)
+
+    threads = [threading.Thread(target=fazer_logins) for _ in range(logins)]
+    threads.append(threading.Thread(target=medir_health))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    print(f'concorrência de hash={concorrencia:<3} logins/s={sum(total_logins) / duracao:7.2f}  ', end='')
+    imprimir_latencias('health durante logins', latencias_health)
+
+
+def benchmark_login(args):
+    """Mede a vazão de logins e o impacto de um pico de logins nas demais requisições"""
+    db.session.add(Usuario(
+        nome='Bench',
+        email='bench@consultorio.com',
+        senha_hash=gerar_hash_senha('123456'),
+        tipo_usuario='admin'
+    ))
+    db.session.commit()
+
+    print(f"{args.logins} clientes fazendo login por {args.duracao}s "
+          f"(hash {app.config['SENHA_HASH_METODO']})\n")
+    for concorrencia in sorted({args.logins, app.config['SENHA_HASH_CONCORRENCIA']}, reverse=True):
+        tempestade_de_logins(args.logins, concorrencia, args.duracao)
+
+
+def gerar_cpf(aleatorio):
+    """Gera um CPF válido e formatado"""
+    digitos = [aleatorio.randrange(10) for _ in range(9)]
+    for tamanho in (9, 10):
+        resto = sum(d * (tamanho + 1 - i) for i, d in enumerate(digitos)) % 11
+        digitos.append(0 if resto < 2 else 11 - resto)
+    cpf = ''.join(map(str, digitos))
+    return f'{cpf[:3]}.{cpf[3:6]}.{cpf[6:9]}-{cpf[9:]}'
+
+
+def benchmark_cpf(args):
+    """Compara a validação de CPF item a item com a validação vetorizada"""
+    aleatorio = random.Random(42)
+    cpfs = [gerar_cpf(aleatorio) if i % 4 else f'{aleatorio.randrange(10 ** 11):011d}'
+            for i in range(args.quantidade)]
+
+    inicio = time.perf_counter()
+    esperado = [validar_cpf(cpf) for cpf in cpfs]
+    tempo_loop = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    mascara = validar_cpfs(cpfs)
+    tempo_vetorizado = time.perf_counter() - inicio
+
+    assert mascara.tolist() == esperado
+    print(f'{args.quantidade} CPFs ({int(mascara.sum())} válidos)')
+    print(f'validar_cpf (loop)   {tempo_loop:7.2f}s  {args.quantidade / tempo_loop:12,.0f} CPFs/s')
+    print(f'validar_cpfs (numpy) {tempo_vetorizado:7.2f}s  {args.quantidade / tempo_vetorizado:12,.0f} CPFs/s')
+
+
+def popular_consultas(quantidade):
+    """Insere um médico, pacientes e consultas sintéticos"""
+    db.session.add(Usuario(nome='Dr. Bench', email='medico@bench.com', senha_hash='x', tipo_usuario='medico'))
+    popular_pacientes(quantidade)
+    medico_id = Usuario.query.filter_by(email='medico@bench.com').first().id
+    inicio = datetime(2024, 1, 1, 8, 0)
+    db.session.execute(insert(Consulta), [
+        {
+            'paciente_id': i + 1,
+            'medico_id': medico_id,
+            'data_consulta': inicio + timedelta(minutes=30 * i),
+            'tipo_consulta': 'Consulta de Rotina',
+            'observacoes': 'Paciente relata melhora dos sintomas',
+            'status': 'agendada'
+        }
+        for i in range(quantidade)
+    ])
+    db.session.commit()
+
+
+def benchmark_json(args):
+    """Compara to_dict + provedor padrão do Flask com serializadores compilados + ProvedorJSON"""
+    popular_consultas(args.por_pagina)
+    consultas = Consulta.query_com_nomes().limit(args.por_pagina).all()
+    provedor_padrao = DefaultJSONProvider(app)
+    provedor_rapido = ProvedorJSON(app)
+    print(f'Página de {len(consultas)} consultas (orjson {"ativo" if aplicacao.orjson else "ausente"})\n')
+
+    with app.test_request_context():
+        imprimir_latencias('to_dict + jsonify padrão', medir(
+            lambda: provedor_padrao.response({'consultas': [c.to_dict() for c in consultas]}),
+            args.repeticoes))
+        imprimir_latencias('serializador + ProvedorJSON', medir(
+            lambda: provedor_rapido.response({'consultas': serializar_consulta.lista(consultas)}),
+            args.repeticoes))
+
+    # Requisição completa a listar_consultas, incluindo consulta ao banco e ETag
+    cliente = app.test_client()
+    with app.app_context():
+        cabecalhos = {'Authorization': f'Bearer {create_access_token(identity=str(consultas[0].medico_id))}'}
+    url = f'/api/consultas?por_pagina={args.por_pagina}'
+    caminhos = [
+        ('GET /api/consultas (padrão)', provedor_padrao,
+         lambda itens: [item.to_dict() for item in itens]),
+        ('GET /api/consultas (rápido)', provedor_rapido, serializar_consulta.lista),
+    ]
+    for nome, provedor, serializar_lista in caminhos:
+        app.json = provedor
+        aplicacao.serializar_consulta = argparse.Namespace(lista=serializar_lista)
+        assert cliente.get(url, headers=cabecalhos).status_code == 200
+        imprimir_latencias(nome, medir(lambda: cliente.get(url, headers=cabecalhos), args.repeticoes))
+    aplicacao.serializar_consulta = serializar_consulta
+
+
+def benchmark_metricas(args):
+    """Mede o custo da instrumentação (métricas por rota e eventos de SQL)"""
+    popular_consultas(100)
+    cliente = app.test_client()
+    with app.app_context():
+        medico_id = Usuario.query.filter_by(email='medico@bench.com').first().id
+        cabecalhos = {'Authorization': f'Bearer {create_access_token(identity=str(medico_id))}'}
+
+    for url in ('/api/health', '/api/consultas?por_pagina=20', f'/api/usuarios/{medico_id}'):
+        medianas = {}
+        # Alterna as duas configurações em rodadas para diluir variações da máquina
+        amostras = {False: [], True: []}
+        for _ in range(5):
+            for habilitadas in (False, True):
+                app.config['METRICAS_HABILITADAS'] = habilitadas
+                amostras[habilitadas] += medir(lambda: cliente.get(url, headers=cabecalhos),
+                                               args.repeticoes // 5)
+        for habilitadas in (False, True):
+            medianas[habilitadas] = statistics.median(amostras[habilitadas])
+            imprimir_latencias(f"{url} ({'com' if habilitadas else 'sem'} métricas)", amostras[habilitadas])
+        print(f'  sobrecarga: {100 * (medianas[True] / medianas[False] - 1):+.1f}% '
+              f'({1000 * (medianas[True] - medianas[False]):+.0f}µs por requisição)\n')
+
+
+# Suíte de benchmarks por endpoint
+SUITE_MEDICOS = 50
+SUITE_HORARIOS_POR_DIA = 20  # consultas de 30 minutos entre 08:00 e 18:00
+SUITE_INICIO_AGENDA = datetime(2024, 1, 1, 8, 0)
+SUITE_STATUS = ['agendada'] * 6 + ['realizada'] * 3 + ['cancelada']
+
+
+def horario_da_consulta(indice):
+    """Data da i-ésima consulta: os médicos se alternam e cada um atende 20 horários por dia"""
+    horario = indice // SUITE_MEDICOS
+    dia, posicao = divmod(horario, SUITE_HORARIOS_POR_DIA)
+    return SUITE_INICIO_AGENDA + timedelta(days=dia, minutes=30 * posicao)
+
+
+def preparar_suite(maior_tamanho):
+    """Cria o administrador, os médicos e os pacientes usados pela suíte"""
+    db.session.add(Usuario(nome='Admin Bench', email='admin@bench.com',
+                           senha_hash=gerar_hash_senha('123456'), tipo_usuario='admin'))
+    db.session.execute(insert(Usuario), [
+        {'nome': f'Dr. Bench {i}', 'email': f'medico{i}@bench.com', 'senha_hash': 'x', 'tipo_usuario': 'medico'}
+        for i in range(SUITE_MEDICOS)
+    ])
+    db.session.commit()
+    popular_pacientes(max(1000, maior_tamanho // 10))
+    medicos = [usuario.id for usuario in Usuario.query.filter_by(tipo_usuario='medico').order_by(Usuario.id)]
+    return {
+        'admin_id': Usuario.query.filter_by(email='admin@bench.com').first().id,
+        'medicos': medicos,
+        'pacientes': Paciente.query.count(),
+        'consultas': 0,
+    }
+
+
+def popular_agenda(estado, total, lote=50000):
+    """Completa a agenda até o total de consultas pedido"""
+    aleatorio = random.Random(estado['consultas'])
+    for inicio in range(estado['consultas'], total, lote):
+        db.session.execute(insert(Consulta), [
+            {
+                'paciente_id': aleatorio.randrange(estado['pacientes']) + 1,
+                'medico_id': estado['medicos'][i % SUITE_MEDICOS],
+                'data_consulta': horario_da_consulta(i),
+                'tipo_consulta': 'Consulta de Rotina',
+                'status': aleatorio.choice(SUITE_STATUS)
+            }
+            for i in range(inicio, min(inicio + lote, total))
+        ])
+        db.session.commit()
+    estado['consultas'] = total
+    estado['ultima_consulta'] = db.session.query(db.func.max(Consulta.id)).scalar()
+
+
+def cenarios_da_suite(estado):
+    """Lista de (nome, método, gerador da requisição) com parâmetros sorteados a cada chamada"""
+    medicos, pacientes = estado['medicos'], estado['pacientes']
+    dias = max(1, estado['consultas'] // (SUITE_MEDICOS * SUITE_HORARIOS_POR_DIA))
+    novos_horarios = estado.setdefault('novos_horarios', iter(range(10 ** 9)))
+    # Pacientes novos recebem CPFs válidos gerados a partir de 10^8; os removidos são os
+    # criados pela própria suíte (ids após os da carga), cada um uma única vez
+    novos_cpfs = estado.setdefault('novos_cpfs', iter(range(10 ** 8, 10 ** 9)))
+    removiveis = estado.setdefault('pacientes_removiveis', iter(range(pacientes + 1, 10 ** 9)))
+
+    def dia(aleatorio):
+        return (SUITE_INICIO_AGENDA + timedelta(days=aleatorio.randrange(dias))).date()
+
+    def periodo(aleatorio, duracao_dias):
+        inicio = dia(aleatorio)
+        return f'data_inicio={inicio}&data_fim={inicio + timedelta(days=duracao_dias)}'
+
+    def ids_de_pacientes(aleatorio, quantidade=30):
+        # Pacientes de uma visão semanal da agenda
+        return ','.join(str(aleatorio.randrange(pacientes) + 1) for _ in range(quantidade))
+
+    def nova_consulta(aleatorio):
+        # Horários de 2030 em diante, sempre livres, para não gerar conflitos
+        indice = next(novos_horarios)
+        data = datetime(2030, 1, 1, 8, 0) + timedelta(days=indice // 20, minutes=30 * (indice % 20))
+        return {'paciente_id': aleatorio.randrange(pacientes) + 1, 'medico_id': medicos[0],
+                'data_consulta': data.strftime('%Y-%m-%d %H:%M'), 'tipo_consulta': 'Retorno'}
+
+    def proximos_cpfs(quantidade):
+        return gerar_cpfs(np.array([next(novos_cpfs) for _ in range(quantidade)]))[0]
+
+    def novo_paciente(aleatorio, cpf):
+        return {'nome': gerar_nome(aleatorio), 'cpf': cpf, 'data_nascimento': '1990-01-01'}
+
+    def importacao(aleatorio, quantidade=100):
+        # Corpo NDJSON (texto), como numa migração de cadastro
+        return '\n'.join(json.dumps(novo_paciente(aleatorio, cpf)) for cpf in proximos_cpfs(quantidade))
+
+    return [
+        ('health', 'GET', lambda a: ('/api/health', None)),
+        ('auth.login', 'POST', lambda a: ('/api/auth/login', {'email': 'admin@bench.com', 'senha': '123456'})),
+        ('usuarios.listar', 'GET', lambda a: ('/api/usuarios?por_pagina=20', None)),
+        ('usuarios.obter', 'GET', lambda a: (f'/api/usuarios/{a.choice(medicos)}', None)),
+        ('pacientes.listar', 'GET', lambda a: (f'/api/pacientes?pagina={a.randrange(1, 50)}', None)),
+        ('pacientes.listar_cursor', 'GET', lambda a: ('/api/pacientes?cursor=&limite=20', None)),
+        ('pacientes.obter', 'GET', lambda a: (f'/api/pacientes/{a.randrange(pacientes) + 1}', None)),
+        ('pacientes.obter_ids', 'GET', lambda a: (f'/api/pacientes?ids={ids_de_pacientes(a)}', None)),
+        ('pacientes.buscar_nome', 'GET', lambda a: (f'/api/pacientes/buscar?q={a.choice(PRIMEIROS_NOMES)}', None)),
+        ('pacientes.buscar_cpf', 'GET', lambda a: (f'/api/pacientes/buscar?q={a.randrange(1000):03d}', None)),
+        ('consultas.listar', 'GET', lambda a: (f'/api/consultas?por_pagina=20&pagina={a.randrange(1, 50)}', None)),
+        ('consultas.listar_cursor', 'GET', lambda a: ('/api/consultas?cursor=&limite=20', None)),
+        ('consultas.listar_cursor_campos', 'GET', lambda a: (
+            '/api/consultas?cursor=&limite=20&campos=id,data_consulta,paciente_nome', None)),
+        ('consultas.obter', 'GET', lambda a: (f"/api/consultas/{a.randrange(estado['ultima_consulta']) + 1}", None)),
+        ('consultas.buscar_medico_dia', 'GET', lambda a: (
+            f'/api/consultas/buscar?medico_id={a.choice(medicos)}&{periodo(a, 0)}', None)),
+        ('consultas.buscar_status', 'GET', lambda a: (
+            f'/api/consultas/buscar?status=cancelada&{periodo(a, 0)}', None)),
+        ('consultas.resumo', 'GET', lambda a: (f'/api/consultas/resumo?{periodo(a, 7)}', None)),
+        ('medicos.horarios_livres', 'GET', lambda a: (
+            f'/api/medicos/{a.choice(medicos)}/horarios-livres?dia={dia(a)}', None)),
+        ('lote.semana_do_medico', 'POST', lambda a: ('/api/lote', {'requisicoes': [
+            f'/api/consultas/buscar?medico_id={a.choice(medicos)}&{periodo(a, 6)}&campos=id,data_consulta,paciente_id',
+            f'/api/pacientes?ids={ids_de_pacientes(a)}&campos=id,nome,telefone',
+            f'/api/medicos/{a.choice(medicos)}/horarios-livres?dia={dia(a)}',
+        ]})),
+        ('pacientes.criar', 'POST', lambda a: ('/api/pacientes', novo_paciente(a, proximos_cpfs(1)[0]))),
+        ('pacientes.remover', 'DELETE', lambda a: (f'/api/pacientes/{next(removiveis)}', None)),
+        ('pacientes.importar_100', 'POST', lambda a: ('/api/pacientes/lote', importacao(a))),
+        ('consultas.criar', 'POST', lambda a: ('/api/consultas', nova_consulta(a))),
+        ('consultas.atualizar', 'PUT', lambda a: (
+            f"/api/consultas/{a.randrange(estado['ultima_consulta']) + 1}",
+            {'observacoes': f'Atualizada {a.random()}'})),
+    ]
+
+
+def requisitar_cenario(cliente, cabecalhos, metodo, url, corpo):
+    """Envia o corpo como JSON ou, se for texto, como NDJSON"""
+    if isinstance(corpo, str):
+        return cliente.open(url, method=metodo, data=corpo, content_type='application/x-ndjson', headers=cabecalhos)
+    return cliente.open(url, method=metodo, json=corpo, headers=cabecalhos)
+
+
+def executar_cenario(cliente, cabecalhos, metodo, gerar, repeticoes, aleatorio):
+    """Executa o cenário e retorna as latências (ms), a vazão e quantas respostas falharam"""
+    for _ in range(min(10, repeticoes)):  # aquecimento
+        url, corpo = gerar(aleatorio)
+        requisitar_cenario(cliente, cabecalhos, metodo, url, corpo)
+
+    amostras, erros = [], 0
+    inicio_total = time.perf_counter()
+    for _ in range(repeticoes):
+        url, corpo = gerar(aleatorio)
+        inicio = time.perf_counter()
+        response = requisitar_cenario(cliente, cabecalhos, metodo, url, corpo)
+        amostras.append((time.perf_counter() - inicio) * 1000)
+        if response.status_code >= 400:
+            erros += 1
+    duracao = time.perf_counter() - inicio_total
+    return {
+        'requisicoes': repeticoes,
+        'vazao_rps': round(repeticoes / duracao, 1),
+        'p50_ms': round(statistics.median(amostras), 3),
+        'p95_ms': round(percentil(amostras, 95), 3),
+        'p99_ms': round(percentil(amostras, 99), 3),
+        'erros': erros,
+    }
+
+
+def comparar_com_base(resultados, base, tolerancia):
+    """Retorna as regressões: cenários cujo p50 ou p95 piorou mais que a tolerância"""
+    regressoes = []
+    for tamanho, cenarios in resultados.items():
+        for nome, atual in cenarios.items():
+            anterior = base.get('resultados', {}).get(tamanho, {}).get(nome)
+            if not anterior:
+                continue
+            for medida in ('p50_ms', 'p95_ms'):
+                if atual[medida] > anterior[medida] * (1 + tolerancia):
+                    regressoes.append(f'{tamanho} consultas, {nome}: {medida} '
+                                      f'{anterior[medida]:.2f} -> {atual[medida]:.2f}')
+    return regressoes
+
+
+def benchmark_suite(args):
+    """Mede todos os endpoints com bases de tamanhos crescentes e compara com uma execução anterior"""
+    tamanhos = sorted(args.consultas)
+    aleatorio = random.Random(42)
+    # As cargas em lote não devem aparecer como comandos lentos no log
+    logging.getLogger('consultorio.sql').setLevel(logging.ERROR)
+    print(f'Preparando médicos e pacientes para até {tamanhos[-1]} consultas...')
+    estado = preparar_suite(tamanhos[-1])
+    cliente = app.test_client()
+    cabecalhos = {'Authorization': f"Bearer {create_access_token(identity=str(estado['admin_id']))}"}
+
+    resultados = {}
+    for tamanho in tamanhos:
+        inicio = time.perf_counter()
+        popular_agenda(estado, tamanho)
+        print(f'\n== {tamanho} consultas (carga em {time.perf_counter() - inicio:.1f}s) ==')
+        resultados[str(tamanho)] = {}
+        for nome, metodo, gerar in cenarios_da_suite(estado):
+            medida = executar_cenario(cliente, cabecalhos, metodo, gerar, args.repeticoes, aleatorio)
+            resultados[str(tamanho)][nome] = medida
+            print(f"{nome:<32} {medida['vazao_rps']:8.1f} req/s  p50={medida['p50_ms']:7.2f}ms "
+                  f"p95={medida['p95_ms']:7.2f}ms p99={medida['p99_ms']:7.2f}ms"
+                  + (f"  {medida['erros']} erros" if medida['erros'] else ''))
+
+    relatorio = {
+        'gerado_em': datetime.now().isoformat(timespec='seconds'),
+        'ambiente': {'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version,
+                     'plataforma': platform.platform(), 'repeticoes': args.repeticoes,
+                     'medicos': SUITE_MEDICOS, 'pacientes': estado['pacientes']},
+        'resultados': resultados,
+    }
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as arquivo:
+            json.dump(relatorio, arquivo, ensure_ascii=False, indent=2)
+        print(f'\n✓ Resultados gravados em {args.saida}')
+
+    if args.base:
+        with open(args.base, encoding='utf-8') as arquivo:
+            regressoes = comparar_com_base(resultados, json.load(arquivo), args.tolerancia)
+        if regressoes:
+            print(f'\n✗ {len(regressoes)} regressões acima de {args.tolerancia:.0%}:')
+            for regressao in regressoes:
+                print(f'  - {regressao}')
+            return 1
+        print(f'\n✓ Nenhuma regressão acima de {args.tolerancia:.0%} em relação a {args.base}')
+    return 0
+
+
+def rodar_wsgi(urls, concorrencia, cabecalhos):
+    """Atende as requisições com a aplicação WSGI em um pool de threads"""
+    clientes = threading.local()
+    amostras = []
+
+    def requisitar(url):
+        if not hasattr(clientes, 'cliente'):
+            clientes.cliente = app.test_client()
+        inicio = time.perf_counter()
+        assert clientes.cliente.get(url, headers=cabecalhos).status_code == 200
+        amostras.append((time.perf_counter() - inicio) * 1000)
+
+    with ThreadPoolExecutor(max_workers=concorrencia) as executor:
+        list(executor.map(requisitar, urls))
+        threads = threading.active_count()
+    return amostras, threads
+
+
+def rodar_asgi(urls, concorrencia, cabecalhos):
+    """Atende as requisições com a aplicação ASGI, com até `concorrencia` corrotinas ativas"""
+    import asgi
+    amostras = []
+
+    async def executar():
+        aplicacao_asgi = asgi.AplicacaoAssincrona()
+        vagas = asyncio.Semaphore(concorrencia)
+
+        async def requisitar(url):
+            async with vagas:
+                inicio = time.perf_counter()
+                status, _, _ = await asgi.chamar(aplicacao_asgi, 'GET', url, cabecalhos)
+                assert status == 200
+                amostras.append((time.perf_counter() - inicio) * 1000)
+
+        await asyncio.gather(*(requisitar(url) for url in urls))
+        threads = threading.active_count()
+        await aplicacao_asgi.engine.dispose()
+        return threads
+
+    return amostras, asyncio.run(executar())
+
+
+def benchmark_asgi(args):
+    """Compara WSGI (uma thread por requisição em andamento) com o modo assíncrono (asgi.py)"""
+    logging.getLogger('consultorio.sql').setLevel(logging.ERROR)
+    print(f'Populando {args.consultas} consultas...')
+    estado = preparar_suite(args.consultas)
+    popular_agenda(estado, args.consultas)
+    cabecalhos = {'Authorization': f"Bearer {create_access_token(identity=str(estado['admin_id']))}"}
+    aleatorio = random.Random(42)
+    urls = [f"/api/consultas/{aleatorio.randrange(estado['ultima_consulta']) + 1}" if i % 2
+            else '/api/consultas?cursor=&limite=20' for i in range(args.requisicoes)]
+
+    print(f'{args.requisicoes} requisições (obter_consulta e listar_consultas por cursor)\n')
+    for concorrencia in args.concorrencia:
+        for nome, rodar in (('WSGI + threads', rodar_wsgi), ('ASGI + asyncio', rodar_asgi)):
+            inicio = time.perf_counter()
+            amostras, threads = rodar(urls, concorrencia, cabecalhos)
+            vazao = len(urls) / (time.perf_counter() - inicio)
+
+            # Memória alocada em Python no pico, medida numa rodada menor à parte
+            tracemalloc.start()
+            rodar(urls[:max(concorrencia * 4, 200)], concorrencia, cabecalhos)
+            pico = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+
+            print(f'concorrência={concorrencia:<4} {nome:<15} {vazao:8.1f} req/s  '
+                  f'p50={statistics.median(amostras):7.2f}ms p95={percentil(amostras, 95):7.2f}ms  '
+                  f'threads={threads:<4} pico de memória={pico:6.1f} MiB')
+        print()
+
+
+def medir_servidor(comando, url_base, caminhos, concorrencia, cabecalhos, prazo=60):
+    """Sobe o servidor com `comando`, mede as requisições por HTTP e o encerra com SIGTERM"""
+    # Sessão própria: o SIGTERM chega também ao processo filho do recarregador do Flask
+    processo = subprocess.Popen(comando, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                start_new_session=True)
+    try:
+        limite = time.monotonic() + prazo
+        while True:
+            if processo.poll() is not None:
+                raise RuntimeError(f"Servidor terminou ao iniciar: {' '.join(comando)}")
+            try:
+                requests.get(f'{url_base}/api/health', timeout=1)
+                break
+            except requests.ConnectionError:
+                if time.monotonic() > limite:
+                    raise
+                time.sleep(0.2)
+
+        sessoes = threading.local()
+        amostras = []
+
+        def requisitar(caminho):
+            if not hasattr(sessoes, 'sessao'):
+                sessoes.sessao = requests.Session()
+            inicio = time.perf_counter()
+            assert sessoes.sessao.get(url_base + caminho, headers=cabecalhos).status_code == 200
+            amostras.append((time.perf_counter() - inicio) * 1000)
+
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concorrencia) as executor:
+            list(executor.map(requisitar, caminhos))
+        return len(caminhos) / (time.perf_counter() - inicio), amostras
+    finally:
+        os.killpg(processo.pid, signal.SIGTERM)
+        processo.wait(timeout=prazo)
+
+
+def benchmark_servidor(args):
+    """Compara por HTTP o servidor de desenvolvimento com o modo de produção do run.py"""
+    logging.getLogger('consultorio.sql').setLevel(logging.ERROR)
+    print(f'Populando {args.consultas} consultas...')
+    estado = preparar_suite(args.consultas)
+    popular_agenda(estado, args.consultas)
+    cabecalhos = {'Authorization': f"Bearer {create_access_token(identity=str(estado['admin_id']))}"}
+    aleatorio = random.Random(42)
+    caminhos = [aleatorio.choice([
+        '/api/consultas?cursor=&limite=20',
+        f"/api/consultas/{aleatorio.randrange(estado['ultima_consulta']) + 1}",
+        f"/api/pacientes/{aleatorio.randrange(estado['pacientes']) + 1}",
+    ]) for _ in range(args.requisicoes)]
+    # Os servidores usam o mesmo banco; nenhuma conexão deste processo deve segurá-lo
+    db.session.remove()
+    db.engine.dispose()
+
+    run = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'run.py')
+    modos = [
+        ('desenvolvimento (python app.py)', [sys.executable, run, '--sem-preparo'], 5000),
+        (f'produção ({args.workers} workers x {args.threads} threads)',
+         [sys.executable, run, '--sem-preparo', '--producao', '--porta', str(args.porta),
+          '--workers', str(args.workers), '--threads', str(args.threads)], args.porta),
+    ]
+
+    print(f'{args.requisicoes} requisições, {args.concorrencia} clientes simultâneos\n')
+    for nome, comando, porta in modos:
+        vazao, amostras = medir_servidor(comando, f'http://127.0.0.1:{porta}', caminhos,
+                                         args.concorrencia, cabecalhos)
+        print(f'{nome:<40} {vazao:8.1f} req/s  p50={statistics.median(amostras):7.2f}ms  '
+              f'p95={percentil(amostras, 95):7.2f}ms  p99={percentil(amostras, 99):7.2f}ms')
+
+
+def benchmark_compressao(args):
+    """CPU x bytes de cada codificação e nível, nas respostas grandes de listagens e buscas"""
+    popular_consultas(args.consultas)
+    cliente = app.test_client()
+    cabecalhos = {'Authorization': f"Bearer {create_access_token(identity=str(Usuario.query.first().id))}"}
+    respostas = [
+        ('listar_consultas (100 por página)', '/api/consultas?por_pagina=100'),
+        ('buscar_pacientes (100 por página)', '/api/pacientes/buscar?q=Silva&por_pagina=100'),
+        (f'buscar_consultas (NDJSON, {args.consultas} linhas)', '/api/consultas/buscar?formato=ndjson'),
+    ]
+    niveis = [('gzip', nivel) for nivel in (1, 3, 6, 9)]
+    if aplicacao.brotli is not None:
+        niveis += [('br', nivel) for nivel in (1, 4, 6, 9)]
+    else:
+        print('brotli não instalado: apenas gzip\n')
+
+    for nome, url in respostas:
+        dados = cliente.get(url, headers=cabecalhos).data
+        envio = len(dados) * 8 / args.link_kbps
+        print(f'{nome}: {len(dados) / 1024:.1f} KiB, envio sem compressão {envio:.1f} ms a {args.link_kbps} kbit/s')
+        for codificacao, nivel in niveis:
+            comprimido = aplicacao.comprimir(dados, codificacao, nivel)
+            tempo = statistics.median(medir(lambda: aplicacao.comprimir(dados, codificacao, nivel),
+                                            args.repeticoes))
+            envio = len(comprimido) * 8 / args.link_kbps
+            print(f'  {codificacao:<4} nível {nivel:<2} {len(comprimido) / 1024:8.1f} KiB '
+                  f'({len(dados) / len(comprimido):5.1f}x)  CPU {tempo:7.2f} ms  '
+                  f'CPU + envio {tempo + envio:8.1f} ms')
+        print()
+
+
+def benchmark_status(args):
+    """Fechamento do dia: N PUTs individuais x um PUT /api/consultas/status-lote"""
+    logging.getLogger('consultorio.sql').setLevel(logging.ERROR)
+    total = args.por_lote * args.repeticoes * 2
+    estado = preparar_suite(total)
+    popular_agenda(estado, total)
+    # Todas começam agendadas, para que cada mudança seja uma transição válida
+    Consulta.query.update({'status': 'agendada'})
+    db.session.commit()
+    cliente = app.test_client()
+    cabecalhos = {'Authorization': f"Bearer {create_access_token(identity=str(estado['admin_id']))}"}
+    ids = iter(range(1, total + 1))
+    print(f'{args.repeticoes} fechamentos de {args.por_lote} consultas (status realizada)\n')
+
+    def individual():
+        for _ in range(args.por_lote):
+            response = cliente.put(f'/api/consultas/{next(ids)}', headers=cabecalhos, json={'status': 'realizada'})
+            assert response.status_code == 200
+
+    def em_lote():
+        lote = [next(ids) for _ in range(args.por_lote)]
+        response = cliente.put('/api/consultas/status-lote', headers=cabecalhos,
+                               json={'ids': lote, 'status': 'realizada'})
+        assert response.get_json()['atualizadas'] == args.por_lote
+
+    imprimir_latencias(f'{args.por_lote} x PUT /api/consultas/<id>', medir(individual, args.repeticoes))
+    imprimir_latencias('PUT /api/consultas/status-lote', medir(em_lote, args.repeticoes))
+
+
+def main():
+    """Função principal"""
+    parser = argparse.ArgumentParser(description='Benchmarks da API do Consultório Médico')
+    subparsers = parser.add_subparsers(dest='comando', required=True)
+
+    busca = subparsers.add_parser('busca', help='Busca textual de pacientes')
+    busca.add_argument('--pacientes', type=int, default=100000)
+    busca.add_argument('--repeticoes', type=int, default=200)
+    busca.set_defaults(funcao=benchmark_busca)
+
+    login = subparsers.add_parser('login', help='Vazão de logins e latência das demais rotas')
+    login.add_argument('--logins', type=int, default=8, help='clientes fazendo login em paralelo')
+    login.add_argument('--duracao', type=float, default=10, help='duração de cada cenário em segundos')
+    login.set_defaults(funcao=benchmark_login)
+
+    cpf = subparsers.add_parser('cpf', help='Validação de CPF item a item e vetorizada')
+    cpf.add_argument('--quantidade', type=int, default=1000000)
+    cpf.set_defaults(funcao=benchmark_cpf)
+
+    serializacao = subparsers.add_parser('json', help='Serialização das páginas de listar_consultas')
+    serializacao.add_argument('--por-pagina', type=int, default=100)
+    serializacao.add_argument('--repeticoes', type=int, default=500)
+    serializacao.set_defaults(funcao=benchmark_json)
+
+    instrumentacao = subparsers.add_parser('metricas', help='Sobrecarga das métricas por rota e do SQL')
+    instrumentacao.add_argument('--repeticoes', type=int, default=2000)
+    instrumentacao.set_defaults(funcao=benchmark_metricas)
+
+    suite = subparsers.add_parser('suite', help='Todos os endpoints com 10k, 100k e 1M consultas')
+    suite.add_argument('--consultas', type=int, nargs='+', default=[10000, 100000, 1000000])
+    suite.add_argument('--repeticoes', type=int, default=200, help='requisições por endpoint')
+    suite.add_argument('--saida', help='arquivo JSON com os resultados')
+    suite.add_argument('--base', help='resultados anteriores (JSON) para detectar regressões')
+    suite.add_argument('--tolerancia', type=float, default=0.25,
+                       help='piora relativa de p50/p95 aceita antes de apontar regressão')
+    suite.set_defaults(funcao=benchmark_suite)
+
+    assincrono = subparsers.add_parser('asgi', help='Escalabilidade com concorrência: WSGI x ASGI')
+    assincrono.add_argument('--consultas', type=int, default=100000)
+    assincrono.add_argument('--requisicoes', type=int, default=2000)
+    assincrono.add_argument('--concorrencia', type=int, nargs='+', default=[1, 8, 32, 128])
+    assincrono.set_defaults(funcao=benchmark_asgi)
+
+    servidor = subparsers.add_parser('servidor', help='Servidor de desenvolvimento x modo de produção (HTTP)')
+    servidor.add_argument('--consultas', type=int, default=100000)
+    servidor.add_argument('--requisicoes', type=int, default=3000)
+    servidor.add_argument('--concorrencia', type=int, default=16, help='clientes HTTP simultâneos')
+    servidor.add_argument('--workers', type=int, default=(os.cpu_count() or 1) * 2 + 1)
+    servidor.add_argument('--threads', type=int, default=4)
+    servidor.add_argument('--porta', type=int, default=5055, help='porta do modo de produção')
+    servidor.set_defaults(funcao=benchmark_servidor)
+
+    compressao = subparsers.add_parser('compressao', help='Tamanho x CPU por codificação e nível de compressão')
+    compressao.add_argument('--consultas', type=int, default=5000)
+    compressao.add_argument('--repeticoes', type=int, default=20)
+    compressao.add_argument('--link-kbps', type=int, default=2000, help='velocidade do link do cliente (kbit/s)')
+    compressao.set_defaults(funcao=benchmark_compressao)
+
+    status = subparsers.add_parser('status', help='Mudança de status: PUTs individuais x em lote')
+    status.add_argument('--por-lote', type=int, default=50, help='consultas por fechamento')
+    status.add_argument('--repeticoes', type=int, default=20)
+    status.set_defaults(funcao=benchmark_status)
+
+    args = parser.parse_args()
+    with app.app_context():
+        db.create_all()
+        return args.funcao(args) or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
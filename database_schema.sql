@@ -11,6 +11,7 @@ CREATE TABLE IF NOT EXISTS usuarios (
     telefone VARCHAR(20),
     endereco VARCHAR(200),
     data_criacao DATETIME DEFAULT CURRENT_TIMESTAMP,
+    atualizado_em DATETIME DEFAULT CURRENT_TIMESTAMP,
     ativo BOOLEAN DEFAULT 1
 );
 
@@ -19,11 +20,13 @@ CREATE TABLE IF NOT EXISTS pacientes (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     nome VARCHAR(100) NOT NULL,
     cpf VARCHAR(14) UNIQUE NOT NULL,
+    cpf_normalizado VARCHAR(11) UNIQUE NOT NULL,
     data_nascimento DATE NOT NULL,
     telefone VARCHAR(20),
     email VARCHAR(120),
     endereco VARCHAR(200),
     data_cadastro DATETIME DEFAULT CURRENT_TIMESTAMP,
+    atualizado_em DATETIME DEFAULT CURRENT_TIMESTAMP,
     ativo BOOLEAN DEFAULT 1
 );
 
@@ -33,14 +36,54 @@ CREATE TABLE IF NOT EXISTS consultas (
     paciente_id INTEGER NOT NULL,
     medico_id INTEGER NOT NULL,
     data_consulta DATETIME NOT NULL,
+    duracao_minutos INTEGER NOT NULL DEFAULT 30,
     tipo_consulta VARCHAR(50) NOT NULL,
     observacoes TEXT,
     status VARCHAR(20) DEFAULT 'agendada' CHECK (status IN ('agendada', 'realizada', 'cancelada')),
     data_criacao DATETIME DEFAULT CURRENT_TIMESTAMP,
+    atualizado_em DATETIME DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (paciente_id) REFERENCES pacientes(id),
     FOREIGN KEY (medico_id) REFERENCES usuarios(id)
 );
 
+-- Criar tabela de resumo diário da agenda (mantida por triggers)
+CREATE TABLE IF NOT EXISTS agenda_resumo (
+    dia DATE NOT NULL,
+    medico_id INTEGER NOT NULL,
+    status VARCHAR(20) NOT NULL,
+    total INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (dia, medico_id, status),
+    FOREIGN KEY (medico_id) REFERENCES usuarios(id)
+);
+
+CREATE TRIGGER IF NOT EXISTS agenda_resumo_ai AFTER INSERT ON consultas
+BEGIN
+    INSERT INTO agenda_resumo (dia, medico_id, status, total)
+    VALUES (date(new.data_consulta), new.medico_id, new.status, 1)
+    ON CONFLICT (dia, medico_id, status) DO UPDATE SET total = total + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS agenda_resumo_au AFTER UPDATE OF data_consulta, medico_id, status ON consultas
+WHEN date(old.data_consulta) IS NOT date(new.data_consulta)
+    OR old.medico_id IS NOT new.medico_id OR old.status IS NOT new.status
+BEGIN
+    UPDATE agenda_resumo SET total = total - 1
+    WHERE dia = date(old.data_consulta) AND medico_id = old.medico_id AND status = old.status;
+    DELETE FROM agenda_resumo
+    WHERE dia = date(old.data_consulta) AND medico_id = old.medico_id AND status = old.status AND total <= 0;
+    INSERT INTO agenda_resumo (dia, medico_id, status, total)
+    VALUES (date(new.data_consulta), new.medico_id, new.status, 1)
+    ON CONFLICT (dia, medico_id, status) DO UPDATE SET total = total + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS agenda_resumo_ad AFTER DELETE ON consultas
+BEGIN
+    UPDATE agenda_resumo SET total = total - 1
+    WHERE dia = date(old.data_consulta) AND medico_id = old.medico_id AND status = old.status;
+    DELETE FROM agenda_resumo
+    WHERE dia = date(old.data_consulta) AND medico_id = old.medico_id AND status = old.status AND total <= 0;
+END;
+
 -- Inserir dados de exemplo - Usuários
 INSERT INTO usuarios (nome, email, senha_hash, tipo_usuario, telefone, endereco) VALUES
 ('Dr. João Silva', 'joao.silva@consultorio.com', '$2b$12$LQv3c1yqBWVHxkd0LHAkCOYz6TtxMQJqhN8/LewdBPj4J8K8K8K8K', 'admin', '(11) 99999-9999', 'Rua das Flores, 123 - São Paulo/SP'),
@@ -49,12 +92,12 @@ INSERT INTO usuarios (nome, email, senha_hash, tipo_usuario, telefone, endereco)
 ('Ana Oliveira', 'ana.oliveira@consultorio.com', '$2b$12$LQv3c1yqBWVHxkd0LHAkCOYz6TtxMQJqhN8/LewdBPj4J8K8K8K', 'recepcionista', '(11) 66666-6666', 'Rua Consolação, 321 - São Paulo/SP');
 
 -- Inserir dados de exemplo - Pacientes
-INSERT INTO pacientes (nome, cpf, data_nascimento, telefone, email, endereco) VALUES
-('Carlos Eduardo Silva', '123.456.789-01', '1985-03-15', '(11) 55555-5555', 'carlos.silva@email.com', 'Rua das Palmeiras, 100 - São Paulo/SP'),
-('Fernanda Lima', '987.654.321-02', '1990-07-22', '(11) 44444-4444', 'fernanda.lima@email.com', 'Av. Brasil, 200 - São Paulo/SP'),
-('Roberto Alves', '456.789.123-03', '1978-11-08', '(11) 33333-3333', 'roberto.alves@email.com', 'Rua das Acácias, 300 - São Paulo/SP'),
-('Patricia Souza', '789.123.456-04', '1992-05-30', '(11) 22222-2222', 'patricia.souza@email.com', 'Av. Faria Lima, 400 - São Paulo/SP'),
-('Marcos Pereira', '321.654.987-05', '1988-12-12', '(11) 11111-1111', 'marcos.pereira@email.com', 'Rua dos Pinheiros, 500 - São Paulo/SP');
+INSERT INTO pacientes (nome, cpf, cpf_normalizado, data_nascimento, telefone, email, endereco) VALUES
+('Carlos Eduardo Silva', '123.456.789-01', '12345678901', '1985-03-15', '(11) 55555-5555', 'carlos.silva@email.com', 'Rua das Palmeiras, 100 - São Paulo/SP'),
+('Fernanda Lima', '987.654.321-02', '98765432102', '1990-07-22', '(11) 44444-4444', 'fernanda.lima@email.com', 'Av. Brasil, 200 - São Paulo/SP'),
+('Roberto Alves', '456.789.123-03', '45678912303', '1978-11-08', '(11) 33333-3333', 'roberto.alves@email.com', 'Rua das Acácias, 300 - São Paulo/SP'),
+('Patricia Souza', '789.123.456-04', '78912345604', '1992-05-30', '(11) 22222-2222', 'patricia.souza@email.com', 'Av. Faria Lima, 400 - São Paulo/SP'),
+('Marcos Pereira', '321.654.987-05', '32165498705', '1988-12-12', '(11) 11111-1111', 'marcos.pereira@email.com', 'Rua dos Pinheiros, 500 - São Paulo/SP');
 
 -- Inserir dados de exemplo - Consultas
 INSERT INTO consultas (paciente_id, medico_id, data_consulta, tipo_consulta, observacoes, status) VALUES
@@ -64,13 +107,15 @@ INSERT INTO consultas (paciente_id, medico_id, data_consulta, tipo_consulta, obs
 (4, 2, '2024-01-17 08:30:00', 'Consulta de Rotina', 'Check-up anual', 'agendada'),
 (5, 3, '2024-01-18 16:00:00', 'Consulta Dermatológica', 'Seguimento de tratamento', 'agendada');
 
--- Criar índices para melhorar performance
-CREATE INDEX IF NOT EXISTS idx_usuarios_email ON usuarios(email);
-CREATE INDEX IF NOT EXISTS idx_usuarios_tipo ON usuarios(tipo_usuario);
-CREATE INDEX IF NOT EXISTS idx_pacientes_cpf ON pacientes(cpf);
-CREATE INDEX IF NOT EXISTS idx_consultas_paciente ON consultas(paciente_id);
-CREATE INDEX IF NOT EXISTS idx_consultas_medico ON consultas(medico_id);
+-- Criar índices para melhorar performance (os mesmos declarados nos modelos em app.py)
+-- email, cpf e cpf_normalizado já são indexados por serem UNIQUE
+CREATE INDEX IF NOT EXISTS idx_usuarios_ativos ON usuarios(id) WHERE ativo = 1;
+CREATE INDEX IF NOT EXISTS idx_usuarios_ativos_tipo ON usuarios(tipo_usuario, id) WHERE ativo = 1;
+CREATE INDEX IF NOT EXISTS idx_pacientes_ativos ON pacientes(id) WHERE ativo = 1;
 CREATE INDEX IF NOT EXISTS idx_consultas_data ON consultas(data_consulta);
+CREATE INDEX IF NOT EXISTS idx_consultas_medico_data ON consultas(medico_id, data_consulta);
+CREATE INDEX IF NOT EXISTS idx_consultas_paciente_data ON consultas(paciente_id, data_consulta);
+CREATE INDEX IF NOT EXISTS idx_consultas_status_data ON consultas(status, data_consulta);
 
 -- Comentários sobre a estrutura
 -- 
@@ -82,12 +127,21 @@ CREATE INDEX IF NOT EXISTS idx_consultas_data ON consultas(data_consulta);
 -- TABELA PACIENTES:
 -- - Armazena informações dos pacientes
 -- - CPF é único para evitar duplicatas
+-- - cpf_normalizado guarda apenas os dígitos do CPF, para que formatações
+--   diferentes do mesmo CPF sejam a mesma chave e a busca por CPF use o índice
 -- - Campo 'ativo' permite soft delete
 -- 
 -- TABELA CONSULTAS:
 -- - Armazena informações das consultas agendadas
 -- - Relaciona pacientes com médicos
 -- - Status permite controle do fluxo da consulta
+-- - Cada INSERT/UPDATE/DELETE atualiza agenda_resumo na mesma transação
+-- - duracao_minutos define o intervalo ocupado na agenda do médico; consultas
+--   não canceladas do mesmo médico não podem se sobrepor
+-- 
+-- ATUALIZADO_EM:
+-- - Presente em usuarios, pacientes e consultas; a aplicação o atualiza em toda escrita
+--   e o usa para responder GETs condicionais (ETag / Last-Modified)
 -- 
 -- SENHAS PADRÃO (hash para '123456'):
 -- Todos os usuários de exemplo têm a senha '123456'
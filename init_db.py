@@ -3,11 +3,21 @@
 """
 Script para inicialização do banco de dados do Consultório Médico
 Este script cria as tabelas e insere dados de exemplo
+
+Uso:
+    python init_db.py                    # dados de exemplo
+    python init_db.py --escala 1000000   # dados de exemplo + 1 milhão de consultas sintéticas
 """
 
-from app import app, db, Usuario, Paciente, Consulta
-from werkzeug.security import generate_password_hash
-from datetime import datetime, date
+from app import (app, db, Usuario, Paciente, Consulta, DDL_BUSCA_PACIENTES, DDL_RESUMO_AGENDA,
+                 atualizar_esquema, gerar_hash_senha, reconstruir_resumo_agenda)
+from datetime import datetime, date, timedelta
+import argparse
+import logging
+import re
+import sys
+import time
+import numpy as np
 
 def criar_dados_exemplo():
     """Cria dados de exemplo no banco de dados"""
@@ -56,7 +66,7 @@ def criar_dados_exemplo():
             usuario = Usuario(
                 nome=user_data['nome'],
                 email=user_data['email'],
-                senha_hash=generate_password_hash(user_data['senha']),
+                senha_hash=gerar_hash_senha(user_data['senha']),
                 tipo_usuario=user_data['tipo_usuario'],
                 telefone=user_data['telefone'],
                 endereco=user_data['endereco']
@@ -112,7 +122,7 @@ def criar_dados_exemplo():
     
     for paciente_data in pacientes_exemplo:
         # Verificar se paciente já existe
-        if not Paciente.query.filter_by(cpf=paciente_data['cpf']).first():
+        if not Paciente.buscar_por_cpf(paciente_data['cpf']):
             paciente = Paciente(**paciente_data)
             db.session.add(paciente)
             print(f"✓ Paciente criado: {paciente_data['nome']}")
@@ -180,21 +190,222 @@ def criar_dados_exemplo():
     print("- Email: pedro.costa@consultorio.com | Senha: 123456 | Tipo: Médico")
     print("- Email: ana.oliveira@consultorio.com | Senha: 123456 | Tipo: Recepcionista")
 
+# Geração de dados sintéticos em escala
+PRIMEIROS_NOMES = [
+    'Ana', 'Antônio', 'Beatriz', 'Bruno', 'Camila', 'Carlos', 'Débora', 'Eduardo',
+    'Fernanda', 'Francisco', 'Gabriela', 'Gustavo', 'Helena', 'Igor', 'Joana', 'José',
+    'Júlia', 'Lucas', 'Luíza', 'Marcos', 'Maria', 'Mateus', 'Natália', 'Otávio',
+    'Patrícia', 'Paulo', 'Rafael', 'Renata', 'Sérgio', 'Simone', 'Tiago', 'Vitória'
+]
+SOBRENOMES = [
+    'Almeida', 'Alves', 'Araújo', 'Barbosa', 'Cardoso', 'Carvalho', 'Castro', 'Conceição',
+    'Costa', 'Dias', 'Fernandes', 'Ferreira', 'Gomes', 'Lima', 'Lopes', 'Martins',
+    'Melo', 'Mendes', 'Monteiro', 'Moreira', 'Nascimento', 'Oliveira', 'Pereira', 'Ribeiro',
+    'Rocha', 'Rodrigues', 'Santana', 'Santos', 'Silva', 'Soares', 'Souza', 'Teixeira'
+]
+LOGRADOUROS = [
+    'Rua das Flores', 'Av. Paulista', 'Rua Augusta', 'Rua Consolação', 'Av. Brasil',
+    'Rua das Palmeiras', 'Av. Faria Lima', 'Rua dos Pinheiros', 'Rua das Acácias', 'Av. Rebouças'
+]
+TIPOS_CONSULTA = [
+    'Consulta de Rotina', 'Retorno', 'Consulta Cardiológica', 'Consulta Dermatológica',
+    'Consulta Pediátrica', 'Exame Periódico'
+]
+OBSERVACOES = [
+    None, None, 'Check-up anual', 'Paciente com histórico de hipertensão', 'Dor no peito e falta de ar',
+    'Manchas na pele', 'Seguimento de tratamento', 'Apresentar exames anteriores'
+]
+HORARIOS_POR_DIA = 20  # consultas de 30 minutos entre 08:00 e 18:00
+FORMATO_DATA_HORA = '%Y-%m-%d %H:%M:%S.%f'  # formato usado pelo SQLAlchemy no SQLite
+
+def gerar_cpfs(ids):
+    """Gera CPFs válidos e distintos (formatados e normalizados) a partir de ids distintos.
+    
+    Os 9 primeiros dígitos vêm de uma permutação de 0..10^9-1 (multiplicação por um número
+    coprimo com 10^9), então ids diferentes nunca geram o mesmo CPF.
+    """
+    base = (ids.astype(np.int64) * 387420489 + 123456789) % 10 ** 9
+    digitos = (base[:, None] // 10 ** np.arange(8, -1, -1)) % 10
+    for pesos in (np.arange(10, 1, -1), np.arange(11, 1, -1)):
+        resto = (digitos @ pesos) % 11
+        digitos = np.column_stack([digitos, np.where(resto < 2, 0, 11 - resto)])
+    
+    caracteres = (digitos + ord('0')).astype(np.uint8)
+    formatados = np.empty((len(ids), 14), dtype=np.uint8)
+    formatados[:, [0, 1, 2, 4, 5, 6, 8, 9, 10, 12, 13]] = caracteres
+    formatados[:, [3, 7]] = ord('.')
+    formatados[:, 11] = ord('-')
+    return (formatados.view('S14').ravel().astype('U14').tolist(),
+            np.ascontiguousarray(caracteres).view('S11').ravel().astype('U11').tolist())
+
+def inserir_em_lotes(connection, tabela, colunas, linhas, lote=100000):
+    """Insere as linhas (tuplas) com executemany, em lotes dentro da mesma transação"""
+    comando = f"INSERT INTO {tabela} ({', '.join(colunas)}) VALUES ({', '.join('?' * len(colunas))})"
+    for inicio in range(0, len(linhas), lote):
+        connection.exec_driver_sql(comando, linhas[inicio:inicio + lote])
+
+def gerar_medicos(primeiro_id, quantidade, senha_hash, agora):
+    aleatorio = np.random.default_rng(primeiro_id)
+    primeiros = aleatorio.integers(len(PRIMEIROS_NOMES), size=quantidade)
+    sobrenomes = aleatorio.integers(len(SOBRENOMES), size=quantidade)
+    return [
+        (primeiro_id + i, f'Dr(a). {PRIMEIROS_NOMES[p]} {SOBRENOMES[s]}', f'medico{primeiro_id + i}@consultorio.com',
+         senha_hash, 'medico', f'(11) 9{8000 + i % 2000}-{i % 10000:04d}', None, agora, agora, 1)
+        for i, (p, s) in enumerate(zip(primeiros.tolist(), sobrenomes.tolist()))
+    ]
+
+def gerar_pacientes(primeiro_id, quantidade, agora):
+    aleatorio = np.random.default_rng(primeiro_id)
+    ids = np.arange(primeiro_id, primeiro_id + quantidade)
+    cpfs, cpfs_normalizados = gerar_cpfs(ids)
+    nascimentos = np.datetime_as_string(
+        np.datetime64('1940-01-01') + aleatorio.integers(0, 80 * 365, size=quantidade), unit='D'
+    ).tolist()
+    nomes = zip(aleatorio.integers(len(PRIMEIROS_NOMES), size=quantidade).tolist(),
+                aleatorio.integers(len(SOBRENOMES), size=quantidade).tolist(),
+                aleatorio.integers(len(SOBRENOMES), size=quantidade).tolist())
+    numeros = aleatorio.integers(1, 3000, size=quantidade).tolist()
+    return [
+        (id_, f'{PRIMEIROS_NOMES[p]} {SOBRENOMES[s1]} {SOBRENOMES[s2]}', cpf, cpf_normalizado, nascimento,
+         f'(11) 9{id_ % 10000:04d}-{numero:04d}', f'paciente{id_}@email.com',
+         f'{LOGRADOUROS[id_ % len(LOGRADOUROS)]}, {numero} - São Paulo/SP', agora, agora, 1)
+        for id_, (p, s1, s2), cpf, cpf_normalizado, nascimento, numero
+        in zip(ids.tolist(), nomes, cpfs, cpfs_normalizados, nascimentos, numeros)
+    ]
+
+def gerar_consultas(quantidade, medicos, pacientes, agora):
+    """Agenda sem conflitos: os médicos se alternam e cada um atende 20 horários por dia útil.
+    
+    Cerca de 70% das consultas ficam no passado (realizadas ou canceladas) e o
+    restante no futuro (agendadas ou canceladas).
+    """
+    aleatorio = np.random.default_rng(quantidade)
+    dias_uteis = -(-quantidade // (len(medicos) * HORARIOS_POR_DIA))
+    hoje = np.datetime64(agora.date(), 'D')
+    primeiro_dia = np.busday_offset(hoje, -int(dias_uteis * 0.7), roll='forward')
+    dias = np.busday_offset(primeiro_dia, np.arange(dias_uteis), roll='forward').astype(datetime)
+    horarios = [
+        datetime.combine(dia, datetime.min.time()) + timedelta(hours=8, minutes=30 * posicao)
+        for dia in dias for posicao in range(HORARIOS_POR_DIA)
+    ]
+    textos = np.array([horario.strftime(FORMATO_DATA_HORA) for horario in horarios], dtype=object)
+    passado = np.array([horario < agora for horario in horarios])
+    
+    indices = np.arange(quantidade)
+    horario = indices // len(medicos)
+    cancelada = aleatorio.random(quantidade) < np.where(passado[horario], 0.15, 0.1)
+    status = np.where(cancelada, 'cancelada', np.where(passado[horario], 'realizada', 'agendada'))
+    agora_texto = agora.strftime(FORMATO_DATA_HORA)
+    return list(zip(
+        aleatorio.choice(pacientes, size=quantidade).tolist(),
+        np.asarray(medicos)[indices % len(medicos)].tolist(),
+        textos[horario].tolist(),
+        aleatorio.choice(np.array(TIPOS_CONSULTA, dtype=object), size=quantidade).tolist(),
+        aleatorio.choice(np.array(OBSERVACOES, dtype=object), size=quantidade).tolist(),
+        [30] * quantidade,
+        status.tolist(),
+        [agora_texto] * quantidade,
+        [agora_texto] * quantidade,
+    ))
+
+def criar_dados_em_escala(consultas, pacientes=None, medicos=None):
+    """Gera médicos, pacientes e consultas sintéticos em massa.
+    
+    Índices secundários e triggers (busca textual e resumo da agenda) são removidos
+    durante a carga e recriados depois, em uma única passada sobre os dados.
+    """
+    if db.engine.dialect.name != 'sqlite':
+        print("✗ A geração em escala está disponível apenas para SQLite")
+        return False
+    
+    pacientes = pacientes or max(100, consultas // 2)
+    medicos = medicos or max(5, consultas // 10000)
+    print(f"Gerando {medicos} médicos, {pacientes} pacientes e {consultas} consultas...")
+    # Cargas em lote não devem aparecer como comandos lentos no log
+    logging.getLogger('consultorio.sql').setLevel(logging.ERROR)
+    inicio = time.perf_counter()
+    agora = datetime.utcnow()
+    
+    indices = [indice for tabela in (Usuario.__table__, Paciente.__table__, Consulta.__table__)
+               for indice in tabela.indexes]
+    gatilhos = [re.search(r'CREATE TRIGGER IF NOT EXISTS (\w+)', ddl).group(1)
+                for ddl in DDL_BUSCA_PACIENTES + DDL_RESUMO_AGENDA if 'CREATE TRIGGER' in ddl]
+    
+    with db.engine.connect() as connection:
+        # Durabilidade reduzida apenas durante a carga, nesta conexão (o PRAGMA
+        # synchronous não pode ser alterado dentro de uma transação)
+        conexao_sqlite = connection.connection.driver_connection
+        sincronismo = conexao_sqlite.execute('PRAGMA synchronous').fetchone()[0]
+        conexao_sqlite.execute('PRAGMA synchronous = OFF')
+        conexao_sqlite.execute('PRAGMA cache_size = -262144')
+        try:
+            with connection.begin():
+                for indice in indices:
+                    connection.exec_driver_sql(f'DROP INDEX IF EXISTS {indice.name}')
+                for gatilho in gatilhos:
+                    connection.exec_driver_sql(f'DROP TRIGGER IF EXISTS {gatilho}')
+                
+                proximo_usuario = connection.exec_driver_sql('SELECT COALESCE(MAX(id), 0) + 1 FROM usuarios').scalar()
+                proximo_paciente = connection.exec_driver_sql('SELECT COALESCE(MAX(id), 0) + 1 FROM pacientes').scalar()
+                
+                inserir_em_lotes(connection, 'usuarios', [
+                    'id', 'nome', 'email', 'senha_hash', 'tipo_usuario', 'telefone', 'endereco',
+                    'data_criacao', 'atualizado_em', 'ativo'
+                ], gerar_medicos(proximo_usuario, medicos, gerar_hash_senha('123456'), agora))
+                print(f"✓ {medicos} médicos ({time.perf_counter() - inicio:.1f}s)")
+                
+                inserir_em_lotes(connection, 'pacientes', [
+                    'id', 'nome', 'cpf', 'cpf_normalizado', 'data_nascimento', 'telefone', 'email',
+                    'endereco', 'data_cadastro', 'atualizado_em', 'ativo'
+                ], gerar_pacientes(proximo_paciente, pacientes, agora))
+                print(f"✓ {pacientes} pacientes ({time.perf_counter() - inicio:.1f}s)")
+                
+                inserir_em_lotes(connection, 'consultas', [
+                    'paciente_id', 'medico_id', 'data_consulta', 'tipo_consulta', 'observacoes',
+                    'duracao_minutos', 'status', 'data_criacao', 'atualizado_em'
+                ], gerar_consultas(consultas, list(range(proximo_usuario, proximo_usuario + medicos)),
+                                   np.arange(proximo_paciente, proximo_paciente + pacientes), agora))
+                print(f"✓ {consultas} consultas ({time.perf_counter() - inicio:.1f}s)")
+        finally:
+            conexao_sqlite.execute(f'PRAGMA synchronous = {sincronismo}')
+    
+    # Índices, triggers e busca textual (atualizar_esquema) e resumo recriados depois da carga
+    atualizar_esquema()
+    reconstruir_resumo_agenda()
+    print(f"✓ Índices, busca textual e resumo da agenda recriados ({time.perf_counter() - inicio:.1f}s)")
+    print("\nMédicos gerados: medico<id>@consultorio.com | Senha: 123456")
+    return True
+
 def main():
     """Função principal"""
+    parser = argparse.ArgumentParser(description='Inicializa o banco de dados do Consultório Médico')
+    parser.add_argument('--escala', type=int, metavar='N',
+                        help='gera também N consultas sintéticas, com pacientes e médicos proporcionais')
+    parser.add_argument('--pacientes', type=int, help='pacientes gerados com --escala (padrão: N/2)')
+    parser.add_argument('--medicos', type=int, help='médicos gerados com --escala (padrão: N/10000, mínimo 5)')
+    args = parser.parse_args()
+    
     print("=== Inicialização do Banco de Dados do Consultório Médico ===\n")
     
     with app.app_context():
         # Criar todas as tabelas
         print("Criando tabelas do banco de dados...")
         db.create_all()
+        atualizar_esquema()
         print("✓ Tabelas criadas com sucesso!\n")
         
         # Criar dados de exemplo
         criar_dados_exemplo()
         
+        # Dados sintéticos em escala
+        if args.escala:
+            print()
+            if not criar_dados_em_escala(args.escala, args.pacientes, args.medicos):
+                return 1
+        
         print("\n=== Inicialização concluída! ===")
         print("Agora você pode executar: python app.py")
+    return 0
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
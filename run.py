@@ -3,8 +3,17 @@
 """
 Script de inicialização rápida do Consultório Médico
 Execute este script para configurar e executar a aplicação
+
+Uso:
+    python run.py                          # servidor de desenvolvimento (python app.py)
+    python run.py --producao --workers 4   # Gunicorn com vários processos
+
+No modo de produção, FLASK_ENV vale 'production' se não tiver sido definido (sem
+DEBUG nem eco de SQL, com o perfil WAL do SQLite); para outra configuração, defina
+FLASK_ENV explicitamente.
 """
 
+import argparse
 import subprocess
 import sys
 import os
@@ -31,10 +40,67 @@ def inicializar_banco():
         print("❌ Erro ao inicializar banco de dados")
         return False
 
-def executar_aplicacao():
+def reiniciar_conexoes(server, worker):
+    """Após o fork, descarta no worker as conexões herdadas do processo mestre sem fechá-las"""
+    from app import app, db
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+def fechar_conexoes(server, worker):
+    """Fecha as conexões do worker ao encerrá-lo (reciclagem ou desligamento)"""
+    from app import app, db
+    with app.app_context():
+        db.engine.dispose()
+
+def opcoes_producao(args):
+    """Configuração do Gunicorn para o modo de produção"""
+    return {
+        'bind': f'{args.host}:{args.porta}',
+        'workers': args.workers,
+        'worker_class': 'gthread',
+        'threads': args.threads,
+        # A aplicação é carregada no processo mestre antes do fork, e os workers
+        # compartilham a memória já carregada (copy-on-write)
+        'preload_app': True,
+        # Cada worker é substituído após N requisições; a variação evita que todos reiniciem juntos
+        'max_requests': args.max_requisicoes,
+        'max_requests_jitter': args.max_requisicoes // 10,
+        # No SIGTERM, as requisições em andamento têm esse prazo (segundos) para terminar
+        'graceful_timeout': args.tempo_encerramento,
+        'post_fork': reiniciar_conexoes,
+        'worker_exit': fechar_conexoes,
+    }
+
+def servidor_producao(args):
+    """Executa a aplicação no Gunicorn, com workers pré-criados (fork) e threads por worker"""
+    # Importados aqui porque as dependências podem ter acabado de ser instaladas
+    from gunicorn.app.base import BaseApplication
+
+    class ServidorProducao(BaseApplication):
+        def load_config(self):
+            for chave, valor in opcoes_producao(args).items():
+                self.cfg.set(chave, valor)
+
+        def load(self):
+            from app import app, db, atualizar_esquema
+            with app.app_context():
+                db.create_all()
+                atualizar_esquema()
+                # Nenhuma conexão aberta no mestre deve ser herdada pelos workers
+                db.engine.dispose()
+            return app
+
+    ServidorProducao().run()
+
+def executar_aplicacao(args):
     """Executa a aplicação Flask"""
     print("🚀 Iniciando aplicação...")
-    print("📡 API disponível em: http://localhost:5000")
+    if args.producao:
+        print(f"⚙️ Modo de produção: {args.workers} workers x {args.threads} threads, "
+              f"reciclados a cada {args.max_requisicoes} requisições")
+        print(f"📡 API disponível em: http://{args.host}:{args.porta}")
+    else:
+        print("📡 API disponível em: http://localhost:5000")
     print("🔑 Usuários de exemplo:")
     print("   - Admin: joao.silva@consultorio.com / 123456")
     print("   - Médico: maria.santos@consultorio.com / 123456")
@@ -42,6 +108,10 @@ def executar_aplicacao():
     print("\n⏹️ Para parar a aplicação, pressione Ctrl+C")
     print("=" * 60)
     
+    if args.producao:
+        servidor_producao(args)
+        return
+    
     try:
         subprocess.check_call([sys.executable, "app.py"])
     except KeyboardInterrupt:
@@ -51,6 +121,30 @@ def executar_aplicacao():
 
 def main():
     """Função principal"""
+    parser = argparse.ArgumentParser(description='Configura e executa a API do Consultório Médico')
+    parser.add_argument('--producao', action='store_true',
+                        help='serve com o Gunicorn (vários processos) em vez do servidor de desenvolvimento')
+    parser.add_argument('--sem-preparo', action='store_true',
+                        help='não instala dependências nem inicializa o banco')
+    parser.add_argument('--host', default=os.environ.get('WEB_HOST', '0.0.0.0'))
+    parser.add_argument('--porta', type=int, default=int(os.environ.get('WEB_PORTA', 5000)))
+    parser.add_argument('--workers', type=int,
+                        default=int(os.environ.get('WEB_WORKERS', (os.cpu_count() or 1) * 2 + 1)),
+                        help='processos do modo de produção (padrão: 2 x CPUs + 1)')
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('WEB_THREADS', 4)),
+                        help='threads por processo no modo de produção')
+    parser.add_argument('--max-requisicoes', type=int,
+                        default=int(os.environ.get('WEB_MAX_REQUISICOES', 1000)),
+                        help='requisições atendidas por worker antes de ser reciclado (0 desliga)')
+    parser.add_argument('--tempo-encerramento', type=int,
+                        default=int(os.environ.get('WEB_TEMPO_ENCERRAMENTO', 30)),
+                        help='segundos para concluir as requisições em andamento ao encerrar')
+    args = parser.parse_args()
+    
+    if args.producao:
+        # Antes de importar app (e de rodar init_db.py), que escolhem a configuração por FLASK_ENV
+        os.environ.setdefault('FLASK_ENV', 'production')
+    
     print("=" * 60)
     print("🏥 CONSULTÓRIO MÉDICO - API REST")
     print("=" * 60)
@@ -61,16 +155,17 @@ def main():
         print("   Certifique-se de que os arquivos app.py, requirements.txt estão presentes")
         return
     
-    # Instalar dependências
-    if not instalar_dependencias():
-        return
-    
-    # Inicializar banco de dados
-    if not inicializar_banco():
-        return
+    if not args.sem_preparo:
+        # Instalar dependências
+        if not instalar_dependencias():
+            return
+        
+        # Inicializar banco de dados
+        if not inicializar_banco():
+            return
     
     # Executar aplicação
-    executar_aplicacao()
+    executar_aplicacao(args)
 
 if __name__ == "__main__":
     main()
@@ -169,6 +169,28 @@ class ConsultorioAPITest:
             print(f"✗ Erro ao listar consultas: {response.json()}")
             return []
     
+    def listar_consultas_cursor(self, limite=2):
+        """Percorre todas as consultas usando paginação por cursor"""
+        url = f'{BASE_URL}/consultas'
+        params = {'cursor': '', 'limite': limite}
+        consultas = []
+        
+        while True:
+            response = requests.get(url, headers=self.headers, params=params)
+            
+            if response.status_code != 200:
+                print(f"✗ Erro ao paginar consultas por cursor: {response.json()}")
+                return []
+            
+            data = response.json()
+            consultas.extend(data['consultas'])
+            if not data['paginacao']['tem_proxima']:
+                break
+            params['cursor'] = data['paginacao']['proxima_cursor']
+        
+        print(f"✓ Percorridas {len(consultas)} consultas por cursor (limite {limite})")
+        return consultas
+    
     def obter_paciente(self, paciente_id):
         """Obtém um paciente específico"""
         url = f'{BASE_URL}/pacientes/{paciente_id}'
@@ -337,6 +359,10 @@ def executar_testes():
     print("\n12. Listando consultas com paginação...")
     consultas = cliente.listar_consultas(pagina=1, por_pagina=3)
     
+    # Teste 12.1: Paginação por cursor
+    print("\n12.1. Percorrendo consultas com paginação por cursor...")
+    cliente.listar_consultas_cursor(limite=2)
+    
     # Teste 13: Obter consulta específica
     print("\n13. Obtendo consulta específica...")
     cliente.obter_consulta(1)
@@ -0,0 +1,1040 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Testes de desempenho da API do Consultório Médico
+Executam a aplicação em processo (Flask test client) sobre um banco em memória
+e verificam propriedades de desempenho, como o número de comandos SQL por requisição.
+
+Execute com: python -m pytest test_desempenho.py
+"""
+
+import gzip
+import json
+import os
+
+os.environ.setdefault('FLASK_ENV', 'testing')
+
+from datetime import datetime, timedelta
+
+import random
+import re
+import threading
+import time
+import zlib
+
+import pytest
+from sqlalchemy import create_engine, event, inspect, text
+
+import app as aplicacao
+from app import app, db, Usuario, Paciente, Consulta, gerar_hash_senha, validar_cpf, validar_cpfs
+from config import ProductionConfig
+
+
+@pytest.fixture
+def cliente():
+    """Cria um banco limpo e retorna o cliente de teste da aplicação"""
+    aplicacao._estado_usuarios.clear()
+    aplicacao.cache_entidades.limpar()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        yield app.test_client()
+        db.session.remove()
+
+
+@pytest.fixture
+def admin(cliente):
+    """Cria um administrador e retorna os cabeçalhos com o token JWT"""
+    db.session.add(Usuario(
+        nome='Admin Teste',
+        email='admin@teste.com',
+        senha_hash=gerar_hash_senha('123456'),
+        tipo_usuario='admin'
+    ))
+    db.session.commit()
+
+    response = cliente.post('/api/auth/login', json={'email': 'admin@teste.com', 'senha': '123456'})
+    return {'Authorization': f"Bearer {response.get_json()['access_token']}"}
+
+
+def criar_consultas(quantidade):
+    """Cria médicos, pacientes e consultas distintos para o teste"""
+    inicio = datetime(2024, 1, 1, 8, 0)
+    for i in range(quantidade):
+        medico = Usuario(
+            nome=f'Médico {i}',
+            email=f'medico{i}@teste.com',
+            senha_hash='x',
+            tipo_usuario='medico'
+        )
+        paciente = Paciente(
+            nome=f'Paciente {i}',
+            cpf=f'{i:011d}',
+            data_nascimento=datetime(1990, 1, 1).date()
+        )
+        db.session.add_all([medico, paciente])
+        db.session.flush()
+        db.session.add(Consulta(
+            paciente_id=paciente.id,
+            medico_id=medico.id,
+            data_consulta=inicio + timedelta(minutes=30 * i),
+            tipo_consulta='Consulta de Rotina'
+        ))
+    db.session.commit()
+
+
+class ContadorSQL:
+    """Conta os comandos SQL executados no engine enquanto ativo"""
+
+    def __init__(self):
+        self.total = 0
+        self.comandos = []
+
+    def _contar(self, conn, cursor, statement, *args):
+        self.total += 1
+        self.comandos.append(statement)
+
+    def __enter__(self):
+        event.listen(db.engine, 'before_cursor_execute', self._contar)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(db.engine, 'before_cursor_execute', self._contar)
+
+
+@pytest.mark.parametrize('url', [
+    '/api/consultas?por_pagina=5',
+    '/api/consultas?por_pagina=40',
+    '/api/consultas?cursor=&limite=5',
+    '/api/consultas?cursor=&limite=40',
+    '/api/consultas/buscar',
+    '/api/consultas/buscar?status=agendada',
+])
+def test_listagem_de_consultas_sem_n_mais_1(cliente, admin, url):
+    """Listagens de consultas devem usar um número fixo de comandos SQL"""
+    criar_consultas(40)
+    db.session.expunge_all()
+
+    with ContadorSQL() as contador:
+        response = cliente.get(url, headers=admin)
+
+    assert response.status_code == 200
+    consultas = response.get_json()['consultas']
+    assert consultas and all(c['paciente_nome'] and c['medico_nome'] for c in consultas)
+    # paginação por número: COUNT + SELECT; cursor e busca: um único SELECT
+    assert contador.total <= 2
+
+
+def test_busca_de_pacientes_acompanha_alteracoes(cliente, admin):
+    """O índice de busca ignora acentos e reflete criação, atualização e soft delete"""
+    response = cliente.post('/api/pacientes', headers=admin, json={
+        'nome': 'José Antônio Conceição',
+        'cpf': '529.982.247-25',
+        'data_nascimento': '1980-05-10'
+    })
+    paciente_id = response.get_json()['paciente']['id']
+
+    def buscar(texto):
+        response = cliente.get(f'/api/pacientes/buscar?q={texto}', headers=admin)
+        return [p['id'] for p in response.get_json()['pacientes']]
+
+    assert buscar('jose antonio') == [paciente_id]
+    assert buscar('CONCEI') == [paciente_id]
+
+    cliente.put(f'/api/pacientes/{paciente_id}', headers=admin, json={'nome': 'Joana Prado'})
+    assert buscar('jose') == []
+    assert buscar('joana') == [paciente_id]
+
+    cliente.delete(f'/api/pacientes/{paciente_id}', headers=admin)
+    assert buscar('joana') == []
+
+    # Na inicialização, o índice só é reconstruído se não confere com os pacientes ativos
+    assert aplicacao.sincronizar_indice_busca() is False
+    db.session.execute(text('UPDATE pacientes SET ativo = 1'))
+    db.session.execute(text('DELETE FROM pacientes_busca'))
+    db.session.commit()
+    assert aplicacao.sincronizar_indice_busca() is True
+    assert buscar('joana') == [paciente_id]
+
+
+def test_busca_por_nome_ordena_todos_os_resultados_por_relevancia(cliente, admin):
+    """As páginas cobrem todos os pacientes que casam, em ordem de relevância, sem repetições"""
+    # Os mais relevantes (nome curto) são os últimos cadastrados
+    nomes = [f'Maria {"Souza " * (10 - i)}{i}' for i in range(10)]
+    for i, nome in enumerate(nomes):
+        db.session.add(Paciente(nome=nome, cpf=f'{i:011d}', data_nascimento=datetime(1990, 1, 1).date()))
+    db.session.commit()
+
+    def pagina(numero):
+        response = cliente.get(f'/api/pacientes/buscar?q=maria&por_pagina=4&pagina={numero}', headers=admin)
+        dados = response.get_json()
+        return [p['nome'] for p in dados['pacientes']], dados['paginacao']['tem_proxima']
+
+    assert pagina(1) == (nomes[::-1][:4], True)
+    assert pagina(2) == (nomes[::-1][4:8], True)
+    assert pagina(3) == (nomes[::-1][8:], False)
+
+
+def test_cpf_normalizado_detecta_duplicatas_e_busca_exata(cliente, admin):
+    """CPFs com e sem formatação são a mesma chave e a busca usa igualdade no índice"""
+    dados = {'nome': 'Paciente CPF', 'cpf': '529.982.247-25', 'data_nascimento': '1980-05-10'}
+    assert cliente.post('/api/pacientes', headers=admin, json=dados).status_code == 201
+
+    dados['cpf'] = '52998224725'
+    response = cliente.post('/api/pacientes', headers=admin, json=dados)
+    assert response.status_code == 400
+    assert response.get_json()['erro'] == 'CPF já cadastrado'
+
+    for texto in ['52998224725', '529.982.247-25', '529.982']:
+        response = cliente.get(f'/api/pacientes/buscar?q={texto}', headers=admin)
+        assert [p['cpf'] for p in response.get_json()['pacientes']] == ['529.982.247-25']
+
+
+def test_migracao_do_cpf_normalizado_com_cpfs_repetidos(cliente, caplog):
+    """Bancos antigos com o mesmo CPF gravado com e sem formatação migram sem erro: os
+    repetidos são registrados e o índice único é criado quando deixam de existir"""
+    # Tabela de pacientes como era antes da coluna cpf_normalizado
+    ddl = db.session.execute(text("SELECT sql FROM sqlite_master WHERE name = 'pacientes'")).scalar()
+    ddl = re.sub(r'\s*cpf_normalizado VARCHAR\(11\) NOT NULL,', '', ddl)
+    ddl = re.sub(r',\s*UNIQUE \(cpf_normalizado\)', '', ddl)
+    db.session.execute(text('DROP TABLE pacientes'))
+    db.session.execute(text(ddl))
+    for cpf in ['123.456.789-01', '12345678901', '529.982.247-25']:
+        db.session.execute(text(
+            "INSERT INTO pacientes (nome, cpf, data_nascimento, ativo) VALUES ('Paciente', :cpf, '1990-01-01', 1)"
+        ), {'cpf': cpf})
+    db.session.commit()
+
+    with caplog.at_level('WARNING', logger='consultorio.esquema'):
+        aplicacao.atualizar_esquema()
+    assert 'CPF 12345678901: pacientes 1,2 (123.456.789-01 | 12345678901)' in caplog.text
+    indices = lambda: [i['name'] for i in inspect(db.engine).get_indexes('pacientes') if i['unique']]
+    assert 'ix_pacientes_cpf_normalizado' not in indices()
+
+    db.session.execute(text("DELETE FROM pacientes WHERE id = 2"))
+    db.session.commit()
+    aplicacao.atualizar_esquema()
+    assert 'ix_pacientes_cpf_normalizado' in indices()
+
+
+def test_autorizacao_usa_claims_e_respeita_desativacao(cliente, admin):
+    """Rotas com controle de acesso não consultam o usuário a cada requisição,
+    mas tokens de usuários desativados deixam de valer"""
+    db.session.add(Usuario(
+        nome='Recepção',
+        email='recepcao@teste.com',
+        senha_hash=gerar_hash_senha('123456'),
+        tipo_usuario='recepcionista'
+    ))
+    db.session.commit()
+    response = cliente.post('/api/auth/login', json={'email': 'recepcao@teste.com', 'senha': '123456'})
+    recepcao = {'Authorization': f"Bearer {response.get_json()['access_token']}"}
+    recepcao_id = response.get_json()['usuario']['id']
+
+    # Primeira requisição preenche o cache; as seguintes não consultam usuarios
+    assert cliente.post('/api/usuarios', headers=recepcao, json={}).status_code == 403
+    with ContadorSQL() as contador:
+        assert cliente.post('/api/usuarios', headers=recepcao, json={}).status_code == 403
+    assert contador.total == 0
+
+    # Recepcionista pode atualizar o próprio perfil
+    response = cliente.put(f'/api/usuarios/{recepcao_id}', headers=recepcao, json={'telefone': '123'})
+    assert response.status_code == 200
+
+    assert cliente.delete(f'/api/usuarios/{recepcao_id}', headers=admin).status_code == 200
+    response = cliente.put(f'/api/usuarios/{recepcao_id}', headers=recepcao, json={'telefone': '456'})
+    assert response.status_code == 401
+
+
+def test_login_refaz_hash_quando_custo_muda(cliente):
+    """Senhas com custo diferente do configurado são refeitas no login"""
+    usuario = Usuario(
+        nome='Custo Antigo',
+        email='antigo@teste.com',
+        senha_hash=aplicacao.generate_password_hash('123456', method='pbkdf2:sha256:2000'),
+        tipo_usuario='medico'
+    )
+    db.session.add(usuario)
+    db.session.commit()
+
+    response = cliente.post('/api/auth/login', json={'email': 'antigo@teste.com', 'senha': '123456'})
+    assert response.status_code == 200
+
+    db.session.refresh(usuario)
+    assert usuario.senha_hash.startswith(app.config['SENHA_HASH_METODO'] + '$')
+    response = cliente.post('/api/auth/login', json={'email': 'antigo@teste.com', 'senha': '123456'})
+    assert response.status_code == 200
+
+
+def test_login_nao_refaz_hash_com_metodo_sem_custo(cliente, monkeypatch):
+    """Com SENHA_HASH_METODO sem custo explícito, o hash é refeito só uma vez"""
+    monkeypatch.setitem(app.config, 'SENHA_HASH_METODO', 'scrypt')
+    monkeypatch.setattr(aplicacao, 'PREFIXO_HASH_SENHA', aplicacao.gerar_hash_senha('').split('$', 1)[0])
+    usuario = Usuario(nome='Sem Custo', email='semcusto@teste.com',
+                      senha_hash=aplicacao.generate_password_hash('123456', method='pbkdf2:sha256:2000'),
+                      tipo_usuario='medico')
+    db.session.add(usuario)
+    db.session.commit()
+
+    hashes = []
+    for _ in range(2):
+        response = cliente.post('/api/auth/login', json={'email': 'semcusto@teste.com', 'senha': '123456'})
+        assert response.status_code == 200
+        db.session.refresh(usuario)
+        hashes.append(usuario.senha_hash)
+    assert hashes[0].startswith('scrypt:32768:8:1$')
+    assert hashes[1] == hashes[0]
+
+
+def test_importacao_em_lote_de_pacientes(cliente, admin):
+    """A importação valida cada linha, detecta duplicatas e insere em lotes"""
+    cliente.post('/api/pacientes', headers=admin, json={
+        'nome': 'Já Cadastrado', 'cpf': '529.982.247-25', 'data_nascimento': '1980-05-10'
+    })
+    corpo = '\n'.join([
+        '{"nome": "Ana Lima", "cpf": "111.444.777-35", "data_nascimento": "1990-01-01"}',
+        '{"nome": "Ana Lima Repetida", "cpf": "11144477735", "data_nascimento": "1990-01-01"}',
+        '{"nome": "CPF Existente", "cpf": "52998224725", "data_nascimento": "1990-01-01"}',
+        '{"nome": "CPF Inválido", "cpf": "123", "data_nascimento": "1990-01-01"}',
+        'isto não é json',
+        '{"nome": "Bruno Dias", "cpf": "935.411.347-80", "data_nascimento": "1985-02-03"}',
+    ])
+
+    with ContadorSQL() as contador:
+        response = cliente.post('/api/pacientes/lote?lote=3', headers=admin, data=corpo,
+                                content_type='application/x-ndjson')
+    relatorio = response.get_json()
+
+    assert response.status_code == 200
+    assert relatorio['importados'] == 2
+    assert [(e['linha'], e['erro']) for e in relatorio['erros']] == [
+        (2, 'CPF já cadastrado'),
+        (3, 'CPF já cadastrado'),
+        (4, 'CPF inválido'),
+        (5, 'Registro inválido'),
+    ]
+    # Por lote: uma consulta de duplicatas e um INSERT (mais o COMMIT)
+    assert contador.total <= 2 * 3
+
+    csv = 'nome,cpf,data_nascimento\nCarla Souza,123.456.789-09,1970-07-07\n'
+    response = cliente.post('/api/pacientes/lote', headers=admin, data=csv, content_type='text/csv')
+    assert response.get_json()['importados'] == 1
+    assert cliente.get('/api/pacientes/buscar?q=carla', headers=admin).get_json()['pacientes']
+
+
+def test_importacao_rejeita_campos_invalidos_e_conflitos_por_linha(cliente, admin, monkeypatch):
+    """Tipos e tamanhos errados e CPFs gravados por outro cadastro durante a importação
+    viram erros da linha; o relatório volta completo e a lista de erros é limitada"""
+    def linha(nome, cpf, **extra):
+        return json.dumps({'nome': nome, 'cpf': cpf, 'data_nascimento': '1990-01-01', **extra})
+
+    corpo = '\n'.join([
+        linha('Ana Lima', '111.444.777-35'),
+        linha(['x'], '529.982.247-25'),
+        linha('Nome Longo', '123.456.789-09', endereco='x' * 201),
+        linha('Telefone Numérico', '390.533.447-05', telefone=11999999999),
+        linha('Bruno Dias', '935.411.347-80'),
+        linha('Carla Souza', '453.178.287-91'),
+    ])
+
+    # Outro cadastro grava o CPF de Bruno entre a verificação de duplicatas e o INSERT
+    def cadastro_concorrente(conn, cursor, statement, parameters, context, executemany):
+        linhas = parameters if executemany else [parameters]
+        if statement.startswith('INSERT INTO pacientes') and any('93541134780' in linha for linha in linhas):
+            cursor.execute("INSERT INTO pacientes (nome, cpf, cpf_normalizado, data_nascimento, ativo) "
+                           "VALUES ('Concorrente', '935.411.347-80', '93541134780', '1990-01-01', 1)")
+
+    monkeypatch.setitem(app.config, 'IMPORTACAO_MAXIMO_ERROS', 3)
+    event.listen(db.engine, 'before_cursor_execute', cadastro_concorrente)
+    try:
+        response = cliente.post('/api/pacientes/lote?lote=3', headers=admin, data=corpo,
+                                content_type='application/x-ndjson')
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', cadastro_concorrente)
+    relatorio = response.get_json()
+
+    assert response.status_code == 200
+    assert relatorio['importados'] == 2 and relatorio['rejeitados'] == 4
+    assert [(e['linha'], e['erro']) for e in relatorio['erros']] == [
+        (2, 'Campo nome deve ser texto'),
+        (3, 'Campo endereco deve ter no máximo 200 caracteres'),
+        (4, 'Campo telefone deve ser texto'),
+    ]
+    assert sorted(p.nome for p in Paciente.query) == ['Ana Lima', 'Carla Souza']
+
+
+def test_validacao_vetorizada_de_cpf_igual_a_validar_cpf():
+    """validar_cpfs produz exatamente o mesmo resultado que validar_cpf"""
+    aleatorio = random.Random(7)
+    cpfs = ['529.982.247-25', '52998224725', '111.111.111-11', '00000000000', '', '123',
+            '529.982.247-2', '529.982.247-250', 'abc52998224725xyz', '123.456.789-09', 'ç529982247ã25']
+    for _ in range(20000):
+        digitos = ''.join(aleatorio.choice('0123456789') for _ in range(aleatorio.choice([10, 11, 11, 12])))
+        if aleatorio.random() < 0.5:
+            digitos = f'{digitos[:3]}.{digitos[3:6]}.{digitos[6:9]}-{digitos[9:]}'
+        cpfs.append(digitos)
+    # Garante uma boa quantidade de CPFs válidos na amostra
+    cpfs += [cpf[:9] + d1 + d2 for cpf in cpfs[:2000] if len(cpf) == 11
+             for d1 in '0123456789' for d2 in '0123456789'][:5000]
+
+    assert validar_cpfs(cpfs).tolist() == [validar_cpf(cpf) for cpf in cpfs]
+    # CPFs com quebra de linha usam a normalização item a item
+    cpfs.append('529.982.247\n-25')
+    assert validar_cpfs(cpfs).tolist() == [validar_cpf(cpf) for cpf in cpfs]
+
+
+def test_validar_cpf_em_lote(cliente, admin):
+    """O endpoint de validação retorna o resultado de cada CPF enviado"""
+    response = cliente.post('/api/pacientes/validar-cpf', headers=admin,
+                            json={'cpfs': ['529.982.247-25', '111.111.111-11', 123]})
+    assert response.status_code == 200
+    assert [r['valido'] for r in response.get_json()['resultados']] == [True, False, False]
+    assert response.get_json()['validos'] == 1
+
+
+def test_exportacao_em_fluxo(cliente, admin):
+    """Exportações em NDJSON e CSV são transmitidas em fluxo e trazem todas as linhas"""
+    criar_consultas(25)
+    aplicacao.EXPORTACAO_LOTE, lote_original = 10, aplicacao.EXPORTACAO_LOTE
+    try:
+        response = cliente.get('/api/consultas/buscar?formato=ndjson', headers=admin)
+        assert response.is_streamed
+        assert response.mimetype == 'application/x-ndjson'
+        linhas = response.get_data(as_text=True).splitlines()
+        assert len(linhas) == 25
+        assert '"medico_nome": "Médico 0"' in linhas[0]
+
+        response = cliente.get('/api/pacientes?formato=csv', headers=admin)
+        linhas = response.get_data(as_text=True).splitlines()
+        assert linhas[0].startswith('id,nome,cpf')
+        assert len(linhas) == 26
+    finally:
+        aplicacao.EXPORTACAO_LOTE = lote_original
+
+    assert cliente.get('/api/pacientes?formato=xml', headers=admin).status_code == 400
+
+
+def test_conflito_de_agenda_e_horarios_livres(cliente, admin):
+    """Consultas sobrepostas do mesmo médico são recusadas e os horários livres as descontam"""
+    criar_consultas(1)
+    medico_id = Usuario.query.filter_by(tipo_usuario='medico').first().id
+    paciente_id = Paciente.query.first().id
+
+    def agendar(horario, **extra):
+        return cliente.post('/api/consultas', headers=admin, json={
+            'paciente_id': paciente_id, 'medico_id': medico_id,
+            'data_consulta': f'2024-03-04 {horario}', 'tipo_consulta': 'Rotina', **extra
+        })
+
+    assert agendar('09:00', duracao_minutos=60).status_code == 201
+    assert agendar('09:30').status_code == 409
+    assert agendar('08:45').status_code == 409
+    assert agendar('10:00').status_code == 201
+    assert agendar('08:30').status_code == 201
+
+    # Cancelar libera o horário
+    cancelada = agendar('11:00').get_json()['consulta']['id']
+    cliente.put(f'/api/consultas/{cancelada}', headers=admin, json={'status': 'cancelada'})
+    assert cliente.put(f'/api/consultas/{cancelada}', headers=admin,
+                       json={'status': 'agendada', 'data_consulta': '2024-03-04 10:15'}).status_code == 409
+
+    response = cliente.get(f'/api/medicos/{medico_id}/horarios-livres?dia=2024-03-04&duracao=30', headers=admin)
+    livres = [h['inicio'][11:16] for h in response.get_json()['horarios_livres']]
+    assert livres[:4] == ['08:00', '10:30', '11:00', '11:30']
+    assert livres[-1] == '17:30'
+
+
+def test_resumo_da_agenda_mantido_incrementalmente(cliente, admin):
+    """O resumo por dia, médico e status acompanha criação, alteração e remoção de consultas"""
+    criar_consultas(3)
+    consulta_id = Consulta.query.first().id
+    cliente.put(f'/api/consultas/{consulta_id}', headers=admin, json={'status': 'cancelada'})
+    cliente.put(f'/api/consultas/{consulta_id + 1}', headers=admin, json={'data_consulta': '2024-01-02 09:00'})
+    cliente.delete(f'/api/consultas/{consulta_id + 2}', headers=admin)
+
+    assert aplicacao.verificar_resumo_agenda() == []
+    response = cliente.get('/api/consultas/resumo?data_inicio=2024-01-01&data_fim=2024-01-31', headers=admin)
+    assert [(r['dia'], r['status'], r['total']) for r in response.get_json()['resumo']] == [
+        ('2024-01-01', 'cancelada', 1),
+        ('2024-01-02', 'agendada', 1),
+    ]
+
+    # Uma divergência é detectada e corrigida pela reconstrução
+    db.session.execute(aplicacao.text('UPDATE agenda_resumo SET total = 7'))
+    db.session.commit()
+    assert len(aplicacao.verificar_resumo_agenda()) == 2
+    aplicacao.reconstruir_resumo_agenda()
+    assert aplicacao.verificar_resumo_agenda() == []
+
+
+def test_get_condicional_com_etag_e_last_modified(cliente, admin):
+    """GETs respondem 304 enquanto o recurso não muda e voltam a enviar o corpo após alterações"""
+    criar_consultas(2)
+    paciente_id = Paciente.query.first().id
+    consulta_id = Consulta.query.filter_by(paciente_id=paciente_id).first().id
+
+    for url in [f'/api/pacientes/{paciente_id}', f'/api/consultas/{consulta_id}',
+                '/api/pacientes', '/api/consultas?cursor=', '/api/usuarios']:
+        response = cliente.get(url, headers=admin)
+        etag, ultima_modificacao = response.headers['ETag'], response.headers.get('Last-Modified')
+        assert response.status_code == 200
+        response = cliente.get(url, headers={**admin, 'If-None-Match': etag})
+        assert response.status_code == 304 and not response.data
+        if url.startswith(('/api/pacientes/', '/api/consultas/')):
+            response = cliente.get(url, headers={**admin, 'If-Modified-Since': ultima_modificacao})
+            assert response.status_code == 304
+        else:
+            # Coleções não levam Last-Modified: uma exclusão não muda a data dos itens restantes
+            assert ultima_modificacao is None
+
+    # Excluir (ou desativar) um item muda a ETag da coleção
+    outra_consulta = Consulta.query.filter(Consulta.id != consulta_id).first().id
+    for url, exclusao in [('/api/consultas', f'/api/consultas/{outra_consulta}'),
+                          ('/api/pacientes', f'/api/pacientes/{paciente_id}')]:
+        etag = cliente.get(url, headers=admin).headers['ETag']
+        assert cliente.delete(exclusao, headers=admin).status_code == 200
+        response = cliente.get(url, headers={**admin, 'If-None-Match': etag})
+        assert response.status_code == 200
+
+    # Mudar o nome do paciente muda a representação da consulta
+    response = cliente.get(f'/api/consultas/{consulta_id}', headers=admin)
+    etag = response.headers['ETag']
+    cliente.put(f'/api/pacientes/{paciente_id}', headers=admin, json={'nome': 'Nome Novo'})
+    response = cliente.get(f'/api/consultas/{consulta_id}', headers={**admin, 'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.get_json()['consulta']['paciente_nome'] == 'Nome Novo'
+
+
+def test_compressao_negociada_com_limite_e_em_fluxo(cliente, admin):
+    """Respostas grandes saem comprimidas conforme Accept-Encoding; pequenas não; fluxos a cada lote"""
+    criar_consultas(30)
+    url = '/api/consultas?por_pagina=30'
+    original = cliente.get(url, headers=admin)
+    assert 'Content-Encoding' not in original.headers
+    assert 'Accept-Encoding' in original.headers['Vary']
+
+    response = cliente.get(url, headers={**admin, 'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert len(response.data) < len(original.data)
+    assert gzip.decompress(response.data) == original.data
+    # A ETag vira fraca e continua valendo para requisições condicionais
+    assert response.headers['ETag'] == f"W/{original.headers['ETag']}"
+    assert cliente.get(url, headers={**admin, 'Accept-Encoding': 'gzip',
+                                     'If-None-Match': response.headers['ETag']}).status_code == 304
+
+    if aplicacao.brotli is not None:
+        response = cliente.get(url, headers={**admin, 'Accept-Encoding': 'gzip, br'})
+        assert response.headers['Content-Encoding'] == 'br'
+        assert aplicacao.brotli.decompress(response.data) == original.data
+    assert cliente.get(url, headers={**admin, 'Accept-Encoding': 'br;q=0.5, gzip'}).headers['Content-Encoding'] == 'gzip'
+
+    # Abaixo do limite o corpo vai sem compressão
+    consulta_id = Consulta.query.first().id
+    response = cliente.get(f'/api/consultas/{consulta_id}', headers={**admin, 'Accept-Encoding': 'gzip'})
+    assert len(response.data) < app.config['COMPRESSAO_MINIMO_BYTES']
+    assert 'Content-Encoding' not in response.headers
+
+    # Exportação em fluxo: cada lote chega comprimido e decodificável antes do fim
+    aplicacao.EXPORTACAO_LOTE, lote_original = 10, aplicacao.EXPORTACAO_LOTE
+    try:
+        response = cliente.get('/api/consultas/buscar?formato=ndjson', buffered=False,
+                               headers={**admin, 'Accept-Encoding': 'gzip'})
+        assert response.is_streamed and response.headers['Content-Encoding'] == 'gzip'
+        descompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        pedacos = [descompressor.decompress(pedaco) for pedaco in response.response]
+        response.close()
+        assert pedacos[0].count(b'\n') == 10
+        assert b''.join(pedacos).count(b'\n') == 30
+    finally:
+        aplicacao.EXPORTACAO_LOTE = lote_original
+
+
+def test_cache_de_entidades_invalidado_nas_escritas(cliente, admin):
+    """Leituras repetidas vêm do cache e nenhuma escrita deixa um registro desatualizado nele"""
+    criar_consultas(1)
+    paciente_id = Paciente.query.first().id
+    medico_id = Usuario.query.filter_by(tipo_usuario='medico').first().id
+    cache = aplicacao.cache_entidades
+
+    cliente.get(f'/api/pacientes/{paciente_id}', headers=admin)
+    with ContadorSQL() as contador:
+        response = cliente.get(f'/api/pacientes/{paciente_id}', headers=admin)
+    assert response.status_code == 200
+    assert contador.total <= 1  # apenas a verificação do usuário autenticado, se houver
+    assert cache.estatisticas()['acertos'] >= 1
+
+    cliente.put(f'/api/pacientes/{paciente_id}', headers=admin, json={'nome': 'Nome Atualizado'})
+    assert cliente.get(f'/api/pacientes/{paciente_id}', headers=admin).get_json()['paciente']['nome'] == 'Nome Atualizado'
+
+    cliente.put(f'/api/usuarios/{medico_id}', headers=admin, json={'tipo_usuario': 'recepcionista'})
+    response = cliente.post('/api/consultas', headers=admin, json={
+        'paciente_id': paciente_id, 'medico_id': medico_id,
+        'data_consulta': '2024-03-01 10:00', 'tipo_consulta': 'Retorno'
+    })
+    assert response.status_code == 404
+
+    cliente.delete(f'/api/pacientes/{paciente_id}', headers=admin)
+    assert cliente.get(f'/api/pacientes/{paciente_id}', headers=admin).get_json()['paciente']['ativo'] is False
+    assert cliente.get('/api/pacientes/999999', headers=admin).status_code == 404
+
+    # O tamanho máximo é respeitado, descartando os registros menos usados
+    pequeno = aplicacao.CacheEntidades(tamanho_maximo=2, ttl=60)
+    for chave in range(3):
+        pequeno.obter(chave, lambda: chave)
+    assert pequeno.estatisticas()['itens'] == 2 and pequeno.estatisticas()['remocoes'] == 1
+
+
+def test_cache_de_entidades_recebe_invalidacoes_de_outros_processos(cliente, admin, monkeypatch):
+    """Escritas de outros processos (que não passam pelos eventos desta sessão) chegam ao
+    cache pela tabela cache_invalidacoes, lida no máximo uma vez por intervalo"""
+    criar_consultas(1)
+    paciente_id = Paciente.query.first().id
+    medico_id = Usuario.query.filter_by(tipo_usuario='medico').first().id
+    url = f'/api/pacientes/{paciente_id}'
+    sincronizacao = aplicacao.sincronizacao_cache
+    monkeypatch.setattr(sincronizacao, 'intervalo', 3600)
+    monkeypatch.setattr(sincronizacao, '_proxima', 0.0)
+    cliente.get(url, headers=admin)
+    cliente.get(f'/api/usuarios?ids={medico_id}', headers=admin)
+
+    def escrita_de_outro_processo(sql):
+        db.session.execute(text(sql))
+        db.session.commit()
+
+    escrita_de_outro_processo(f"UPDATE pacientes SET nome = 'Outro Processo' WHERE id = {paciente_id}")
+    escrita_de_outro_processo(f"UPDATE usuarios SET tipo_usuario = 'recepcionista' WHERE id = {medico_id}")
+    # Dentro do intervalo, os acertos não consultam o banco
+    with ContadorSQL() as contador:
+        assert cliente.get(url, headers=admin).get_json()['paciente']['nome'] == 'Paciente 0'
+    assert contador.total <= 1  # apenas a verificação do usuário autenticado, se houver
+
+    # Ao agendar, paciente e médico são lidos do banco, não do cache
+    response = cliente.post('/api/consultas', headers=admin, json={
+        'paciente_id': paciente_id, 'medico_id': medico_id,
+        'data_consulta': '2024-03-01 10:00', 'tipo_consulta': 'Retorno'
+    })
+    assert response.status_code == 404
+
+    # Vencido o intervalo, as invalidações registradas são aplicadas
+    monkeypatch.setattr(sincronizacao, '_proxima', 0.0)
+    assert cliente.get(url, headers=admin).get_json()['paciente']['nome'] == 'Outro Processo'
+    dados = cliente.get(f'/api/usuarios?ids={medico_id}', headers=admin).get_json()
+    assert dados['usuarios'][0]['tipo_usuario'] == 'recepcionista'
+
+    # Um processo que ficou para trás das invalidações mantidas limpa o cache inteiro
+    ultimo = sincronizacao._ultimo
+    assert sincronizacao.verificar_faixa(ultimo + 5, ultimo + 9) is None
+    assert aplicacao.cache_entidades.estatisticas()['itens'] == 0 and sincronizacao._ultimo == ultimo + 9
+
+
+def test_serializadores_compilados_equivalem_ao_to_dict(cliente, admin, monkeypatch):
+    """As listagens usam serializadores compilados com a mesma saída JSON do to_dict()"""
+    criar_consultas(3)
+    casos = [
+        ('/api/consultas?por_pagina=100', 'consultas', Consulta),
+        ('/api/pacientes', 'pacientes', Paciente),
+        ('/api/usuarios', 'usuarios', Usuario),
+    ]
+    for usar_orjson in (True, False):
+        if not usar_orjson:
+            monkeypatch.setattr(aplicacao, 'orjson', None)
+        for url, chave, modelo in casos:
+            response = cliente.get(url, headers=admin)
+            esperado = [item.to_dict() for item in modelo.query.order_by(modelo.id)]
+            assert sorted(response.get_json()[chave], key=lambda item: item['id']) == esperado
+
+
+def test_campos_parciais_projetam_colunas_no_sql(cliente, admin):
+    """?campos= limita o SELECT às colunas pedidas e só faz JOIN para os nomes pedidos"""
+    criar_consultas(5)
+    db.session.expunge_all()
+    comandos = []
+
+    def capturar(conn, cursor, statement, *args):
+        comandos.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', capturar)
+    try:
+        response = cliente.get('/api/consultas?cursor=&limite=3&campos=id,data_consulta', headers=admin)
+        assert [set(c) for c in response.get_json()['consultas']] == [{'id', 'data_consulta'}] * 3
+        assert len(comandos) == 1
+        assert 'observacoes' not in comandos[0] and 'JOIN' not in comandos[0]
+        # O cursor da próxima página continua válido com a projeção
+        cursor = response.get_json()['paginacao']['proxima_cursor']
+        response = cliente.get(f'/api/consultas?cursor={cursor}&limite=3&campos=id,data_consulta', headers=admin)
+        assert len(response.get_json()['consultas']) == 2
+
+        comandos.clear()
+        response = cliente.get('/api/consultas/buscar?campos=id,paciente_nome', headers=admin)
+        assert response.get_json()['consultas'][0] == {'id': 1, 'paciente_nome': 'Paciente 0'}
+        assert len(comandos) == 1
+        assert 'JOIN pacientes' in comandos[0] and 'usuarios' not in comandos[0]
+
+        comandos.clear()
+        response = cliente.get('/api/pacientes/buscar?q=Paciente&campos=nome', headers=admin)
+        assert response.get_json()['pacientes'][0] == {'nome': 'Paciente 0'}
+        assert 'data_nascimento' not in comandos[-1]
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', capturar)
+
+    # Campos diferentes são representações diferentes (ETags distintas)
+    completa = cliente.get('/api/consultas/1', headers=admin)
+    parcial = cliente.get('/api/consultas/1?campos=status', headers=admin)
+    assert parcial.get_json() == {'consulta': {'status': 'agendada'}}
+    assert parcial.headers['ETag'] != completa.headers['ETag']
+    assert cliente.get('/api/consultas/1?campos=status',
+                       headers={**admin, 'If-None-Match': parcial.headers['ETag']}).status_code == 304
+    assert cliente.get('/api/pacientes/1?campos=nome,cpf', headers=admin).get_json() == {
+        'paciente': {'nome': 'Paciente 0', 'cpf': '00000000000'}}
+
+    response = cliente.get('/api/consultas?campos=id,senha', headers=admin)
+    assert response.status_code == 400 and 'senha' in response.get_json()['erro']
+
+
+def test_leituras_em_lote_por_ids_e_multiplexadas(cliente, admin):
+    """?ids= resolve vários registros em um único SELECT ... IN; /api/lote junta vários GETs"""
+    criar_consultas(5)
+    db.session.expunge_all()
+
+    with ContadorSQL() as contador:
+        response = cliente.get('/api/pacientes?ids=3,1,99,3', headers=admin)
+    assert [p['id'] for p in response.get_json()['pacientes']] == [3, 1]
+    assert response.get_json()['nao_encontrados'] == [99]
+    assert contador.total == 1
+    # Agora os pacientes vêm do cache de entidades
+    with ContadorSQL() as contador:
+        cliente.get('/api/pacientes?ids=1,3', headers=admin)
+    assert contador.total == 0
+
+    with ContadorSQL() as contador:
+        response = cliente.get('/api/consultas?ids=5,2&campos=id,medico_nome', headers=admin)
+    assert response.get_json()['consultas'] == [{'id': 5, 'medico_nome': 'Médico 4'},
+                                                {'id': 2, 'medico_nome': 'Médico 1'}]
+    assert contador.total == 1
+    assert cliente.get('/api/usuarios?ids=1,x', headers=admin).status_code == 400
+    ids = ','.join(str(i) for i in range(app.config['LOTE_MAXIMO_IDS'] + 1))
+    assert cliente.get(f'/api/usuarios?ids={ids}', headers=admin).status_code == 400
+
+    response = cliente.post('/api/lote', headers=admin, json={'requisicoes': [
+        '/api/pacientes/2?campos=nome',
+        '/api/consultas?ids=1,2&campos=status',
+        '/api/usuarios?ids=abc',
+        '/api/lote',
+        '/api/inexistente',
+        '/api/pacientes?formato=ndjson',
+        '/api/health',
+    ]})
+    respostas = response.get_json()['respostas']
+    assert response.status_code == 200
+    assert [r['status'] for r in respostas] == [200, 200, 400, 405, 404, 400, 400]
+    assert respostas[5]['corpo'] == {'erro': 'Exportações não são aceitas no lote'}
+    assert respostas[0]['corpo'] == {'paciente': {'nome': 'Paciente 1'}}
+    assert respostas[1]['corpo']['consultas'] == [{'status': 'agendada'}] * 2
+
+    assert cliente.post('/api/lote', headers=admin, json={'requisicoes': []}).status_code == 400
+    assert cliente.post('/api/lote', json={'requisicoes': ['/api/pacientes/1']}).status_code == 401
+
+
+def test_status_em_lote_com_um_unico_update(cliente, admin):
+    """PUT /api/consultas/status-lote valida e aplica as transições com um SELECT e um UPDATE"""
+    criar_consultas(5)
+    cliente.put('/api/consultas/3', headers=admin, json={'status': 'cancelada'})
+    cliente.get('/api/consultas/1', headers=admin)  # preenche o cache de autorização
+
+    with ContadorSQL() as contador:
+        response = cliente.put('/api/consultas/status-lote', headers=admin,
+                               json={'ids': [1, 2, 3, 99, 2], 'status': 'realizada'})
+    assert response.status_code == 200
+    assert response.get_json()['atualizadas'] == 2
+    assert response.get_json()['resultados'] == [
+        {'id': 1, 'resultado': 'atualizada'},
+        {'id': 2, 'resultado': 'atualizada'},
+        {'id': 3, 'resultado': 'transicao_invalida', 'status_atual': 'cancelada'},
+        {'id': 99, 'resultado': 'nao_encontrada'},
+    ]
+    comandos = [c for c in contador.comandos if not c.startswith(('BEGIN', 'COMMIT'))]
+    assert len(comandos) == 2 and comandos[1].startswith('UPDATE consultas')
+
+    db.session.expire_all()
+    assert [c.status for c in Consulta.query.order_by(Consulta.id)] == [
+        'realizada', 'realizada', 'cancelada', 'agendada', 'agendada']
+    assert aplicacao.verificar_resumo_agenda() == []
+    response = cliente.put('/api/consultas/status-lote', headers=admin, json={'ids': [1], 'status': 'realizada'})
+    assert response.get_json()['resultados'] == [{'id': 1, 'resultado': 'inalterada'}]
+
+    # Recepcionistas seguem a regra do PUT individual
+    db.session.add(Usuario(nome='Recepção', email='recepcao@teste.com',
+                           senha_hash=gerar_hash_senha('123456'), tipo_usuario='recepcionista'))
+    db.session.commit()
+    token = cliente.post('/api/auth/login', json={'email': 'recepcao@teste.com', 'senha': '123456'})
+    recepcao = {'Authorization': f"Bearer {token.get_json()['access_token']}"}
+    response = cliente.put('/api/consultas/status-lote', headers=recepcao, json={'ids': [4], 'status': 'cancelada'})
+    assert response.get_json()['resultados'] == [{'id': 4, 'resultado': 'sem_permissao'}]
+
+    for corpo in [{'ids': [4], 'status': 'agendada'}, {'ids': [], 'status': 'cancelada'},
+                  {'ids': ['4'], 'status': 'cancelada'}]:
+        assert cliente.put('/api/consultas/status-lote', headers=admin, json=corpo).status_code == 400
+
+
+def test_sqlite_em_wal_nao_bloqueia_leituras_e_repete_escritas(tmp_path):
+    """Com o perfil de produção, leituras seguem durante uma escrita longa e uma segunda
+    escrita espera o bloqueio (busy_timeout + novas tentativas) em vez de falhar"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'wal.db'}")
+    pragmas = {**ProductionConfig.SQLITE_PRAGMAS, 'busy_timeout': 50}
+    aplicacao.configurar_sqlite(engine, pragmas, tentativas=6, espera=0.05)
+    with engine.begin() as conexao:
+        assert conexao.execute(text('PRAGMA journal_mode')).scalar() == 'wal'
+        conexao.execute(text('CREATE TABLE itens (id INTEGER PRIMARY KEY, valor TEXT)'))
+        conexao.execute(text("INSERT INTO itens (valor) VALUES ('a')"))
+
+    escrita_aberta = threading.Event()
+    resultados = {}
+
+    def escrita_longa():
+        with app.test_request_context(method='POST'), engine.begin() as conexao:
+            conexao.execute(text("INSERT INTO itens (valor) VALUES ('b')"))
+            escrita_aberta.set()
+            time.sleep(0.5)
+
+    def segunda_escrita():
+        with app.test_request_context(method='POST'), engine.begin() as conexao:
+            conexao.execute(text("INSERT INTO itens (valor) VALUES ('c')"))
+        resultados['segunda_escrita'] = time.perf_counter() - inicio
+
+    escritor = threading.Thread(target=escrita_longa)
+    escritor.start()
+    assert escrita_aberta.wait(5)
+    inicio = time.perf_counter()
+    concorrente = threading.Thread(target=segunda_escrita)
+    concorrente.start()
+
+    with engine.connect() as conexao:
+        total = conexao.execute(text('SELECT COUNT(*) FROM itens')).scalar()
+    tempo_leitura = time.perf_counter() - inicio
+
+    escritor.join()
+    concorrente.join()
+    assert total == 1  # a leitura vê o último commit, sem esperar a escrita em andamento
+    assert tempo_leitura < 0.25
+    assert resultados['segunda_escrita'] >= 0.3  # esperou o fim da primeira escrita
+    with engine.connect() as conexao:
+        assert conexao.execute(text('SELECT COUNT(*) FROM itens')).scalar() == 3
+    engine.dispose()
+
+    # Só reservam o banco no BEGIN as requisições que escrevem
+    for caminho, metodo, modo in [('/api/consultas/1', 'PUT', 'IMMEDIATE'),
+                                  ('/api/auth/login', 'POST', 'DEFERRED'),
+                                  ('/api/lote', 'POST', 'DEFERRED'),
+                                  ('/api/consultas', 'GET', 'DEFERRED')]:
+        with app.test_request_context(caminho, method=metodo):
+            assert aplicacao.modo_transacao() == modo
+
+
+class PlanosSQL:
+    """Registra o EXPLAIN QUERY PLAN de cada SELECT executado enquanto ativo"""
+
+    def __init__(self):
+        self.planos = []
+
+    def _registrar(self, conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT') and not executemany:
+            linhas = cursor.connection.execute(f'EXPLAIN QUERY PLAN {statement}', parameters).fetchall()
+            self.planos.append((statement, [linha[-1] for linha in linhas]))
+
+    def varreduras_completas(self):
+        """Passos 'SCAN <tabela>' sem índice sobre tabelas do modelo"""
+        tabelas = set(db.metadata.tables)
+        return [
+            (statement, passo)
+            for statement, passos in self.planos
+            for passo in passos
+            if passo.startswith('SCAN ') and passo.split()[1] in tabelas and ' USING ' not in passo
+        ]
+
+    def __enter__(self):
+        event.listen(db.engine, 'before_cursor_execute', self._registrar)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(db.engine, 'before_cursor_execute', self._registrar)
+
+
+@pytest.mark.parametrize('url', [
+    '/api/usuarios',
+    '/api/usuarios?tipo_usuario=medico',
+    '/api/usuarios?cursor=&limite=5',
+    '/api/pacientes',
+    '/api/pacientes?cursor=&limite=5',
+    '/api/pacientes/buscar?q=Paciente',
+    '/api/pacientes/buscar?q=000',
+    '/api/consultas',
+    '/api/consultas?cursor=&limite=5',
+    '/api/consultas?cursor=&limite=5&campos=id,data_consulta',
+    '/api/consultas/buscar?status=agendada',
+    '/api/consultas/buscar?medico_id=2',
+    '/api/consultas/buscar?data_inicio=2024-01-01&data_fim=2024-01-02',
+    '/api/consultas/resumo?data_inicio=2024-01-01&data_fim=2024-01-31',
+    '/api/medicos/2/horarios-livres?dia=2024-01-01',
+])
+def test_listagens_e_buscas_usam_indices(cliente, admin, url):
+    """Nenhuma listagem ou busca pode recorrer a uma varredura completa de tabela"""
+    criar_consultas(5)
+    with PlanosSQL() as planos:
+        response = cliente.get(url, headers=admin)
+    assert response.status_code == 200
+    assert planos.planos
+    assert planos.varreduras_completas() == []
+
+
+def test_metricas_por_rota_e_consultas_lentas(cliente, admin, caplog, monkeypatch):
+    """/api/metrics expõe latência, status e SQL por rota e registra comandos SQL lentos"""
+    aplicacao.metricas.limpar()
+    criar_consultas(3)
+    for _ in range(2):
+        cliente.get('/api/consultas', headers=admin)
+    cliente.get('/api/pacientes/999999', headers=admin)
+
+    monkeypatch.setitem(app.config, 'CONSULTA_LENTA_MS', 0)
+    with caplog.at_level('WARNING', logger='consultorio.sql'):
+        cliente.get('/api/pacientes', headers=admin)
+    assert any('Comando SQL lento' in registro.message for registro in caplog.records)
+
+    response = cliente.get('/api/metrics')
+    assert response.status_code == 200 and response.mimetype == 'text/plain'
+    texto = response.get_data(as_text=True)
+    rotulos = 'endpoint="/api/consultas",metodo="GET"'
+    assert f'consultorio_requisicoes_total{{{rotulos},status="200"}} 2' in texto
+    assert f'consultorio_requisicao_duracao_segundos_bucket{{{rotulos},le="+Inf"}} 2' in texto
+    assert f'consultorio_requisicao_duracao_segundos_count{{{rotulos}}} 2' in texto
+    assert 'status="404"} 1' in texto
+    comandos = next(linha for linha in texto.splitlines()
+                    if linha.startswith(f'consultorio_sql_comandos_total{{{rotulos}}}'))
+    assert int(comandos.split()[-1]) >= 4  # listagem e contagem em cada requisição
+    assert 'consultorio_sql_lentos_total 0' not in texto
+
+    # Um comando que falha não deixa o início registrado na conexão
+    with app.app_context():
+        with pytest.raises(aplicacao.OperationalError):
+            db.session.execute(text('SELECT * FROM tabela_inexistente'))
+        assert 'inicio_comando' not in db.session.connection().info
+        db.session.rollback()
+
+
+def test_geracao_em_escala(cliente):
+    """init_db --escala gera CPFs válidos e distintos, agenda sem conflitos e recria índices e resumo"""
+    import init_db
+
+    assert init_db.criar_dados_em_escala(2000, pacientes=500, medicos=5)
+    assert (Usuario.query.count(), Paciente.query.count(), Consulta.query.count()) == (5, 500, 2000)
+
+    cpfs = [paciente.cpf for paciente in Paciente.query]
+    assert validar_cpfs(cpfs).all() and len(set(cpfs)) == 500
+    assert db.session.execute(text(
+        'SELECT COUNT(*) FROM (SELECT 1 FROM consultas GROUP BY medico_id, data_consulta HAVING COUNT(*) > 1)'
+    )).scalar() == 0
+    assert aplicacao.verificar_resumo_agenda() == []
+    assert db.session.execute(text('SELECT COUNT(*) FROM pacientes_busca')).scalar() == 500
+    indices = {linha[0] for linha in db.session.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'"))}
+    assert {'idx_consultas_medico_data', 'idx_pacientes_ativos'} <= indices
+
+    # Os dados gerados são lidos normalmente pelo ORM
+    assert Consulta.query.first().to_dict()['paciente_nome']
+
+
+def test_modo_assincrono_responde_como_a_aplicacao_wsgi(tmp_path):
+    """As rotas assíncronas (asgi.py) devolvem o mesmo conteúdo das rotas síncronas e as
+    demais rotas são atendidas pela aplicação WSGI"""
+    import asyncio
+    from sqlalchemy.orm import Session
+    from flask_jwt_extended import create_access_token
+    import asgi
+
+    arquivo = tmp_path / 'assincrono.db'
+    engine = create_engine(f'sqlite:///{arquivo}')
+    db.metadata.create_all(engine)
+    with Session(engine) as sessao:
+        medico = Usuario(nome='Dra. Async', email='async@teste.com', senha_hash='x', tipo_usuario='medico')
+        pacientes = [Paciente(nome=f'Paciente {i}', cpf=f'{i:011d}', data_nascimento=datetime(1990, 1, 1).date())
+                     for i in range(3)]
+        sessao.add_all([medico, *pacientes])
+        sessao.flush()
+        sessao.add_all([Consulta(paciente_id=paciente.id, medico_id=medico.id, tipo_consulta='Retorno',
+                                 data_consulta=datetime(2024, 1, 1, 8 + i)) for i, paciente in enumerate(pacientes)])
+        sessao.commit()
+        esperado = [consulta.to_dict() for consulta in sessao.query(Consulta).order_by(Consulta.id)]
+        pacientes_esperados = [paciente.to_dict() for paciente in pacientes]
+        paciente_esperado = pacientes_esperados[0]
+        medico_esperado = medico.to_dict()
+    engine.dispose()
+
+    aplicacao.cache_entidades.limpar()
+    with app.app_context():
+        cabecalhos = {'Authorization': f"Bearer {create_access_token(identity='1')}"}
+
+    async def executar():
+        aplicacao_asgi = asgi.AplicacaoAssincrona(f'sqlite+aiosqlite:///{arquivo}')
+        try:
+            respostas = await asyncio.gather(*[
+                asgi.chamar(aplicacao_asgi, 'GET', f"/api/consultas/{consulta['id']}", cabecalhos)
+                for consulta in esperado
+            ])
+            assert [json.loads(corpo)['consulta'] for _, _, corpo in respostas] == esperado
+
+            status, _, corpo = await asgi.chamar(aplicacao_asgi, 'GET', '/api/consultas?por_pagina=2', cabecalhos)
+            dados = json.loads(corpo)
+            assert status == 200 and dados['consultas'] == esperado[:2]
+            assert dados['paginacao']['total_itens'] == 3 and dados['paginacao']['tem_proxima']
+
+            status, cabecalhos_resposta, corpo = await asgi.chamar(
+                aplicacao_asgi, 'GET', '/api/consultas?cursor=&limite=2', cabecalhos)
+            proxima = json.loads(corpo)['paginacao']['proxima_cursor']
+            _, _, corpo = await asgi.chamar(aplicacao_asgi, 'GET', f'/api/consultas?cursor={proxima}', cabecalhos)
+            assert json.loads(corpo)['consultas'] == esperado[2:]
+
+            status, _, _ = await asgi.chamar(aplicacao_asgi, 'GET', '/api/consultas?cursor=&limite=2',
+                                             {**cabecalhos, 'If-None-Match': cabecalhos_resposta['etag']})
+            assert status == 304
+
+            # Busca em lote por ids, na ordem pedida e com os ids inexistentes
+            ids = [esperado[2]['id'], 999, esperado[0]['id']]
+            status, _, corpo = await asgi.chamar(
+                aplicacao_asgi, 'GET', f"/api/consultas?ids={','.join(map(str, ids))}", cabecalhos)
+            dados = json.loads(corpo)
+            assert status == 200 and dados['consultas'] == [esperado[2], esperado[0]]
+            assert dados['nao_encontrados'] == [999]
+            assert (await asgi.chamar(aplicacao_asgi, 'GET', '/api/consultas?ids=a', cabecalhos))[0] == 400
+
+            status, _, corpo = await asgi.chamar(aplicacao_asgi, 'GET', f"/api/pacientes/{paciente_esperado['id']}", cabecalhos)
+            assert status == 200 and json.loads(corpo)['paciente'] == paciente_esperado
+            assert (await asgi.chamar(aplicacao_asgi, 'GET', '/api/consultas/999', cabecalhos))[0] == 404
+
+            # Demais rotas de leitura, com o mesmo código das rotas síncronas
+            status, _, corpo = await asgi.chamar(aplicacao_asgi, 'GET', '/api/pacientes?por_pagina=2', cabecalhos)
+            dados = json.loads(corpo)
+            assert status == 200 and dados['pacientes'] == pacientes_esperados[:2]
+            assert dados['paginacao']['total_itens'] == 3
+            _, _, corpo = await asgi.chamar(aplicacao_asgi, 'GET', '/api/pacientes/buscar?q=pacien', cabecalhos)
+            assert json.loads(corpo)['pacientes'] == pacientes_esperados
+            _, _, corpo = await asgi.chamar(aplicacao_asgi, 'GET', '/api/pacientes/buscar?q=000.000.000-01', cabecalhos)
+            assert json.loads(corpo)['pacientes'] == pacientes_esperados[1:2]
+            assert (await asgi.chamar(aplicacao_asgi, 'GET', '/api/pacientes/buscar', cabecalhos))[0] == 400
+            status, _, corpo = await asgi.chamar(aplicacao_asgi, 'GET', f"/api/usuarios/{medico_esperado['id']}", cabecalhos)
+            assert status == 200 and json.loads(corpo)['usuario'] == medico_esperado
+            _, _, corpo = await asgi.chamar(aplicacao_asgi, 'GET', '/api/usuarios?tipo_usuario=medico', cabecalhos)
+            assert json.loads(corpo)['usuarios'] == [medico_esperado]
+            status, _, corpo = await asgi.chamar(
+                aplicacao_asgi, 'GET', '/api/consultas/buscar?data_inicio=2024-01-01&data_fim=2024-01-01', cabecalhos)
+            assert status == 200 and json.loads(corpo)['consultas'] == esperado
+            assert (await asgi.chamar(aplicacao_asgi, 'GET', '/api/consultas/buscar?status=x', cabecalhos))[0] == 400
+            assert (await asgi.chamar(aplicacao_asgi, 'GET', '/api/consultas/1'))[0] == 401
+
+            # Rotas sem versão assíncrona são atendidas pela aplicação WSGI
+            status, _, corpo = await asgi.chamar(aplicacao_asgi, 'GET', '/api/health')
+            assert status == 200 and json.loads(corpo)['status'] == 'OK'
+            status, cabecalhos_resposta, _ = await asgi.chamar(
+                aplicacao_asgi, 'GET', '/api/consultas/buscar?formato=ndjson', cabecalhos)
+            assert status == 200 and cabecalhos_resposta['content-type'] == 'application/x-ndjson'
+        finally:
+            await aplicacao_asgi.engine.dispose()
+
+    asyncio.run(executar())